@@ -8,14 +8,24 @@ JWT authentication, and comprehensive user management.
 from flask import Flask, jsonify, request
 from flask_cors import CORS
 from dotenv import load_dotenv
+import hmac
 import os
 
 # Load environment variables
 load_dotenv()
 
 # Import blueprints
-from routes.auth import auth_bp
+from routes.auth import auth_bp, stateless_otp
 from routes.dashboard import dashboard_bp
+from utils.db import WRITE_LSN_HEADER, db_pool, init_read_your_writes, init_unit_of_work, user_bloom, user_cache
+from utils.query_stats import query_stats
+from utils.account_numbers import account_numbers
+from utils.hashing import hashing_executor
+from utils.security import token_cache
+from utils.revocation import revoked_tokens
+from utils.entropy import entropy_pool
+from utils.otp_store import otp_store
+from utils.expiry import expiry_purger
 
 def create_app():
     """Create and configure Flask application"""
@@ -29,10 +39,18 @@ def create_app():
     CORS(app, 
          resources={r"/api/*": {"origins": "*"}},
          supports_credentials=True,
-         allow_headers=["Content-Type", "Authorization"],
+         allow_headers=["Content-Type", "Authorization", WRITE_LSN_HEADER],
+         expose_headers=[WRITE_LSN_HEADER],
          methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"]
     )
     
+    # Read-your-writes across workers when reads go to replicas; registered
+    # first so its after_request hook runs after the commit
+    init_read_your_writes(app)
+    
+    # One pinned connection and transaction per request
+    init_unit_of_work(app)
+    
     # Register blueprints
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
     app.register_blueprint(dashboard_bp, url_prefix='/api/dashboard')
@@ -60,6 +78,7 @@ def create_app():
                 'quantum_otp': 'active',
                 'authentication': 'ready'
             },
+            'database_pool': db_pool.stats(),
             'endpoints': {
                 'auth': {
                     'register': '/api/auth/register',
@@ -75,6 +94,37 @@ def create_app():
             }
         })
     
+    @app.route('/api/metrics/db')
+    def db_metrics():
+        """
+        Backend metrics for scraping (database pool, queries, caches and hashing)
+        
+        Requests must send METRICS_TOKEN as a Bearer token. Without a
+        METRICS_TOKEN the endpoint does not exist: query statistics carry
+        statement parameters and EXPLAIN plans with literals in them.
+        """
+        metrics_token = os.getenv('METRICS_TOKEN')
+        if not metrics_token:
+            return jsonify({'error': 'Endpoint not found'}), 404
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {metrics_token}"):
+            return jsonify({'error': 'Unauthorized'}), 401
+        
+        return jsonify({
+            'pool': db_pool.stats(),
+            'replicas': db_pool.replica_stats(),
+            'queries': query_stats.snapshot(),
+            'user_cache': user_cache.stats(),
+            'user_bloom': user_bloom.stats(),
+            'account_numbers': account_numbers.stats(),
+            'hashing': hashing_executor.stats(),
+            'token_cache': token_cache.stats(),
+            'revoked_tokens': revoked_tokens.stats(),
+            'otp_entropy': entropy_pool.stats(),
+            'stateless_otp': stateless_otp.stats() if stateless_otp else None,
+            'otp_store': otp_store.stats(),
+            'expiry': expiry_purger.stats()
+        })
+    
     # Error handlers
     @app.errorhandler(404)
     def not_found(error):
@@ -116,7 +166,7 @@ def validate_environment():
         return False
     
     # Check other required vars
-    required_vars = ['SMTP_EMAIL', 'SMTP_PASSWORD', 'JWT_SECRET']
+    required_vars = ['SMTP_EMAIL', 'SMTP_PASSWORD', 'JWT_SECRET', 'ACCOUNT_NUMBER_KEY']
     missing_vars = [var for var in required_vars if not os.getenv(var)]
     
     if missing_vars:
@@ -0,0 +1,56 @@
+"""
+Gunicorn server hooks for the Quantum Banking backend
+
+Gunicorn loads this file automatically when started from the backend
+directory (Procfile, render.yaml, Dockerfile). Command-line flags still
+take precedence over anything set here.
+"""
+
+import os
+
+# OTP coordinator process (OTP_STORE=memory), shared by every worker
+otp_coordinator = None
+
+
+def on_starting(server):
+    """Calibrate the bcrypt cost once and start the shared OTP store"""
+    global otp_coordinator
+
+    if os.getenv('BCRYPT_LATENCY_BUDGET_MS') and not os.getenv('BCRYPT_ROUNDS'):
+        from utils.security import bcrypt_rounds
+
+        os.environ['BCRYPT_ROUNDS'] = str(bcrypt_rounds())
+        server.log.info(f"bcrypt cost calibrated to {os.environ['BCRYPT_ROUNDS']}")
+
+    if os.getenv('OTP_STORE', 'postgres').lower() == 'memory' and not os.getenv('OTP_STORE_ADDRESS'):
+        from utils.otp_store import start_otp_coordinator
+
+        otp_coordinator = start_otp_coordinator()
+        server.log.info(f"OTP coordinator started (pid {otp_coordinator.pid})")
+
+
+def on_exit(server):
+    """Stop the OTP coordinator with the master"""
+    if otp_coordinator is not None:
+        otp_coordinator.terminate()
+        otp_coordinator.wait(timeout=5)
+
+
+def post_worker_init(worker):
+    """Open the worker's pooled connections, build its lookup filters and start its background jobs"""
+    from utils.account_numbers import account_numbers
+    from utils.db import db_pool, user_bloom
+    from utils.entropy import PrefetchingEntropyPool, entropy_pool
+    from utils.expiry import expiry_purger
+    from utils.revocation import revoked_tokens
+
+    opened = db_pool.warm_up()
+    worker.log.info(f"Database pool warmed up with {opened} connection(s)")
+    if user_bloom.enabled:
+        user_bloom.build()
+        user_bloom.start()
+    if isinstance(entropy_pool, PrefetchingEntropyPool):
+        entropy_pool.start()
+    expiry_purger.start()
+    revoked_tokens.start()
+    account_numbers.start()
@@ -4,21 +4,109 @@ Authentication routes for registration, login, and OTP verification
 from flask import Blueprint, request, jsonify
 from datetime import datetime, timedelta
 import os
+import threading
 
 from utils.db import (
-    get_user_by_account, get_user_by_email, create_user, 
-    store_otp, get_valid_otp, mark_otp_used, count_recent_otps
+    after_commit, get_user_by_account, register_user, update_password_hash,
+    redeem_otp_ticket
 )
 from utils.security import (
-    hash_password, verify_password, generate_jwt_token,
+    hash_password, verify_password, password_needs_rehash, rehash_password_async,
+    generate_jwt_token, token_required,
     validate_email, validate_account_number, validate_password
 )
 from utils.mailer import send_otp_email, send_welcome_email
-from utils.quantum_otp import generate_otp
+from utils.account_numbers import account_numbers
+from utils.hashing import HashingOverloadedError
+from utils.otp_store import otp_store
+from utils.revocation import revoke
+from utils.validation import Field, Schema, validate_json
+from utils.quantum_otp import StatelessOTP, generate_otp
 
 auth_bp = Blueprint('auth', __name__)
 
+# OTP rate limit: at most OTP_RATE_LIMIT codes per OTP_RATE_WINDOW_HOURS
+OTP_RATE_LIMIT = 3
+OTP_RATE_WINDOW_HOURS = 1
+
+# OTP_MODE=stateless derives codes from a key and a per-login ticket instead
+# of storing them in otps; the rate limit is then kept per worker process.
+# Anyone holding the key can compute codes, so there is no default key.
+OTP_MODE = os.getenv('OTP_MODE', 'table').lower()
+stateless_otp = None
+if OTP_MODE == 'stateless':
+    _otp_secret = os.getenv('OTP_SECRET') or os.getenv('JWT_SECRET')
+    if not _otp_secret:
+        raise RuntimeError("OTP_MODE=stateless requires OTP_SECRET (or JWT_SECRET) to be set")
+    stateless_otp = StatelessOTP(
+        key=_otp_secret.encode(),
+        window_seconds=int(os.getenv('OTP_WINDOW_SECONDS', '300')),
+        redeem=redeem_otp_ticket,
+        max_issues=OTP_RATE_LIMIT,
+        issue_window_seconds=OTP_RATE_WINDOW_HOURS * 3600,
+    )
+
+# Request bodies, validated before any database or bcrypt work
+ACCOUNT_NUMBER = Field(label='Account number', check=validate_account_number,
+                       message='Account number must be 10 digits')
+
+REGISTER_SCHEMA = Schema(
+    name=Field(label='Name', min_length=2, max_length=100,
+               message='Name must be 2 to 100 characters long'),
+    email=Field(label='Email', lower=True, max_length=255, check=validate_email,
+                message='Invalid email format'),
+    password=Field(label='Password', strip=False, max_length=1024, check=validate_password,
+                   message='Password must be at least 8 characters long'),
+)
+LOGIN_SCHEMA = Schema(
+    account_number=ACCOUNT_NUMBER,
+    password=Field(label='Password', strip=False, max_length=1024),
+)
+VERIFY_OTP_SCHEMA = Schema(
+    account_number=ACCOUNT_NUMBER,
+    otp=Field(label='OTP', check=lambda otp: otp.isdigit() and len(otp) == 6,
+              message='OTP must be 6 digits'),
+    otp_ticket=Field(label='OTP ticket', required=False, max_length=32),
+)
+RESEND_OTP_SCHEMA = Schema(account_number=ACCOUNT_NUMBER)
+
+# Fresh account numbers tried when the insert hits an existing one
+REGISTER_ATTEMPTS = 3
+
+def _send_welcome_email(email, name, account_number):
+    """Send the welcome email, logging instead of raising"""
+    try:
+        print(f"📧 Sending welcome email to {email}...")
+        result = send_welcome_email(email, name, account_number)
+        if result:
+            print(f"✅ Welcome email sent successfully to {email}")
+        else:
+            print(f"⚠️ Welcome email function returned False for {email}")
+    except Exception as e:
+        import traceback
+        print(f"❌ Failed to send welcome email: {e}")
+        print(f"❌ Traceback: {traceback.format_exc()}")
+
+def _send_otp_email(email, otp_code):
+    """Send an OTP email, logging instead of raising"""
+    try:
+        print(f"🔄 Background thread started for sending OTP to {email}")
+        result = send_otp_email(email, otp_code)
+        if result:
+            print(f"✅ Background email thread completed successfully")
+        else:
+            print(f"⚠️ Background email thread completed but email sending returned False")
+    except Exception as e:
+        import traceback
+        print(f"❌ Background email thread error: {str(e)}")
+        print(f"❌ Traceback: {traceback.format_exc()}")
+
+def _send_otp_email_after_commit(email, otp_code):
+    """Mail an OTP in the background once the request's writes are committed"""
+    after_commit(lambda: threading.Thread(target=_send_otp_email, args=(email, otp_code)).start())
+
 @auth_bp.route('/register', methods=['POST'])
+@validate_json(REGISTER_SCHEMA)
 def register():
     """
     Register a new user
@@ -35,64 +123,42 @@ def register():
         JSON response with success/error status
     """
     try:
-        data = request.get_json()
-        
-        # Validate required fields (removed account_number requirement)
-        required_fields = ['name', 'email', 'password']
-        for field in required_fields:
-            if not data.get(field):
-                return jsonify({'error': f'{field} is required'}), 400
-        
-        name = data['name'].strip()
-        email = data['email'].strip().lower()
+        data = request.validated
+        name = data['name']
+        email = data['email']
         password = data['password']
         
-        # Validate input formats
-        if not validate_email(email):
-            return jsonify({'error': 'Invalid email format'}), 400
-        
-        if not validate_password(password):
-            return jsonify({'error': 'Password must be at least 8 characters long'}), 400
-        
-        if len(name) < 2:
-            return jsonify({'error': 'Name must be at least 2 characters long'}), 400
-        
-        # Check if email already exists
-        existing_email = get_user_by_email(email)
-        if existing_email:
-            return jsonify({'error': 'Email already registered'}), 400
+        # Hash password
+        password_hash = hash_password(password)
         
-        # Auto-generate unique account number
-        import random
-        while True:
-            account_number = ''.join([str(random.randint(0, 9)) for _ in range(10)])
-            if not get_user_by_account(account_number):
+        # Create user; the insert itself reports a taken email or account
+        # number, so there is no separate existence check to race with
+        for _ in range(REGISTER_ATTEMPTS):
+            account_number = account_numbers.allocate()
+            user, conflict = register_user(name, account_number, email, password_hash)
+            if conflict != 'account_number':
                 break
         
-        # Hash password
-        password_hash = hash_password(password)
+        if conflict == 'email':
+            return jsonify({'error': 'Email already registered'}), 400
         
-        # Create user
-        create_user(name, account_number, email, password_hash)
+        if user is None:
+            return jsonify({'error': 'Could not allocate an account number, please try again'}), 503
         
         # Send welcome email (optional, doesn't affect registration success)
-        try:
-            print(f"📧 Sending welcome email to {email}...")
-            result = send_welcome_email(email, name, account_number)
-            if result:
-                print(f"✅ Welcome email sent successfully to {email}")
-            else:
-                print(f"⚠️ Welcome email function returned False for {email}")
-        except Exception as e:
-            import traceback
-            print(f"❌ Failed to send welcome email: {e}")
-            print(f"❌ Traceback: {traceback.format_exc()}")
+        # once the new user is committed, in the background so the request
+        # never waits on the mail server
+        after_commit(lambda: threading.Thread(
+            target=_send_welcome_email, args=(email, name, account_number)
+        ).start())
         
         return jsonify({
             'message': 'Account created successfully',
             'account_number': account_number
         }), 201
         
+    except HashingOverloadedError:
+        return jsonify({'error': 'Server is busy, please try again shortly'}), 503, {'Retry-After': '1'}
     except Exception as e:
         import traceback
         print(f"Registration error: {e}")
@@ -100,6 +166,7 @@ def register():
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
 @auth_bp.route('/login', methods=['POST'])
+@validate_json(LOGIN_SCHEMA)
 def login():
     """
     Login user and send OTP
@@ -114,74 +181,74 @@ def login():
         JSON response indicating OTP sent status
     """
     try:
-        data = request.get_json()
-        
-        # Validate required fields
-        if not data.get('account_number') or not data.get('password'):
-            return jsonify({'error': 'Account number and password are required'}), 400
-        
-        account_number = data['account_number'].strip()
+        data = request.validated
+        account_number = data['account_number']
         password = data['password']
         
-        # Get user by account number
-        user = get_user_by_account(account_number)
+        # Get user by account number (the only lookup that needs the hash)
+        user = get_user_by_account(account_number, with_password=True)
         if not user:
             return jsonify({'error': 'Invalid account number or password'}), 401
         
         # Verify password
-        if not verify_password(password, user['password_hash']):
+        if not verify_password(password, user.password_hash):
             return jsonify({'error': 'Invalid account number or password'}), 401
         
-        # Rate limiting: Check recent OTP requests
-        recent_otps = count_recent_otps(user['id'], hours=1)
-        if recent_otps >= 3:
-            return jsonify({'error': 'Too many OTP requests. Please try again later.'}), 429
-        
-        # Generate quantum-inspired OTP
-        otp_code = generate_otp(user['id'])
-        
-        # Set OTP expiry (5 minutes from now for better UX)
-        expiry = datetime.now() + timedelta(minutes=5)
-        
-        # Store OTP in database
-        store_otp(user['id'], otp_code, expiry)
+        # Bring the stored hash to the current bcrypt cost, off the request path
+        if password_needs_rehash(user.password_hash):
+            rehash_password_async(password, lambda new_hash: update_password_hash(user, new_hash))
+        
+        if OTP_MODE == 'stateless':
+            # Derive the OTP; nothing is written until it is verified
+            issued = stateless_otp.issue(user.id)
+            if issued is None:
+                return jsonify({'error': 'Too many OTP requests. Please try again later.'}), 429
+            otp_code, otp_ticket = issued
+            expiry_minutes = stateless_otp.window_seconds // 60
+        else:
+            # Generate quantum-inspired OTP
+            otp_code = generate_otp(user.id)
+            otp_ticket = None
+            
+            # Set OTP expiry (5 minutes from now for better UX)
+            expiry_minutes = 5
+            expiry = datetime.now() + timedelta(minutes=expiry_minutes)
+            
+            # Store OTP unless rate limited (one statement, or no I/O with OTP_STORE=memory)
+            issued = otp_store.issue(
+                user, otp_code, expiry,
+                max_otps=OTP_RATE_LIMIT, hours=OTP_RATE_WINDOW_HOURS
+            )
+            if not issued:
+                return jsonify({'error': 'Too many OTP requests. Please try again later.'}), 429
         
         # Prepare response FIRST (don't wait for email)
         response_data = {
             'status': 'otp_sent',
             'message': 'OTP has been sent to your registered email address',
-            'expiry_minutes': 5
+            'expiry_minutes': expiry_minutes
         }
+        if otp_ticket:
+            response_data['otp_ticket'] = otp_ticket
         
         # Debug mode: include OTP in response (ONLY FOR DEVELOPMENT)
         if os.getenv('DEBUG_OTP', 'false').lower() == 'true':
             response_data['debug_otp'] = otp_code
             response_data['debug_notice'] = 'OTP included for debugging - remove in production'
         
-        # Send OTP via email in background (after response is sent)
-        import threading
-        def send_email_wrapper():
-            try:
-                print(f"🔄 Background thread started for sending OTP to {user['email']}")
-                result = send_otp_email(user['email'], otp_code)
-                if result:
-                    print(f"✅ Background email thread completed successfully")
-                else:
-                    print(f"⚠️ Background email thread completed but email sending returned False")
-            except Exception as e:
-                import traceback
-                print(f"❌ Background email thread error: {str(e)}")
-                print(f"❌ Traceback: {traceback.format_exc()}")
-        
-        threading.Thread(target=send_email_wrapper).start()
+        # Send OTP via email in background once the OTP is committed
+        _send_otp_email_after_commit(user.email, otp_code)
         
         return jsonify(response_data), 200
         
+    except HashingOverloadedError:
+        return jsonify({'error': 'Server is busy, please try again shortly'}), 503, {'Retry-After': '1'}
     except Exception as e:
         print(f"Login error: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
 @auth_bp.route('/verify-otp', methods=['POST'])
+@validate_json(VERIFY_OTP_SCHEMA)
 def verify_otp():
     """
     Verify OTP and complete login
@@ -189,38 +256,38 @@ def verify_otp():
     Request Body:
         {
             "account_number": "1234567890",
-            "otp": "123456"
+            "otp": "123456",
+            "otp_ticket": "..."          (OTP_MODE=stateless only)
         }
     
     Returns:
         JSON response with JWT token and user info
     """
     try:
-        data = request.get_json()
-        
-        # Validate required fields
-        if not data.get('account_number') or not data.get('otp'):
-            return jsonify({'error': 'Account number and OTP are required'}), 400
-        
-        account_number = data['account_number'].strip()
-        otp_code = data['otp'].strip()
-        
-        # Validate OTP format
-        if not otp_code.isdigit() or len(otp_code) != 6:
-            return jsonify({'error': 'OTP must be 6 digits'}), 400
-        
-        # Get user by account number
-        user = get_user_by_account(account_number)
-        if not user:
-            return jsonify({'error': 'Invalid account number'}), 401
-        
-        # Get valid OTP for user
-        otp_record = get_valid_otp(user['id'], otp_code)
-        if not otp_record:
-            return jsonify({'error': 'Invalid or expired OTP'}), 401
-        
-        # Mark OTP as used
-        mark_otp_used(otp_record['id'])
+        data = request.validated
+        account_number = data['account_number']
+        otp_code = data['otp']
+        
+        if OTP_MODE == 'stateless':
+            otp_ticket = data.get('otp_ticket')
+            if not otp_ticket:
+                return jsonify({'error': 'OTP ticket is required'}), 400
+            
+            user = get_user_by_account(account_number)
+            if not user:
+                return jsonify({'error': 'Invalid account number'}), 401
+            
+            # Recompute the code and spend the ticket (one insert, only when correct)
+            if not stateless_otp.verify(user.id, otp_code, otp_ticket):
+                return jsonify({'error': 'Invalid or expired OTP'}), 401
+        else:
+            # Look up user and consume the OTP atomically
+            user, consumed = otp_store.consume_for_account(account_number, otp_code)
+            if not user:
+                return jsonify({'error': 'Invalid account number'}), 401
+            
+            if not consumed:
+                return jsonify({'error': 'Invalid or expired OTP'}), 401
         
         # Generate JWT token
         token = generate_jwt_token(user)
@@ -230,10 +297,10 @@ def verify_otp():
             'message': 'Login successful',
             'token': token,
             'user': {
-                'id': user['id'],
-                'name': user['name'],
-                'account_number': user['account_number'],
-                'email': user['email']
+                'id': user.id,
+                'name': user.name,
+                'account_number': user.account_number,
+                'email': user.email
             }
         }), 200
         
@@ -242,6 +309,7 @@ def verify_otp():
         return jsonify({'error': 'Internal server error'}), 500
 
 @auth_bp.route('/resend-otp', methods=['POST'])
+@validate_json(RESEND_OTP_SCHEMA)
 def resend_otp():
     """
     Resend OTP to user's email
@@ -255,42 +323,48 @@ def resend_otp():
         JSON response indicating OTP sent status
     """
     try:
-        data = request.get_json()
-        
-        if not data.get('account_number'):
-            return jsonify({'error': 'Account number is required'}), 400
-        
-        account_number = data['account_number'].strip()
-        
-        # Get user by account number
-        user = get_user_by_account(account_number)
-        if not user:
-            return jsonify({'error': 'Invalid account number'}), 401
-        
-        # Rate limiting: Check recent OTP requests
-        recent_otps = count_recent_otps(user['id'], hours=1)
-        if recent_otps >= 3:
-            return jsonify({'error': 'Too many OTP requests. Please try again later.'}), 429
-        
-        # Generate new OTP
-        otp_code = generate_otp(user['id'])
-        
-        # Set OTP expiry (2 minutes from now)
-        expiry = datetime.now() + timedelta(minutes=2)
-        
-        # Store OTP in database
-        store_otp(user['id'], otp_code, expiry)
-        
-        # Send OTP via email
-        email_sent = send_otp_email(user['email'], otp_code)
-        if not email_sent:
-            return jsonify({'error': 'Failed to send OTP email. Please try again.'}), 500
+        account_number = request.validated['account_number']
+        otp_ticket = None
+        
+        if OTP_MODE == 'stateless':
+            user = get_user_by_account(account_number)
+            if not user:
+                return jsonify({'error': 'Invalid account number'}), 401
+            
+            issued = stateless_otp.issue(user.id)
+            if issued is None:
+                return jsonify({'error': 'Too many OTP requests. Please try again later.'}), 429
+            otp_code, otp_ticket = issued
+        else:
+            # Generate new OTP (keyed by account number since the user id
+            # is only known once the combined lookup/insert has run)
+            otp_code = generate_otp(account_number)
+            
+            # Set OTP expiry (2 minutes from now)
+            expiry = datetime.now() + timedelta(minutes=2)
+            
+            # Look up user and store the OTP unless rate limited
+            user, issued = otp_store.issue_for_account(
+                account_number, otp_code, expiry,
+                max_otps=OTP_RATE_LIMIT, hours=OTP_RATE_WINDOW_HOURS
+            )
+            if not user:
+                return jsonify({'error': 'Invalid account number'}), 401
+            
+            if not issued:
+                return jsonify({'error': 'Too many OTP requests. Please try again later.'}), 429
+        
+        # Send OTP via email once the OTP is committed; a failed commit
+        # turns this response into a 500 and no email goes out
+        _send_otp_email_after_commit(user.email, otp_code)
         
         # Prepare response
         response_data = {
             'status': 'otp_sent',
             'message': 'New OTP has been sent to your registered email address'
         }
+        if otp_ticket:
+            response_data['otp_ticket'] = otp_ticket
         
         # Debug mode: include OTP in response (ONLY FOR DEVELOPMENT)
         if os.getenv('DEBUG_OTP', 'false').lower() == 'true':
@@ -301,3 +375,29 @@ def resend_otp():
     except Exception as e:
         print(f"Resend OTP error: {e}")
         return jsonify({'error': 'Internal server error'}), 500
+
+@auth_bp.route('/logout', methods=['POST'])
+@token_required
+def logout():
+    """
+    Revoke the current token
+    
+    Headers:
+        Authorization: Bearer <jwt_token>
+    
+    Returns:
+        JSON response confirming logout
+    """
+    try:
+        current_user = request.current_user
+        
+        # Tokens issued before revocation support carry no jti
+        if 'jti' not in current_user:
+            return jsonify({'error': 'Token cannot be revoked, it expires on its own'}), 400
+        
+        revoke(current_user['jti'], current_user['user_id'], current_user['exp'])
+        return jsonify({'message': 'Logged out successfully'}), 200
+        
+    except Exception as e:
+        print(f"Logout error: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
@@ -6,7 +6,6 @@ import random
 from datetime import datetime, timedelta
 
 from utils.security import token_required
-from utils.db import get_user_by_account
 
 dashboard_bp = Blueprint('dashboard', __name__)
 
@@ -23,16 +22,11 @@ def get_user_dashboard():
         JSON response with user dashboard data
     """
     try:
-        # Get current user from token
-        current_user = request.current_user
-        
-        # Get fresh user data from database
-        user = get_user_by_account(current_user['account_number'])
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
+        # Current user from token claims (no database lookup)
+        user = request.user
         
         # Generate dummy balance (in production, this would come from accounts table)
-        random.seed(user['id'])  # Consistent random for same user
+        random.seed(user.id)  # Consistent random for same user
         balance = round(random.uniform(1000, 50000), 2)
         
         # Generate dummy recent transactions
@@ -50,7 +44,7 @@ def get_user_dashboard():
             ]
             
             transactions.append({
-                'id': f"TXN{user['id']}{i:03d}",
+                'id': f"TXN{user.id}{i:03d}",
                 'date': transaction_date.strftime('%Y-%m-%d'),
                 'description': random.choice(descriptions),
                 'amount': abs(amount),
@@ -67,11 +61,11 @@ def get_user_dashboard():
         
         dashboard_data = {
             'user': {
-                'id': user['id'],
-                'name': user['name'],
-                'account_number': user['account_number'],
-                'email': user['email'],
-                'member_since': user['created_at'].strftime('%B %Y') if user.get('created_at') else 'Recently'
+                'id': user.id,
+                'name': user.name,
+                'account_number': user.account_number,
+                'email': user.email,
+                'member_since': user.created_at.strftime('%B %Y') if user.created_at else 'Recently'
             },
             'account': {
                 'balance': balance,
@@ -135,20 +129,16 @@ def get_transactions():
         JSON response with paginated transactions
     """
     try:
-        current_user = request.current_user
-        
         # Get query parameters
         page = int(request.args.get('page', 1))
         limit = min(int(request.args.get('limit', 10)), 50)  # Max 50 items per page
         transaction_type = request.args.get('type', '').lower()
         
-        # Get user data
-        user = get_user_by_account(current_user['account_number'])
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
+        # Current user from token claims (no database lookup)
+        user = request.user
         
         # Generate dummy transactions (in production, query from database)
-        random.seed(user['id'])
+        random.seed(user.id)
         all_transactions = []
         
         for i in range(50):  # Generate 50 dummy transactions
@@ -164,7 +154,7 @@ def get_transactions():
             ]
             
             all_transactions.append({
-                'id': f"TXN{user['id']}{i:03d}",
+                'id': f"TXN{user.id}{i:03d}",
                 'date': transaction_date.strftime('%Y-%m-%d %H:%M:%S'),
                 'description': random.choice(descriptions),
                 'amount': abs(amount),
@@ -216,23 +206,20 @@ def get_account_summary():
         JSON response with account summary data
     """
     try:
-        current_user = request.current_user
-        
-        user = get_user_by_account(current_user['account_number'])
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
+        # Current user from token claims (no database lookup)
+        user = request.user
         
         # Generate consistent dummy data
-        random.seed(user['id'])
+        random.seed(user.id)
         
         # Account summary data
         summary = {
             'account_info': {
-                'account_number': user['account_number'],
+                'account_number': user.account_number,
                 'account_type': 'Quantum Savings',
                 'branch': 'Digital Branch',
                 'ifsc_code': 'QNTM0001234',
-                'opened_date': user['created_at'].strftime('%Y-%m-%d') if user.get('created_at') else '2024-01-01'
+                'opened_date': user.created_at.strftime('%Y-%m-%d') if user.created_at else '2024-01-01'
             },
             'balances': {
                 'current_balance': round(random.uniform(5000, 75000), 2),
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Benchmark the bulk write strategies in utils/bulk.py
+
+Loads the same synthetic transaction rows into a scratch table with
+row-by-row INSERTs (baseline), batched INSERT ... VALUES, COPY FROM STDIN
+and bulk upsert, and prints rows/sec for each.
+
+Usage (from the backend directory):
+    python scripts/benchmark_bulk_writes.py [rows] [page_size]
+"""
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from utils.db import execute_query
+from utils.bulk import bulk_insert, bulk_upsert, copy_rows
+
+TABLE = 'bulk_benchmark'
+COLUMNS = ['transaction_id', 'user_id', 'amount', 'transaction_type', 'description', 'created_at']
+
+
+def generate_rows(count, offset=0):
+    """Synthetic transaction rows, produced lazily"""
+    started = datetime(2025, 1, 1)
+    for i in range(offset, offset + count):
+        yield (
+            f"BENCH{i:09d}", i % 1000, round((i % 5000) / 3, 2),
+            'credit' if i % 2 else 'debit', f"Benchmark row {i}",
+            started + timedelta(seconds=i)
+        )
+
+
+def reset_table():
+    execute_query(f"DROP TABLE IF EXISTS {TABLE}")
+    execute_query(f"""
+        CREATE UNLOGGED TABLE {TABLE} (
+            transaction_id VARCHAR(50) PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            amount DECIMAL(15, 2) NOT NULL,
+            transaction_type VARCHAR(20) NOT NULL,
+            description VARCHAR(255) NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE
+        )
+    """)
+
+
+def row_by_row(rows):
+    count = 0
+    for row in rows:
+        execute_query(
+            f"INSERT INTO {TABLE} ({', '.join(COLUMNS)}) VALUES (%s, %s, %s, %s, %s, %s)", row
+        )
+        count += 1
+    return count
+
+
+def timed(label, load, rows):
+    reset_table()
+    started = time.perf_counter()
+    loaded = load(rows)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<28}{loaded:>10}{elapsed:>10.3f}{loaded / elapsed:>14,.0f}")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    page_size = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    baseline = min(count, 2000)
+
+    print("=" * 62)
+    print(f"Bulk write benchmark ({count} rows, page size {page_size})")
+    print("=" * 62)
+    print(f"{'strategy':<28}{'rows':>10}{'seconds':>10}{'rows/sec':>14}")
+
+    try:
+        timed('row-by-row INSERT', row_by_row, generate_rows(baseline))
+        timed('batched INSERT ... VALUES',
+              lambda rows: bulk_insert(TABLE, COLUMNS, rows, page_size=page_size),
+              generate_rows(count))
+        timed('COPY FROM STDIN', lambda rows: copy_rows(TABLE, COLUMNS, rows), generate_rows(count))
+
+        # Upsert half existing / half new rows
+        reset_table()
+        copy_rows(TABLE, COLUMNS, generate_rows(count // 2))
+        started = time.perf_counter()
+        loaded = bulk_upsert(TABLE, COLUMNS, generate_rows(count),
+                             conflict_columns=['transaction_id'],
+                             update_columns=['amount', 'description'], page_size=page_size)
+        elapsed = time.perf_counter() - started
+        print(f"{'bulk upsert (50% updates)':<28}{loaded:>10}{elapsed:>10.3f}{loaded / elapsed:>14,.0f}")
+    finally:
+        execute_query(f"DROP TABLE IF EXISTS {TABLE}")
+
+    print("=" * 62)
+
+
+if __name__ == "__main__":
+    main()
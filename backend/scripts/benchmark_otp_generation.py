@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Benchmark OTP generation throughput
+
+Compares the former per-call derivation (eight SHA-256 measurements plus
+an HMAC per OTP) with generate_otp() on the buffered entropy pool, one
+call per code on both sides. Batching has no legacy counterpart, so
+generate_otps() is compared with generate_otp() only. The batched codes
+must pass a chi-square test of their last digit (uniform over 0-9).
+
+Usage (from the backend directory):
+    python scripts/benchmark_otp_generation.py [count] [batch_size]
+"""
+import os
+import sys
+import time
+from collections import Counter
+
+# Chi-square critical value for 9 degrees of freedom at p = 0.001: a
+# uniform generator exceeds it once in a thousand runs
+CHI_SQUARE_BOUND = 27.88
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+os.environ['DEBUG_OTP'] = 'false'
+
+from utils.quantum_otp import OTP_FLOOR, OTP_SPAN, quantum_otp_generator
+
+
+def legacy_otp(user_id):
+    """The per-call derivation generate_otp used before the entropy pool"""
+    data = quantum_otp_generator._simulate_quantum_measurement(user_id, time.time())
+    otp = quantum_otp_generator._extract_digits_from_quantum_data(data)
+    return '1' + otp[1:] if otp[0] == '0' else otp
+
+
+def timed(label, produce, count):
+    started = time.perf_counter()
+    codes = produce()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<30}{count / elapsed:>14,.0f}{elapsed / count * 1e6:>12.2f}")
+    return codes, elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    print("=" * 56)
+    print(f"OTP generation ({count} codes, batch size {batch_size})")
+    print("=" * 56)
+    print(f"{'method':<30}{'otps/sec':>14}{'us/otp':>12}")
+
+    _, legacy = timed('legacy SHA-256 derivation', lambda: [legacy_otp(i) for i in range(count)], count)
+    _, pooled = timed('generate_otp (pooled)', lambda: [quantum_otp_generator.generate_otp(i) for i in range(count)], count)
+    codes, batched = timed('generate_otps (batched)', lambda: [
+        code
+        for start in range(0, count, batch_size)
+        for code in quantum_otp_generator.generate_otps(range(start, min(start + batch_size, count)))
+    ], count)
+
+    print("=" * 56)
+    print(f"{'pooled vs legacy (per call)':<30}{legacy / pooled:>13.1f}x")
+    print(f"{'batched vs pooled':<30}{pooled / batched:>13.1f}x")
+
+    # Sampled codes must cover [100000, 999999] uniformly
+    assert all(OTP_FLOOR <= int(code) < OTP_FLOOR + OTP_SPAN for code in codes)
+    last_digits = Counter(code[-1] for code in codes)
+    expected = count / 10
+    chi_square = sum((last_digits[digit] - expected) ** 2 / expected for digit in '0123456789')
+    print(f"Last-digit chi-square: {chi_square:.2f} (bound {CHI_SQUARE_BOUND}, 9 dof, p = 0.001)")
+    assert chi_square < CHI_SQUARE_BOUND, "Last digits of the batched codes are not uniform"
+    print(f"Entropy pool: {quantum_otp_generator.entropy.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Benchmark server-side prepared statements against plain execute_query
+
+Runs the read queries of the login path (user lookup + OTP quota count) and
+the dashboard path (user lookup) with prepared statements on and off and
+prints per-call latency for each. The user lookup goes straight to the
+query layer (execute_prepared), past the user cache and the Bloom filter
+that answer get_user_by_account in the app, so every call reaches the
+database.
+
+Usage (from the backend directory, against a database with the schema):
+    python scripts/benchmark_prepared_statements.py [account_number] [iterations]
+"""
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from utils.db import User, count_recent_otps, db_pool, execute_prepared
+
+
+def lookup_user(account_number):
+    """The statement behind get_user_by_account, without its caches"""
+    return execute_prepared('get_user_by_account', (account_number,), fetch_one=True, record=User,
+                            readonly=True)
+
+
+def login_path(account_number):
+    """Reads done by /api/auth/login before issuing an OTP"""
+    user = lookup_user(account_number)
+    if user:
+        count_recent_otps(user.id, hours=1)
+
+
+def dashboard_path(account_number):
+    """Read done by every /api/dashboard/* request"""
+    lookup_user(account_number)
+
+
+def measure(path, account_number, iterations):
+    """Time one path and return per-call latencies in milliseconds"""
+    # Warm the pool and (when enabled) prepare on every pooled connection
+    for _ in range(db_pool.connection_pool.maxconn):
+        path(account_number)
+
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        path(account_number)
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def summarize(samples):
+    """Mean / p50 / p95 of a latency sample"""
+    ordered = sorted(samples)
+    return {
+        'mean': statistics.fmean(ordered),
+        'p50': ordered[len(ordered) // 2],
+        'p95': ordered[int(len(ordered) * 0.95) - 1],
+    }
+
+
+def main():
+    account_number = sys.argv[1] if len(sys.argv) > 1 else '1234567890'
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+    print("=" * 64)
+    print(f"Prepared statement benchmark ({iterations} iterations per run)")
+    print("=" * 64)
+    print(f"{'path':<12}{'mode':<12}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+
+    for name, path in (('login', login_path), ('dashboard', dashboard_path)):
+        results = {}
+        for mode, use_prepared in (('plain', False), ('prepared', True)):
+            db_pool.use_prepared = use_prepared
+            results[mode] = summarize(measure(path, account_number, iterations))
+            r = results[mode]
+            print(f"{name:<12}{mode:<12}{r['mean']:>10.3f}{r['p50']:>10.3f}{r['p95']:>10.3f}")
+        saved = results['plain']['mean'] - results['prepared']['mean']
+        print(f"{'':<12}{'saved':<12}{saved:>10.3f}  ({saved / results['plain']['mean'] * 100:.1f}% per call)")
+
+    print("=" * 64)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Benchmark the per-request overhead of token_required
+
+Calls a trivial protected view in a request context with a valid,
+claims-bearing bearer token, once with the verified-token cache disabled
+(full PyJWT decode on every call) and once with it enabled, and prints
+microseconds per call. The revocation index is stubbed with an empty
+load, so no database is needed and its initial load is not timed.
+
+Usage (from the backend directory):
+    python scripts/benchmark_token_required.py [iterations]
+"""
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+os.environ.setdefault('JWT_SECRET', 'benchmark-secret')
+
+from flask import Flask
+
+from utils.revocation import revoked_tokens
+from utils.security import generate_jwt_token, token_cache, token_required
+
+
+@token_required
+def protected():
+    return 'ok'
+
+
+def run(app, headers, iterations):
+    with app.test_request_context('/', headers=headers):
+        protected()
+        started = time.perf_counter()
+        for _ in range(iterations):
+            protected()
+        return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    app = Flask(__name__)
+    revoked_tokens.load = lambda after_id: []
+    revoked_tokens.wait_until_loaded(5)
+    # A claims-bearing token, so the user is built without a lookup
+    token = generate_jwt_token({
+        'id': 1, 'account_number': '1234567890', 'name': 'Benchmark User',
+        'email': 'benchmark@example.com', 'created_at': datetime.now(timezone.utc),
+    })
+    headers = {'Authorization': f'Bearer {token}'}
+
+    print("=" * 44)
+    print(f"token_required overhead ({iterations} calls)")
+    print("=" * 44)
+
+    maxsize = token_cache.maxsize
+    token_cache.maxsize = 0
+    uncached = run(app, headers, iterations)
+    token_cache.maxsize = maxsize
+    cached = run(app, headers, iterations)
+
+    print(f"{'full decode':<28}{uncached:>10.2f} us")
+    print(f"{'verified-token cache':<28}{cached:>10.2f} us")
+    print(f"{'speedup':<28}{uncached / cached:>10.1f} x")
+    print("=" * 44)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Benchmark request validation for the auth endpoints
+
+For each endpoint schema, measures the cost of validating a valid body
+and an invalid one, for the compiled schema alone and including JSON
+decoding of the raw body (what validate_json does per request), and
+prints microseconds per request.
+
+Usage (from the backend directory):
+    python scripts/benchmark_validation.py [iterations]
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from routes.auth import LOGIN_SCHEMA, REGISTER_SCHEMA, RESEND_OTP_SCHEMA, VERIFY_OTP_SCHEMA
+
+CASES = [
+    ('register', REGISTER_SCHEMA,
+     {'name': ' Jane Doe ', 'email': 'Jane.Doe@Example.com ', 'password': 'correct horse battery'},
+     {'name': 'J', 'email': 'not-an-email', 'password': 'short'}),
+    ('login', LOGIN_SCHEMA,
+     {'account_number': '1234567890', 'password': 'password123'},
+     {'account_number': '12345', 'password': ''}),
+    ('verify-otp', VERIFY_OTP_SCHEMA,
+     {'account_number': '1234567890', 'otp': '123456'},
+     {'account_number': '1234567890', 'otp': '12x456'}),
+    ('resend-otp', RESEND_OTP_SCHEMA,
+     {'account_number': '1234567890'},
+     {'account_number': 1234567890}),
+]
+
+
+def per_call_us(fn, iterations):
+    fn()
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def parse_and_validate(schema, body):
+    """What validate_json does per request: decode the body, then validate"""
+    raw = json.dumps(body).encode('utf-8')
+    return lambda: schema.validate(json.loads(raw))
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+
+    print("=" * 66)
+    print(f"Auth request validation ({iterations} iterations, us per request)")
+    print("=" * 66)
+    print(f"{'endpoint':<14}{'schema ok':>12}{'schema bad':>12}{'+json ok':>14}{'+json bad':>14}")
+    for name, schema, good, bad in CASES:
+        print(f"{name:<14}"
+              f"{per_call_us(lambda: schema.validate(good), iterations):>12.2f}"
+              f"{per_call_us(lambda: schema.validate(bad), iterations):>12.2f}"
+              f"{per_call_us(parse_and_validate(schema, good), iterations):>14.2f}"
+              f"{per_call_us(parse_and_validate(schema, bad), iterations):>14.2f}")
+    print("=" * 66)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Measure bcrypt cost factors on this host and recommend one
+
+Prints the time one hash takes at each cost and the highest cost that
+fits the latency budget, for BCRYPT_ROUNDS in the environment.
+
+Usage (from the backend directory):
+    python scripts/calibrate_bcrypt.py [budget_ms]
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from utils.security import (
+    BCRYPT_MAX_ROUNDS, BCRYPT_MIN_ROUNDS, calibrate_bcrypt_rounds, time_bcrypt
+)
+
+
+def main():
+    budget_ms = float(sys.argv[1]) if len(sys.argv) > 1 else float(
+        os.getenv('BCRYPT_LATENCY_BUDGET_MS', '250'))
+
+    print("=" * 40)
+    print(f"bcrypt calibration (budget {budget_ms:.0f}ms)")
+    print("=" * 40)
+    print(f"{'cost':<8}{'ms/hash':>12}")
+    for rounds in range(BCRYPT_MIN_ROUNDS, BCRYPT_MAX_ROUNDS + 1):
+        elapsed = time_bcrypt(rounds)
+        print(f"{rounds:<8}{elapsed:>12.1f}")
+        if elapsed > budget_ms * 4:
+            break
+
+    print("=" * 40)
+    print(f"Recommended: BCRYPT_ROUNDS={calibrate_bcrypt_rounds(budget_ms)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Standalone expiry worker
+
+Deletes expired OTPs, spent OTP tickets and revocations in paced chunks,
+for deployments that run it next to the app (EXPIRY_PURGE=false) instead
+of on every worker. With an interval of 0 it sweeps once and exits, e.g.
+from cron. Batch size and pacing come from the EXPIRY_* variables.
+
+Usage (from the backend directory):
+    python scripts/purge_expired.py [interval_seconds]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from utils.expiry import expiry_purger
+
+
+def report(deleted, elapsed):
+    print(f"[EXPIRY] Purged {deleted} row(s) in {elapsed:.2f}s")
+    for table, stats in expiry_purger.stats()['tables'].items():
+        print(f"  {table:<16} purged={stats['rows_purged']:<8} chunks={stats['chunks']:<5} "
+              f"lock_avg_ms={stats['lock_avg_ms']} lock_max_ms={stats['lock_max_ms']} errors={stats['errors']}")
+
+
+if __name__ == '__main__':
+    interval = float(sys.argv[1]) if len(sys.argv) > 1 else float(os.getenv('EXPIRY_SWEEP_INTERVAL', '300'))
+
+    while True:
+        started = time.perf_counter()
+        deleted = expiry_purger.sweep()
+        report(deleted, time.perf_counter() - started)
+        if not interval:
+            break
+        time.sleep(interval)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for a remote quantum random number generator
+
+Serves GET /random?bytes=<n> with n bytes from os.urandom, in the format
+HttpQrngProvider expects, optionally slowed down or failing so the
+prefetch buffer and the os.urandom fallback can be exercised:
+
+    python scripts/qrng_standin_server.py [port] [latency_ms] [failure_rate]
+    QRNG_URL=http://127.0.0.1:8765/random python app.py
+"""
+import os
+import random
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+MAX_BYTES = 1 << 20
+
+
+class QrngHandler(BaseHTTPRequestHandler):
+    latency_ms = 0.0
+    failure_rate = 0.0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/random':
+            self.send_error(404)
+            return
+        try:
+            count = int(parse_qs(url.query).get('bytes', ['32'])[0])
+        except ValueError:
+            count = -1
+        if not 0 < count <= MAX_BYTES:
+            self.send_error(400, f"bytes must be between 1 and {MAX_BYTES}")
+            return
+
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        if random.random() < self.failure_rate:
+            self.send_error(503, "Simulated generator failure")
+            return
+
+        data = os.urandom(count)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(count))
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up waiting (its timeout is shorter than the latency)
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    QrngHandler.latency_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    QrngHandler.failure_rate = float(sys.argv[3]) if len(sys.argv) > 3 else 0.0
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), QrngHandler)
+    print(f"QRNG stand-in on http://127.0.0.1:{port}/random "
+          f"(latency {QrngHandler.latency_ms:.0f} ms, failure rate {QrngHandler.failure_rate:.0%})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
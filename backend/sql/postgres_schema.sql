@@ -3,8 +3,12 @@
 
 -- Drop tables if they exist (for clean reinstall)
 DROP TABLE IF EXISTS otps CASCADE;
+DROP TABLE IF EXISTS revoked_tokens CASCADE;
+DROP TABLE IF EXISTS otp_redemptions CASCADE;
+DROP TABLE IF EXISTS otp_events CASCADE;
 DROP TABLE IF EXISTS transactions CASCADE;
 DROP TABLE IF EXISTS users CASCADE;
+DROP SEQUENCE IF EXISTS account_number_seq;
 
 -- Drop views if they exist
 DROP VIEW IF EXISTS user_balance_summary;
@@ -28,6 +32,10 @@ CREATE INDEX idx_users_email ON users(email);
 CREATE INDEX idx_users_created_at ON users(created_at);
 CREATE INDEX idx_users_active ON users(is_active);
 
+-- Account number allocation - each value is permuted into a unique account
+-- number (see utils/account_numbers.py); reserved in blocks by the backend
+CREATE SEQUENCE account_number_seq MINVALUE 0 MAXVALUE 999999999 START 0 NO CYCLE;
+
 -- OTPs table - stores one-time passwords for authentication
 CREATE TABLE otps (
     id SERIAL PRIMARY KEY,
@@ -52,6 +60,19 @@ CREATE INDEX idx_otps_cleanup ON otps(expiry, used);
 -- Composite index for OTP verification (most important query)
 CREATE INDEX idx_otps_user_otp ON otps(user_id, otp_code, used, expiry);
 
+-- Count a user's recent OTPs for the rate limit, serialized per user: the
+-- advisory lock is held until the issuing transaction ends, and a volatile
+-- function counts with a fresh snapshot taken after the lock was granted,
+-- so concurrent requests cannot both see room for one more OTP
+CREATE OR REPLACE FUNCTION lock_and_count_recent_otps(p_user_id INTEGER, p_hours INTEGER)
+RETURNS BIGINT AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('otps'), p_user_id);
+    RETURN (SELECT COUNT(*) FROM otps
+            WHERE user_id = p_user_id AND created_at > NOW() - p_hours * INTERVAL '1 hour');
+END;
+$$ language 'plpgsql' VOLATILE;
+
 -- Transactions table - stores transaction history (optional for demo)
 CREATE TABLE transactions (
     id SERIAL PRIMARY KEY,
@@ -79,6 +100,53 @@ CREATE INDEX idx_transactions_amount ON transactions(amount);
 -- Composite index for user transaction history
 CREATE INDEX idx_transactions_user_date ON transactions(user_id, created_at DESC);
 
+-- Revoked tokens - JWT ids killed by logout before their expiry; every
+-- worker mirrors the unexpired ones in memory (see utils/revocation.py)
+CREATE TABLE revoked_tokens (
+    id BIGSERIAL PRIMARY KEY,
+    jti VARCHAR(64) UNIQUE NOT NULL,
+    user_id INTEGER,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    revoked_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX idx_revoked_tokens_expires_at ON revoked_tokens(expires_at);
+
+-- Deleting a user revokes every token issued to it: tokens carry the user
+-- in their claims, so requests would otherwise not notice. One row per
+-- user ('user:<id>'), kept for the JWT lifetime (24 hours)
+CREATE OR REPLACE FUNCTION revoke_deleted_user_tokens()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO revoked_tokens (jti, user_id, expires_at)
+    VALUES ('user:' || OLD.id, OLD.id, NOW() + INTERVAL '24 hours')
+    ON CONFLICT (jti) DO UPDATE SET expires_at = EXCLUDED.expires_at;
+    RETURN OLD;
+END;
+$$ language 'plpgsql';
+
+CREATE TRIGGER revoke_deleted_user_tokens AFTER DELETE ON users
+    FOR EACH ROW EXECUTE FUNCTION revoke_deleted_user_tokens();
+
+-- OTP redemptions - spent tickets of stateless OTPs (OTP_MODE=stateless);
+-- codes are derived, not stored, so this marker is all a login writes
+CREATE TABLE otp_redemptions (
+    nonce VARCHAR(32) PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+-- OTP events - audit trail of OTPs issued/consumed by the in-memory store
+-- (OTP_STORE=memory), written in batches after the fact; codes are not kept
+CREATE TABLE otp_events (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    event VARCHAR(16) NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+CREATE INDEX idx_otp_events_user_created ON otp_events(user_id, created_at);
+
 -- Create function to update updated_at timestamp automatically
 CREATE OR REPLACE FUNCTION update_updated_at_column()
 RETURNS TRIGGER AS $$
@@ -92,6 +160,21 @@ $$ language 'plpgsql';
 CREATE TRIGGER update_users_updated_at BEFORE UPDATE ON users
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
+-- Announce new users to every backend worker, which adds them to its
+-- in-memory Bloom filters (see utils/bloom.py)
+CREATE OR REPLACE FUNCTION notify_user_created()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('users_created', json_build_object(
+        'account_number', NEW.account_number, 'email', NEW.email
+    )::text);
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+CREATE TRIGGER notify_user_created AFTER INSERT ON users
+    FOR EACH ROW EXECUTE FUNCTION notify_user_created();
+
 -- Insert sample user accounts
 -- Password: "password123" (hashed with bcrypt)
 -- Note: Use the provided Python script to generate proper bcrypt hash
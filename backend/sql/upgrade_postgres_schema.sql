@@ -0,0 +1,74 @@
+-- Quantum Banking schema upgrade (PostgreSQL/Supabase)
+-- Brings a database created from an older postgres_schema.sql up to date
+-- without dropping any data. Safe to run more than once; run it before
+-- starting the backend, which no longer creates tables itself.
+
+-- Account number allocation (see utils/account_numbers.py)
+CREATE SEQUENCE IF NOT EXISTS account_number_seq MINVALUE 0 MAXVALUE 999999999 START 0 NO CYCLE;
+
+-- OTP rate limit, serialized per user (see postgres_schema.sql)
+CREATE OR REPLACE FUNCTION lock_and_count_recent_otps(p_user_id INTEGER, p_hours INTEGER)
+RETURNS BIGINT AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('otps'), p_user_id);
+    RETURN (SELECT COUNT(*) FROM otps
+            WHERE user_id = p_user_id AND created_at > NOW() - p_hours * INTERVAL '1 hour');
+END;
+$$ language 'plpgsql' VOLATILE;
+
+-- Revoked tokens and the user deletion trigger (see utils/revocation.py)
+CREATE TABLE IF NOT EXISTS revoked_tokens (
+    id BIGSERIAL PRIMARY KEY,
+    jti VARCHAR(64) UNIQUE NOT NULL,
+    user_id INTEGER,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    revoked_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_revoked_tokens_expires_at ON revoked_tokens(expires_at);
+
+CREATE OR REPLACE FUNCTION revoke_deleted_user_tokens()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO revoked_tokens (jti, user_id, expires_at)
+    VALUES ('user:' || OLD.id, OLD.id, NOW() + INTERVAL '24 hours')
+    ON CONFLICT (jti) DO UPDATE SET expires_at = EXCLUDED.expires_at;
+    RETURN OLD;
+END;
+$$ language 'plpgsql';
+
+DROP TRIGGER IF EXISTS revoke_deleted_user_tokens ON users;
+CREATE TRIGGER revoke_deleted_user_tokens AFTER DELETE ON users
+    FOR EACH ROW EXECUTE FUNCTION revoke_deleted_user_tokens();
+
+-- Spent stateless OTP tickets (OTP_MODE=stateless)
+CREATE TABLE IF NOT EXISTS otp_redemptions (
+    nonce VARCHAR(32) PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+-- Audit trail of the in-memory OTP store (OTP_STORE=memory)
+CREATE TABLE IF NOT EXISTS otp_events (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    event VARCHAR(16) NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_otp_events_user_created ON otp_events(user_id, created_at);
+
+-- New users announced to the backend workers' Bloom filters (see utils/bloom.py)
+CREATE OR REPLACE FUNCTION notify_user_created()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('users_created', json_build_object(
+        'account_number', NEW.account_number, 'email', NEW.email
+    )::text);
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+DROP TRIGGER IF EXISTS notify_user_created ON users;
+CREATE TRIGGER notify_user_created AFTER INSERT ON users
+    FOR EACH ROW EXECUTE FUNCTION notify_user_created();
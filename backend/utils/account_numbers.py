@@ -0,0 +1,215 @@
+"""
+Account number allocation
+
+Account numbers are 9 permuted digits plus a Luhn check digit. Each number
+comes from a unique index drawn from the account_number_seq sequence; a
+keyed Feistel permutation maps the index onto [0, 10^9) so consecutive
+signups get unrelated-looking numbers while two indexes can never map to
+the same number. Indexes are reserved ACCOUNT_NUMBER_BLOCK_SIZE at a time
+in one round trip and the next block is fetched in the background when
+the local supply runs low, so register() normally allocates without
+touching the database.
+
+The permutation key (ACCOUNT_NUMBER_KEY) is required: with a known key the
+permutation can be inverted and future account numbers predicted. It must
+not change once accounts exist: a different key maps future indexes onto
+numbers already handed out.
+"""
+import hashlib
+import hmac
+import os
+import threading
+from collections import deque
+
+from utils.db import db_pool, user_bloom
+
+# 9 payload digits; the Feistel network runs on the smallest square domain
+# covering them (31623^2 >= 10^9) and cycle-walks back into range
+ACCOUNT_SPACE = 10 ** 9
+_HALF = 31623
+FEISTEL_ROUNDS = 4
+
+RESERVE_QUERY = "SELECT nextval('account_number_seq') FROM generate_series(1, %s)"
+
+
+def luhn_check_digit(digits):
+    """Luhn check digit for a string of digits"""
+    total = 0
+    for position, digit in enumerate(reversed(digits)):
+        value = int(digit)
+        if position % 2 == 0:
+            value *= 2
+            if value > 9:
+                value -= 9
+        total += value
+    return str((10 - total % 10) % 10)
+
+
+class KeyedPermutation:
+    """
+    Bijection on [0, ACCOUNT_SPACE) keyed by a secret
+
+    Args:
+        key (bytes): Secret for the Feistel round function
+        rounds (int): Feistel rounds
+    """
+
+    def __init__(self, key, rounds=FEISTEL_ROUNDS):
+        self._round_keys = [
+            hmac.new(key, f"account-number-round-{index}".encode(), hashlib.sha256).digest()
+            for index in range(rounds)
+        ]
+
+    def _feistel(self, value):
+        left, right = divmod(value, _HALF)
+        for round_key in self._round_keys:
+            digest = hashlib.blake2b(right.to_bytes(4, 'big'), key=round_key, digest_size=8).digest()
+            left, right = right, (left + int.from_bytes(digest, 'big')) % _HALF
+        return left * _HALF + right
+
+    def __call__(self, index):
+        if not 0 <= index < ACCOUNT_SPACE:
+            raise ValueError("Account index out of range")
+        value = self._feistel(index)
+        # Cycle-walk: the permutation of the larger square domain restricted
+        # to [0, ACCOUNT_SPACE) is still a permutation
+        while value >= ACCOUNT_SPACE:
+            value = self._feistel(value)
+        return value
+
+
+def reserve_indexes(count):
+    """
+    Reserve count unique indexes from account_number_seq
+
+    Inside a request this runs on the request's own pinned connection, so a
+    refill never waits for a second pool connection while the request holds
+    one; background refills check out their own. nextval is not
+    transactional, so a rolled-back request only leaves a gap. The sequence
+    comes with the schema (sql/postgres_schema.sql).
+    """
+    with db_pool.get_cursor(cursor_factory=None) as cursor:
+        cursor.execute(RESERVE_QUERY, (count,))
+        return [row[0] for row in cursor.fetchall()]
+
+
+class AccountNumberAllocator:
+    """
+    Hands out account numbers from locally reserved blocks
+
+    Args:
+        key (bytes): Permutation key
+        block_size (int): Indexes reserved per round trip
+        low_watermark (int): Remaining numbers that trigger a background refill
+        reserve (callable): reserve(count) returns that many unique indexes
+        is_taken (callable): Cheap check for numbers that may already exist
+            (accounts created before the allocator); those are skipped
+    """
+
+    def __init__(self, key, block_size=100, low_watermark=25,
+                 reserve=reserve_indexes, is_taken=None):
+        self.permute = KeyedPermutation(key)
+        self.block_size = block_size
+        self.low_watermark = low_watermark
+        self.reserve = reserve
+        self.is_taken = is_taken
+        self._lock = threading.Lock()
+        self._available = deque()
+        self._pid = os.getpid()
+        self._refilling = False
+
+        self.allocated = 0
+        self.skipped = 0
+        self.blocks = 0
+        self.sync_refills = 0
+        self.refill_errors = 0
+
+    def _check_pid(self):
+        # Numbers reserved before a fork would be handed out twice
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._lock = threading.Lock()
+            self._available.clear()
+            self._refilling = False
+
+    def _fill(self):
+        indexes = self.reserve(self.block_size)
+        numbers = []
+        for index in indexes:
+            payload = f"{self.permute(index):09d}"
+            numbers.append(payload + luhn_check_digit(payload))
+        with self._lock:
+            self._available.extend(numbers)
+        self.blocks += 1
+
+    def _background_fill(self):
+        try:
+            self._fill()
+        except Exception as e:
+            self.refill_errors += 1
+            print(f"[ACCOUNT-NUMBERS] Background refill failed: {e}")
+        finally:
+            self._refilling = False
+
+    def _maybe_refill(self):
+        with self._lock:
+            if self._refilling or len(self._available) > self.low_watermark:
+                return
+            self._refilling = True
+        threading.Thread(target=self._background_fill, name='account-number-refill', daemon=True).start()
+
+    def start(self):
+        """Reserve this process's first block in the background"""
+        self._check_pid()
+        self._maybe_refill()
+
+    def allocate(self):
+        """
+        Next unused account number
+
+        Returns:
+            str: 10-digit account number (9 digits + Luhn check digit)
+        """
+        self._check_pid()
+        while True:
+            with self._lock:
+                number = self._available.popleft() if self._available else None
+            if number is None:
+                # Supply ran dry before the background refill landed; this
+                # reserves on the request's connection
+                self.sync_refills += 1
+                self._fill()
+                continue
+            self._maybe_refill()
+            if self.is_taken is not None and self.is_taken(number):
+                self.skipped += 1
+                continue
+            self.allocated += 1
+            return number
+
+    def stats(self):
+        """Local supply and refill counters"""
+        return {
+            'available': len(self._available),
+            'block_size': self.block_size,
+            'low_watermark': self.low_watermark,
+            'allocated': self.allocated,
+            'skipped': self.skipped,
+            'blocks': self.blocks,
+            'sync_refills': self.sync_refills,
+            'refill_errors': self.refill_errors,
+        }
+
+
+_block_size = int(os.getenv('ACCOUNT_NUMBER_BLOCK_SIZE', '100'))
+_key = os.getenv('ACCOUNT_NUMBER_KEY')
+if not _key:
+    raise RuntimeError("ACCOUNT_NUMBER_KEY must be set (a long random secret, never changed afterwards)")
+
+# Global allocator used by registration
+account_numbers = AccountNumberAllocator(
+    key=_key.encode(),
+    block_size=_block_size,
+    low_watermark=int(os.getenv('ACCOUNT_NUMBER_LOW_WATERMARK', str(max(_block_size // 4, 1)))),
+    is_taken=user_bloom.peek_account,
+)
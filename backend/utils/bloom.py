@@ -0,0 +1,368 @@
+"""
+Bloom filters answering "this account/email does not exist" in memory
+
+A Bloom filter never reports a key it was given as missing, so a negative
+answer lets login, resend-otp and registration skip the database entirely
+for account numbers and emails nobody has. A positive answer only means
+"maybe" and the caller goes on to query as usual.
+
+The filters are per process. They are built from a streaming scan of the
+users table, extended by create_user, caught up with rows written by other
+workers as they happen, and rebuilt from scratch every
+BLOOM_REBUILD_INTERVAL seconds. Until the first build finishes every key
+is reported as "maybe".
+
+Users created by other workers arrive by LISTEN/NOTIFY: a trigger on users
+notifies users_created on every insert and a background thread in each
+worker adds them to its filters milliseconds after the commit. Where the
+trigger is missing (or LISTEN is unavailable, e.g. behind a transaction
+pooler) the thread rescans WHERE id > last seen id every
+BLOOM_SYNC_INTERVAL seconds instead. Either way a miss is only trusted
+while the filters are known to be current (last notification check or
+rescan within BLOOM_MAX_STALENESS seconds); otherwise it is a "maybe".
+Nothing scans on a request thread.
+"""
+import json
+import math
+import os
+import select
+import threading
+import time
+from hashlib import blake2b
+
+# Seconds before a failed build is retried
+BUILD_RETRY_SECONDS = 30.0
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over strings
+
+    Args:
+        capacity (int): Number of keys the filter is sized for
+        error_rate (float): Target false-positive rate at capacity
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(int(capacity), 1)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(int(-capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self.num_hashes = max(int(round(self.num_bits / capacity * math.log(2))), 1)
+        self.count = 0
+        self._bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, key):
+        # Double hashing (Kirsch-Mitzenmacher): k positions from one digest
+        digest = blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key):
+        """Add a key (re-adding a key already present does not count again)"""
+        added = False
+        for position in self._positions(key):
+            mask = 1 << (position & 7)
+            if not self._bits[position >> 3] & mask:
+                self._bits[position >> 3] |= mask
+                added = True
+        if added:
+            self.count += 1
+
+    def __contains__(self, key):
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    @property
+    def memory_bytes(self):
+        return len(self._bits)
+
+    def estimated_error_rate(self):
+        """False-positive rate expected at the current fill"""
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+
+class UserBloomIndex:
+    """
+    Account-number and email filters over the users table
+
+    Args:
+        scan (callable): scan(after_id) yields (id, account_number, email)
+            rows with id > after_id in id order, streaming
+        count (callable): Returns the current number of users
+        error_rate (float): Target false-positive rate per filter
+        min_capacity (int): Smallest capacity a filter is sized for
+        sync_interval (float): Seconds between catch-up scans without
+            notifications (and the longest wait for one with them)
+        rebuild_interval (float): Seconds between full rebuilds
+        sync_lookback (int): Ids re-read on each catch-up scan, so rows
+            whose insert committed out of id order are not missed
+        listen (callable): Returns a connection LISTENing for users_created
+            notifications, or None when they are not available
+        max_staleness (float): Misses are trusted only while the filters
+            were last known current this recently (default: 3 sync intervals)
+    """
+
+    def __init__(self, scan, count, error_rate=0.001, min_capacity=10000,
+                 sync_interval=1.0, rebuild_interval=3600.0, sync_lookback=100,
+                 listen=None, max_staleness=None):
+        self.scan = scan
+        self.count = count
+        self.error_rate = error_rate
+        self.min_capacity = min_capacity
+        self.sync_interval = sync_interval
+        self.rebuild_interval = rebuild_interval
+        self.sync_lookback = sync_lookback
+        self.listen = listen
+        self.max_staleness = sync_interval * 3 if max_staleness is None else max_staleness
+        self.enabled = True
+
+        self._lock = threading.Lock()
+        self._accounts = None
+        self._emails = None
+        self._last_id = 0
+        self._built_at = 0.0
+        # Users committed before this time are in the filters
+        self._covered_at = 0.0
+        self._added_during_build = None
+        self._building = False
+        self._build_started_at = None
+        self._pid = None
+        self._listener = None
+        self._listen_retry_at = 0.0
+
+        self.negatives = 0
+        self.stale_misses = 0
+        self.false_positives = 0
+        self.syncs = 0
+        self.sync_errors = 0
+        self.notifications = 0
+        self.builds = 0
+        self.build_errors = 0
+        self.last_build_ms = 0.0
+
+    @property
+    def ready(self):
+        return self._accounts is not None
+
+    def build(self):
+        """Scan users and replace both filters (blocking)"""
+        started = time.perf_counter()
+        scan_started_at = time.monotonic()
+        with self._lock:
+            self._added_during_build = []
+        try:
+            capacity = max(self.min_capacity, int(self.count() * 2))
+            accounts = BloomFilter(capacity, self.error_rate)
+            emails = BloomFilter(capacity, self.error_rate)
+            last_id = 0
+            for user_id, account_number, email in self.scan(0):
+                accounts.add(account_number)
+                emails.add(email)
+                last_id = user_id
+        except Exception as e:
+            self.build_errors += 1
+            print(f"[BLOOM] Build failed: {e}")
+            with self._lock:
+                self._added_during_build = None
+            return False
+        finally:
+            self._building = False
+
+        with self._lock:
+            # Users created here during the scan may have committed after it
+            for account_number, email in self._added_during_build:
+                accounts.add(account_number)
+                emails.add(email)
+            self._added_during_build = None
+            self._accounts = accounts
+            self._emails = emails
+            self._last_id = last_id
+            self._built_at = time.monotonic()
+            self._covered_at = scan_started_at
+        self.builds += 1
+        self.last_build_ms = (time.perf_counter() - started) * 1000
+        print(f"[BLOOM] Built user filters: {accounts.count} users, "
+              f"{accounts.memory_bytes + emails.memory_bytes} bytes, {self.last_build_ms:.0f}ms")
+        return True
+
+    def _start_build(self):
+        """Build in the background unless a build is already running"""
+        now = time.monotonic()
+        with self._lock:
+            if self._building:
+                return
+            if self._build_started_at is not None and now - self._build_started_at < BUILD_RETRY_SECONDS:
+                return
+            self._building = True
+            self._build_started_at = now
+        threading.Thread(target=self.build, name='bloom-build', daemon=True).start()
+
+    def sync(self):
+        """Add users written since the last scan (run by the catch-up thread)"""
+        scan_started_at = time.monotonic()
+        accounts, emails = self._accounts, self._emails
+        last_id = self._last_id
+        for user_id, account_number, email in self.scan(max(last_id - self.sync_lookback, 0)):
+            accounts.add(account_number)
+            emails.add(email)
+            last_id = max(last_id, user_id)
+        with self._lock:
+            # A build that finished meanwhile replaced the filters scanned into
+            if self._accounts is accounts:
+                self._last_id = max(self._last_id, last_id)
+                self._covered_at = scan_started_at
+        self.syncs += 1
+
+    def _connect_listener(self):
+        if self.listen is None or time.monotonic() < self._listen_retry_at:
+            return
+        self._listen_retry_at = time.monotonic() + BUILD_RETRY_SECONDS
+        self._listener = self.listen()
+        if self._listener is None:
+            print("[BLOOM] users_created notifications unavailable; rescanning every "
+                  f"{self.sync_interval}s")
+            return
+        # Catch up with users created before LISTEN took effect
+        self.sync()
+
+    def _close_listener(self):
+        if self._listener is not None:
+            try:
+                self._listener.close()
+            except Exception:
+                pass
+            self._listener = None
+
+    def _wait_for_notifications(self):
+        """Add users announced by notification, waiting up to sync_interval"""
+        connection = self._listener
+        select.select([connection], [], [], self.sync_interval)
+        # Notifications are delivered in commit order: all users committed
+        # before this poll are now in the filters
+        checked_at = time.monotonic()
+        connection.poll()
+        while connection.notifies:
+            user = json.loads(connection.notifies.pop(0).payload)
+            self.add(user['account_number'], user['email'])
+            self.notifications += 1
+        self._covered_at = max(self._covered_at, checked_at)
+
+    def _run(self):
+        while True:
+            if not self.ready:
+                time.sleep(self.sync_interval)
+                continue
+            try:
+                if self._listener is None:
+                    self._connect_listener()
+                if self._listener is not None:
+                    self._wait_for_notifications()
+                else:
+                    time.sleep(self.sync_interval)
+                    self.sync()
+            except Exception as e:
+                # Misses turn into "maybe" once the filters are stale
+                self.sync_errors += 1
+                print(f"[BLOOM] Sync failed: {e}")
+                self._close_listener()
+                time.sleep(self.sync_interval)
+
+    def start(self):
+        """Start this process's catch-up thread (lookups start it on demand)"""
+        if not self.enabled:
+            return
+        # The thread does not survive a fork; start one per process
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name='bloom-sync', daemon=True).start()
+
+    def _might_contain(self, attribute, key):
+        if not self.enabled or key is None:
+            return True
+        self.start()
+        if not self.ready:
+            self._start_build()
+            return True
+
+        now = time.monotonic()
+        if (now - self._built_at >= self.rebuild_interval
+                or self._accounts.count > self._accounts.capacity):
+            self._start_build()
+
+        if key in getattr(self, attribute):
+            return True
+        # Users created elsewhere since the filters were last known current
+        # may be missing from them
+        if now - self._covered_at > self.max_staleness:
+            self.stale_misses += 1
+            return True
+        self.negatives += 1
+        return False
+
+    def might_contain_account(self, account_number):
+        """False only if no user has this account number"""
+        return self._might_contain('_accounts', account_number)
+
+    def might_contain_email(self, email):
+        """False only if no user has this email"""
+        return self._might_contain('_emails', email)
+
+    def peek_account(self, account_number):
+        """
+        Filter membership only: no catch-up scan, no rebuild, no counters
+        
+        Returns False while the filter is not built.
+        """
+        accounts = self._accounts
+        return accounts is not None and account_number in accounts
+
+    def add(self, account_number, email):
+        """Record a newly created user"""
+        with self._lock:
+            if self._accounts is not None:
+                self._accounts.add(account_number)
+                self._emails.add(email)
+            if self._added_during_build is not None:
+                self._added_during_build.append((account_number, email))
+
+    def record_false_positive(self):
+        """Count a "maybe" that the database answered with no row"""
+        if self.ready:
+            self.false_positives += 1
+
+    def stats(self):
+        """Fill, memory footprint and observed vs expected false-positive rate"""
+        accounts, emails = self._accounts, self._emails
+        checked_absent = self.negatives + self.false_positives
+        stats = {
+            'enabled': self.enabled,
+            'ready': accounts is not None,
+            'builds': self.builds,
+            'build_errors': self.build_errors,
+            'last_build_ms': round(self.last_build_ms, 1),
+            'syncs': self.syncs,
+            'sync_errors': self.sync_errors,
+            'listening': self._listener is not None,
+            'notifications': self.notifications,
+            'negatives': self.negatives,
+            'stale_misses': self.stale_misses,
+            'false_positives': self.false_positives,
+            'observed_fp_rate': round(self.false_positives / checked_absent, 6) if checked_absent else 0.0,
+        }
+        if accounts is not None:
+            stats.update({
+                'users': accounts.count,
+                'capacity': accounts.capacity,
+                'num_hashes': accounts.num_hashes,
+                'memory_bytes': accounts.memory_bytes + emails.memory_bytes,
+                'expected_fp_rate': round(accounts.estimated_error_rate(), 6),
+                'age_seconds': round(time.monotonic() - self._built_at, 1),
+                'current_as_of_seconds_ago': round(time.monotonic() - self._covered_at, 1),
+            })
+        return stats
@@ -0,0 +1,288 @@
+"""
+Bulk write helpers (batched INSERT, COPY FROM STDIN and upsert)
+
+For seeding users, importing transactions or backfilling audit data without
+one round trip per row. Rows can be any iterable, including generators;
+they are consumed in pages so memory stays bounded.
+
+Inside a Flask request the writes join the request's unit of work; from
+scripts each page (or the whole COPY) autocommits on its own.
+
+WriteBehindQueue moves inserts off the request path altogether: rows are
+queued in memory and a background thread writes them in batches.
+"""
+import atexit
+import io
+import os
+import threading
+import time
+from collections import deque
+from datetime import date, datetime
+from itertools import islice
+
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+from utils.db import db_pool
+from utils.query_stats import query_stats
+
+
+def _pages(rows, page_size):
+    """Split an iterable of rows into lists of at most page_size"""
+    iterator = iter(rows)
+    while True:
+        page = list(islice(iterator, page_size))
+        if not page:
+            return
+        yield page
+
+
+def _column_list(columns):
+    return sql.SQL(', ').join(sql.Identifier(column) for column in columns)
+
+
+def _run_pages(template, statement, rows, page_size):
+    """Run execute_values page by page and return the total row count"""
+    total = 0
+    with db_pool.get_cursor(cursor_factory=None, write=True) as cursor:
+        query = statement.as_string(cursor)
+        for page in _pages(rows, page_size):
+            started = time.perf_counter()
+            execute_values(cursor, query, page, page_size=len(page))
+            query_stats.record(template, (time.perf_counter() - started) * 1000, rows=cursor.rowcount)
+            total += cursor.rowcount
+    return total
+
+
+def bulk_insert(table, columns, rows, page_size=1000):
+    """
+    Insert rows with multi-row INSERT ... VALUES statements
+
+    Args:
+        table (str): Target table
+        columns (list): Column names, in the order values appear in each row
+        rows (iterable): Row tuples
+        page_size (int): Rows per INSERT statement
+
+    Returns:
+        int: Number of rows inserted
+    """
+    statement = sql.SQL("INSERT INTO {} ({}) VALUES %s").format(
+        sql.Identifier(table), _column_list(columns)
+    )
+    return _run_pages(f"bulk_insert:{table}", statement, rows, page_size)
+
+
+def bulk_upsert(table, columns, rows, conflict_columns, update_columns=None, page_size=1000):
+    """
+    Insert rows, updating (or skipping) the ones that already exist
+
+    Args:
+        table (str): Target table
+        columns (list): Column names, in the order values appear in each row
+        rows (iterable): Row tuples
+        conflict_columns (list): Columns of the unique constraint to match on
+        update_columns (list): Columns overwritten on conflict; empty or None
+            means existing rows are left untouched (DO NOTHING)
+        page_size (int): Rows per statement
+
+    Returns:
+        int: Number of rows inserted or updated
+    """
+    if update_columns:
+        action = sql.SQL("DO UPDATE SET {}").format(sql.SQL(', ').join(
+            sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(column))
+            for column in update_columns
+        ))
+    else:
+        action = sql.SQL("DO NOTHING")
+
+    statement = sql.SQL("INSERT INTO {} ({}) VALUES %s ON CONFLICT ({}) {}").format(
+        sql.Identifier(table), _column_list(columns), _column_list(conflict_columns), action
+    )
+    return _run_pages(f"bulk_upsert:{table}", statement, rows, page_size)
+
+
+def _copy_value(value):
+    """Encode one value in COPY text format"""
+    if value is None:
+        return '\\N'
+    if value is True:
+        return 't'
+    if value is False:
+        return 'f'
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return (str(value)
+            .replace('\\', '\\\\')
+            .replace('\t', '\\t')
+            .replace('\n', '\\n')
+            .replace('\r', '\\r'))
+
+
+class IterableCopyStream(io.RawIOBase):
+    """
+    File-like reader that renders rows as COPY text on demand
+
+    copy_expert() pulls fixed-size chunks from it, so rows from a generator
+    are encoded as Postgres reads them instead of being materialised first.
+    """
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = b''
+        self.rows_read = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        while len(self._buffer) < len(target):
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self._buffer += ('\t'.join(_copy_value(value) for value in row) + '\n').encode('utf-8')
+            self.rows_read += 1
+        size = min(len(target), len(self._buffer))
+        target[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+def copy_rows(table, columns, rows, chunk_size=65536):
+    """
+    Stream rows into a table with COPY FROM STDIN
+
+    Args:
+        table (str): Target table
+        columns (list): Column names, in the order values appear in each row
+        rows (iterable): Row tuples (a generator is streamed, not buffered)
+        chunk_size (int): Bytes sent to the server per read
+
+    Returns:
+        int: Number of rows copied
+    """
+    stream = IterableCopyStream(rows)
+    started = time.perf_counter()
+    with db_pool.get_cursor(cursor_factory=None, write=True) as cursor:
+        statement = sql.SQL("COPY {} ({}) FROM STDIN").format(
+            sql.Identifier(table), _column_list(columns)
+        )
+        cursor.copy_expert(statement, stream, size=chunk_size)
+    query_stats.record(f"copy:{table}", (time.perf_counter() - started) * 1000, rows=stream.rows_read)
+    return stream.rows_read
+
+
+class WriteBehindQueue:
+    """
+    Rows queued by requests and inserted later in batches
+
+    A background thread per process inserts the queue with bulk_insert
+    every flush_interval seconds, or as soon as batch_size rows wait. The
+    queue is bounded: while the database is unavailable the oldest rows are
+    dropped (and counted) instead of memory growing without limit. Rows
+    still queued when the process exits are flushed by an atexit hook.
+
+    Args:
+        table (str): Target table
+        columns (list): Column names, in the order values appear in each row
+        batch_size (int): Queued rows that trigger an early flush
+        flush_interval (float): Seconds between flushes
+        max_pending (int): Rows kept while inserts fail
+    """
+
+    def __init__(self, table, columns, batch_size=500, flush_interval=1.0,
+                 max_pending=50000):
+        self.table = table
+        self.columns = columns
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending = deque()
+        self._pid = None
+
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.errors = 0
+        self.flush_ms_total = 0.0
+        atexit.register(self.flush)
+
+    def _ensure_started(self):
+        # The flusher thread does not survive a fork; rows queued by the
+        # parent are the parent's to write
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pending.clear()
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name=f'write-behind-{self.table}', daemon=True).start()
+
+    def append(self, row):
+        """Queue one row tuple for insertion"""
+        self._ensure_started()
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self._pending.popleft()
+                self.dropped += 1
+            self._pending.append(row)
+            if len(self._pending) >= self.batch_size:
+                self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        """
+        Insert everything queued so far
+
+        Returns:
+            int: Rows written (0 if the insert failed; the rows stay queued)
+        """
+        if self._pid != os.getpid():
+            return 0
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._pending)
+                self._pending.clear()
+            if not batch:
+                return 0
+
+            started = time.perf_counter()
+            try:
+                bulk_insert(self.table, self.columns, batch, page_size=self.batch_size)
+            except Exception as e:
+                self.errors += 1
+                print(f"[WRITE-BEHIND] Insert into {self.table} failed, {len(batch)} row(s) kept: {e}")
+                with self._lock:
+                    requeued = batch + list(self._pending)
+                    overflow = len(requeued) - self.max_pending
+                    if overflow > 0:
+                        self.dropped += overflow
+                        requeued = requeued[overflow:]
+                    self._pending = deque(requeued)
+                return 0
+
+            self.flushes += 1
+            self.written += len(batch)
+            self.flush_ms_total += (time.perf_counter() - started) * 1000
+            return len(batch)
+
+    def stats(self):
+        """Queue depth and write counters"""
+        return {
+            'pending': len(self._pending) if self._pid == os.getpid() else 0,
+            'written': self.written,
+            'dropped': self.dropped,
+            'flushes': self.flushes,
+            'errors': self.errors,
+            'flush_avg_ms': round(self.flush_ms_total / self.flushes, 3) if self.flushes else None,
+        }
@@ -0,0 +1,94 @@
+"""
+Bounded in-process LRU cache with per-entry expiry
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire after a time-to-live
+
+    Args:
+        maxsize (int): Maximum number of entries (0 disables the cache)
+        ttl (float): Default seconds an entry stays valid
+    """
+
+    def __init__(self, maxsize=1024, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key, default=None):
+        """Return a live entry (marking it recently used) or default"""
+        if not self.maxsize:
+            return default
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Store an entry, evicting the least recently used one when full
+
+        Args:
+            ttl (float): Seconds this entry stays valid (default: cache ttl)
+        """
+        if not self.maxsize:
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        """Drop an entry if present"""
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Size and hit/miss/eviction counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
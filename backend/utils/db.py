@@ -2,13 +2,24 @@
 Database connection utilities with connection pooling (Supabase/PostgreSQL)
 """
 import psycopg2
+import psycopg2.errors
+from psycopg2 import extensions
 from psycopg2.extras import RealDictCursor
-from psycopg2 import pool
 import os
+import re
+import threading
+import time
 from contextlib import contextmanager
+from flask import g, has_request_context, jsonify, request
+
+from utils.bloom import UserBloomIndex
+from utils.cache import TTLCache
+from utils.pool import BoundedConnectionPool, PoolTimeoutError
+from utils.replicas import ReplicaRouter, parse_lsn
+from utils.query_stats import query_stats, normalize_statement, is_read_only
 
 class DatabasePool:
-    """Simple database connection manager for PostgreSQL/Supabase"""
+    """Pooled database connection manager for PostgreSQL/Supabase"""
     
     def __init__(self):
         # Support both DATABASE_URL (standard Postgres) and individual params
@@ -27,65 +38,726 @@ class DatabasePool:
             
             self.connection_string = f"postgresql://{user}:{password}@{host}:{port}/{database}"
         
-        # Initialize connection pool for better performance
+        # Optional read replicas (comma-separated DSNs) for read-only helpers
+        self.replica_urls = [url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+        
+        # Pools are created on first use in the process that uses them, so
+        # nothing is connected at import time (before gunicorn forks)
+        self._pool = None
+        self._router = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+        # Pools inherited across fork are kept referenced, never closed:
+        # closing would terminate sessions the parent is still using
+        self._inherited_pools = []
+        
+        # Hot queries prepared per connection (see register_statement).
+        # Disable with DB_PREPARED_STATEMENTS=false behind poolers such as
+        # PgBouncer in transaction mode that don't keep session state.
+        self.statements = {}
+        self.use_prepared = os.getenv('DB_PREPARED_STATEMENTS', 'true').lower() == 'true'
+    
+    def _create_pool(self, dsn):
+        """Build a thread-safe bounded pool from the environment"""
+        # Callers wait for a free connection instead of opening unpooled
+        # ones when it is exhausted
+        return BoundedConnectionPool(
+            dsn,
+            minconn=int(os.getenv('DB_POOL_MIN', '1')),
+            maxconn=int(os.getenv('DB_POOL_MAX', '10')),
+            timeout=float(os.getenv('DB_POOL_TIMEOUT', '5')),
+            max_age=float(os.getenv('DB_POOL_MAX_AGE', '1800')),
+            max_idle=float(os.getenv('DB_POOL_MAX_IDLE', '300')),
+            ping_after=float(os.getenv('DB_POOL_PING_AFTER', '30'))
+        )
+    
+    def _ensure_pools(self):
+        """Create this process's pools lazily, and again after fork"""
+        pid = os.getpid()
+        if self._pool is None or self._pool_pid != pid:
+            with self._pool_lock:
+                if self._pool is None or self._pool_pid != pid:
+                    if self._pool is not None:
+                        self._inherited_pools.append((self._pool, self._router))
+                    self._pool = self._create_pool(self.connection_string)
+                    self._router = ReplicaRouter(
+                        self.replica_urls, self._create_pool,
+                        strategy=os.getenv('DB_REPLICA_STRATEGY', 'round_robin'),
+                        max_lag=float(os.getenv('DB_REPLICA_MAX_LAG', '5')),
+                        check_interval=float(os.getenv('DB_REPLICA_LAG_CHECK_INTERVAL', '5'))
+                    )
+                    self._pool_pid = pid
+    
+    @property
+    def connection_pool(self):
+        """The current process's primary pool"""
+        self._ensure_pools()
+        return self._pool
+    
+    @property
+    def replica_router(self):
+        """The current process's replica router (falsy without replicas)"""
+        self._ensure_pools()
+        return self._router
+    
+    def _after_fork(self):
+        """Drop the parent's pools in a freshly forked child"""
+        self._pool_lock = threading.Lock()
+        if self._pool is not None:
+            self._inherited_pools.append((self._pool, self._router))
+        self._pool = None
+        self._router = None
+        self._pool_pid = None
+    
+    def warm_up(self, count=None):
+        """
+        Pre-open pooled connections so the first requests skip connection setup
+        
+        Args:
+            count (int): Connections to open (default: DB_POOL_WARMUP, else DB_POOL_MIN)
+        
+        Returns:
+            int: Number of connections opened
+        """
+        if count is None:
+            count = int(os.getenv('DB_POOL_WARMUP', os.getenv('DB_POOL_MIN', '1')))
+        if count <= 0:
+            return 0
+        return self.connection_pool.warm_up(count)
+    
+    def get_connection(self, timeout=None):
+        """
+        Check a connection out of the pool
+        
+        Raises:
+            PoolTimeoutError: If every connection stays busy for the wait timeout
+        """
+        return self.connection_pool.getconn(timeout)
+    
+    def return_connection(self, connection, close=False, pool=None):
+        """Return connection to the pool (the primary unless given)"""
+        if not connection:
+            return
+        if self._pool_pid != os.getpid():
+            # Checked out before a fork; it belongs to the parent
+            return
+        (pool or self.connection_pool).putconn(connection, close=close)
+    
+    def _choose_replica(self):
+        """Replica for a read-only statement, or None to use the primary"""
+        if not self.replica_urls:
+            return None
+        min_lsn = g.get('db_min_lsn') if has_request_context() else None
+        return self.replica_router.choose(min_lsn=min_lsn)
+    
+    def _record_write_lsn(self, connection):
+        """Remember the primary's WAL position after a request's write (see init_read_your_writes)"""
+        if not self.replica_urls or not has_request_context():
+            return
         try:
-            self.connection_pool = pool.SimpleConnectionPool(
-                1,  # min connections
-                10,  # max connections
-                self.connection_string
-            )
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_current_wal_lsn()::text")
+                g.db_write_lsn = cursor.fetchone()[0]
         except Exception as e:
-            print(f"Warning: Could not create connection pool: {e}")
-            self.connection_pool = None
+            # The write itself succeeded; the client's next reads may lag
+            print(f"[REPLICAS] Could not read the write position: {e}")
     
-    def get_connection(self):
-        """Get a connection from the pool or create a new one"""
-        if self.connection_pool:
-            try:
-                return self.connection_pool.getconn()
-            except Exception:
-                pass
+    def register_statement(self, name, query):
+        """
+        Register a query for server-side preparation
         
-        # Fallback to direct connection
-        return psycopg2.connect(self.connection_string)
+        Args:
+            name (str): Statement name (a valid SQL identifier)
+            query (str): SQL using $1, $2, ... placeholders
+        """
+        self.statements[name] = query
     
-    def return_connection(self, connection):
-        """Return connection to the pool"""
-        if self.connection_pool and connection:
-            try:
-                self.connection_pool.putconn(connection)
-                return
-            except Exception:
-                pass
+    def execute_prepared(self, cursor, name, params=(), explain=False):
+        """
+        Execute a registered statement by name on the cursor's connection
         
-        # Fallback: close the connection
-        if connection:
-            connection.close()
+        The statement is PREPAREd lazily the first time a pooled connection
+        runs it, so Postgres parses and plans it once per connection instead
+        of once per call.
+        
+        Args:
+            explain (bool): Run it under EXPLAIN (ANALYZE, BUFFERS) instead
+        """
+        prefix = "EXPLAIN (ANALYZE, BUFFERS) " if explain else ""
+        if not self.use_prepared:
+            cursor.execute(prefix + _as_client_side(self.statements[name]),
+                           {f'p{i}': value for i, value in enumerate(params, 1)})
+            return
+        
+        prepared = cursor.connection.prepared_statements
+        execute = f"EXECUTE {name} ({', '.join(['%s'] * len(params))})" if params else f"EXECUTE {name}"
+        if name not in prepared:
+            cursor.execute(f"PREPARE {name} AS {self.statements[name]}")
+            prepared.add(name)
+        try:
+            cursor.execute(prefix + execute, params)
+        except psycopg2.errors.InvalidSqlStatementName:
+            # Session state was reset underneath us (e.g. DISCARD ALL by a
+            # transaction-mode pooler); prepare again once
+            if cursor.connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                raise
+            prepared.clear()
+            cursor.execute(f"PREPARE {name} AS {self.statements[name]}")
+            prepared.add(name)
+            cursor.execute(prefix + execute, params)
+    
+    def stats(self):
+        """Connection pool statistics (in use, waiting, wait time)"""
+        return self.connection_pool.stats()
+    
+    def replica_stats(self):
+        """Lag, health and pool usage of each read replica"""
+        return self.replica_router.stats()
     
     @contextmanager
-    def get_cursor(self):
-        """Context manager for database operations"""
+    def get_cursor(self, cursor_factory=RealDictCursor, write=False,
+                   readonly=False):
+        """
+        Context manager for database operations
+        
+        Inside a Flask request with a unit of work the request's pinned
+        connection is used; otherwise (scripts, background threads) a
+        connection is checked out for this statement only and autocommits.
+        Read-only statements go to a replica when one is configured and
+        healthy and has replayed the client's last write (X-DB-LSN).
+        
+        Args:
+            cursor_factory: psycopg2 cursor class (None for plain tuple rows)
+            write (bool): Statement modifies data (opens the request transaction)
+            readonly (bool): Statement may be served by a read replica
+        """
+        unit = current_unit_of_work()
+        if readonly and not (unit is not None and unit.in_transaction):
+            replica = self._choose_replica()
+            connection = None
+            if replica is not None:
+                try:
+                    # Don't queue behind a saturated replica; use the primary
+                    connection = replica.pool.getconn(timeout=0)
+                except PoolTimeoutError:
+                    pass
+                except Exception:
+                    self.replica_router.mark_down(replica)
+            if connection is not None:
+                broken = False
+                try:
+                    connection.autocommit = True
+                    with connection.cursor(cursor_factory=cursor_factory) as cursor:
+                        yield cursor
+                except Exception as e:
+                    broken = isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+                    if broken:
+                        self.replica_router.mark_down(replica)
+                    raise
+                finally:
+                    self.return_connection(connection, close=broken, pool=replica.pool)
+                return
+        
+        if unit is not None:
+            with unit.cursor(cursor_factory, write) as cursor:
+                yield cursor
+            return
+        
         connection = None
+        broken = False
         try:
             connection = self.get_connection()
             connection.autocommit = True
-            with connection.cursor(cursor_factory=RealDictCursor) as cursor:
+            with connection.cursor(cursor_factory=cursor_factory) as cursor:
                 yield cursor
+            if write:
+                self._record_write_lsn(connection)
         except Exception as e:
-            if connection:
+            # Don't hand a dead socket back to the next caller
+            broken = isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+            if connection and not broken:
                 try:
                     connection.rollback()
                 except Exception:
-                    pass
+                    broken = True
             raise e
         finally:
             if connection:
-                self.return_connection(connection)
+                self.return_connection(connection, close=broken)
+
+class UnitOfWork:
+    """
+    Request-scoped database session
+    
+    Pins one pooled connection for the whole request. Reads run in
+    autocommit until the first write; from then on every statement belongs
+    to one transaction that is committed or rolled back when the request
+    finishes. A failed statement rolls the transaction back immediately and
+    marks the unit failed, so nothing written by the request is committed.
+    Side effects that must only happen once the writes are durable (emails)
+    are registered with after_commit().
+    """
+    
+    def __init__(self, pool):
+        self.pool = pool
+        self.connection = None
+        self.failed = False
+        self.broken = False
+        self.commit_callbacks = []
+    
+    @property
+    def in_transaction(self):
+        """Whether a write has opened the request transaction"""
+        return self.connection is not None and not self.connection.autocommit
+    
+    @contextmanager
+    def cursor(self, cursor_factory=RealDictCursor, write=False):
+        """Cursor on the pinned connection"""
+        if self.connection is None:
+            self.connection = self.pool.get_connection()
+            self.connection.autocommit = True
+        if write and self.connection.autocommit:
+            # psycopg2 issues BEGIN before the next statement
+            self.connection.autocommit = False
+        try:
+            with self.connection.cursor(cursor_factory=cursor_factory) as cursor:
+                yield cursor
+        except Exception as e:
+            self.failed = self.failed or self.in_transaction
+            if isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError)):
+                self.broken = True
+            elif self.in_transaction:
+                try:
+                    self.connection.rollback()
+                except Exception:
+                    self.broken = True
+            raise
+    
+    def finish(self, commit=True):
+        """
+        End the request transaction and, once committed, run the commit callbacks
+        
+        Args:
+            commit (bool): Commit (unless a statement failed) instead of rolling back
+        """
+        callbacks, self.commit_callbacks = self.commit_callbacks, []
+        if self.broken:
+            return
+        committed = commit and not self.failed
+        if self.in_transaction:
+            if committed:
+                self.connection.commit()
+            else:
+                self.connection.rollback()
+            self.connection.autocommit = True
+            if committed:
+                self.pool._record_write_lsn(self.connection)
+        if not committed:
+            return
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Commit callback error: {e}")
+    
+    def close(self):
+        """Roll back anything left open and return the connection to the pool"""
+        if self.connection is None:
+            return
+        try:
+            if self.in_transaction and not self.broken:
+                self.connection.rollback()
+        except Exception:
+            self.broken = True
+        finally:
+            self.pool.return_connection(self.connection, close=self.broken)
+            self.connection = None
+
+def current_unit_of_work():
+    """The active request's unit of work, or None outside a request"""
+    if not has_request_context():
+        return None
+    return g.get('db_unit_of_work')
+
+def after_commit(callback):
+    """
+    Run callback once the request's writes are committed
+    
+    Dropped if the request rolls back. Runs right away when there is no
+    unit of work (statements autocommit). Keep callbacks short: they run in
+    after_request, so slow work (email) should start its own thread.
+    
+    Args:
+        callback (callable): Called without arguments
+    """
+    unit = current_unit_of_work()
+    if unit is None:
+        callback()
+    else:
+        unit.commit_callbacks.append(callback)
+
+def init_unit_of_work(app):
+    """
+    Register request-scoped unit of work hooks on a Flask app
+    
+    Each request lazily pins one connection on first query. Writes are
+    committed in after_request for successful (< 400) responses, so a
+    failed commit can still turn into a 500; everything else is rolled
+    back. Set DB_UNIT_OF_WORK=false to keep per-statement autocommit.
+
+    Only statements issued on the request thread belong to the unit of
+    work. These run on their own autocommit connections and commit
+    independently of the request, by design:
+
+    - reads routed to a read replica (before the request's first write)
+    - Bloom filter builds and catch-up scans (utils.bloom, background)
+    - background account-number refills (utils.account_numbers); a
+      refill on the request thread uses the request's connection, and
+      nextval is not transactional either way
+    - the OTP audit queue (utils.bulk.WriteBehindQueue, background)
+    - the revocation index poll (utils.revocation)
+    - expiry purges (utils.expiry)
+
+    Request-side effects that must wait for the commit go through
+    after_commit().
+    """
+    if os.getenv('DB_UNIT_OF_WORK', 'true').lower() != 'true':
+        return
+    
+    @app.before_request
+    def begin_unit_of_work():
+        g.db_unit_of_work = UnitOfWork(db_pool)
+    
+    @app.after_request
+    def commit_unit_of_work(response):
+        unit = g.get('db_unit_of_work')
+        if unit is not None:
+            try:
+                unit.finish(commit=response.status_code < 400)
+            except Exception as e:
+                print(f"Commit error: {e}")
+                unit.broken = True
+                response = jsonify({'error': 'Internal server error'})
+                response.status_code = 500
+        return response
+    
+    @app.teardown_request
+    def release_unit_of_work(error):
+        unit = g.pop('db_unit_of_work', None)
+        if unit is not None:
+            unit.close()
+
+# Carries the primary's WAL position after a write from the response to
+# the client's next requests
+WRITE_LSN_HEADER = 'X-DB-LSN'
+
+def init_read_your_writes(app):
+    """
+    Register the read-your-writes hooks for read replicas on a Flask app
+    
+    A response to a request that wrote carries the primary's WAL position
+    in X-DB-LSN; clients send the last one back, and that request's reads
+    only go to replicas that have replayed it (see utils.replicas). Unlike
+    a per-process marker this holds on any worker. Register before
+    init_unit_of_work: after_request hooks run in reverse order, and the
+    position is read once the request transaction has committed.
+    """
+    if not db_pool.replica_urls:
+        return
+    
+    @app.before_request
+    def read_write_position():
+        g.db_min_lsn = parse_lsn(request.headers.get(WRITE_LSN_HEADER))
+    
+    @app.after_request
+    def send_write_position(response):
+        lsn = g.get('db_write_lsn')
+        if lsn:
+            response.headers[WRITE_LSN_HEADER] = lsn
+        return response
+
+class Record:
+    """
+    Compact row record backed by __slots__
+    
+    Subclasses list their columns in __slots__; rows are mapped
+    positionally, so queries must select columns in that order. Columns a
+    projection leaves out are None. Item access is kept so records can be
+    passed where a row dict used to be.
+    """
+    __slots__ = ()
+    
+    def __init__(self, *values):
+        fields = self.__slots__
+        for index, field in enumerate(fields):
+            setattr(self, field, values[index] if index < len(values) else None)
+    
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+    
+    def get(self, key, default=None):
+        """dict.get-style access"""
+        value = getattr(self, key, None) if key in self.__slots__ else None
+        return default if value is None else value
+    
+    def as_dict(self):
+        """Convert to a plain dict"""
+        return {field: getattr(self, field) for field in self.__slots__}
+    
+    def __eq__(self, other):
+        return type(self) is type(other) and self.as_dict() == other.as_dict()
+    
+    def __repr__(self):
+        fields = ', '.join(f"{field}={getattr(self, field)!r}" for field in self._repr_fields())
+        return f"{type(self).__name__}({fields})"
+    
+    def _repr_fields(self):
+        return self.__slots__
+
+class User(Record):
+    """Row of the users table"""
+    __slots__ = ('id', 'name', 'account_number', 'email', 'created_at', 'password_hash')
+    
+    def _repr_fields(self):
+        # Never echo password hashes into logs
+        return self.__slots__[:-1]
+
+class Otp(Record):
+    """Row of the otps table"""
+    __slots__ = ('id', 'user_id', 'otp_code', 'expiry', 'used', 'created_at')
+
+# Column projections, in record slot order. The password hash is only
+# selected by the login lookup.
+USER_COLUMNS = "id, name, account_number, email, created_at"
+USER_AUTH_COLUMNS = USER_COLUMNS + ", password_hash"
+OTP_COLUMNS = "id, user_id, otp_code, expiry, used, created_at"
+
+def _as_client_side(query):
+    """Rewrite $n placeholders as psycopg2 %(pn)s parameters"""
+    return re.sub(r'\$(\d+)', r'%(p\1)s', query)
+
+# Hot queries, prepared lazily on each pooled connection
+PREPARED_STATEMENTS = {
+    'get_user_by_account': f"SELECT {USER_COLUMNS} FROM users WHERE account_number = $1",
+    'get_user_auth_by_account': f"SELECT {USER_AUTH_COLUMNS} FROM users WHERE account_number = $1",
+    'get_user_by_email': f"SELECT {USER_COLUMNS} FROM users WHERE email = $1",
+    'store_otp': """
+        INSERT INTO otps (user_id, otp_code, expiry)
+        VALUES ($1, $2, $3)
+    """,
+    'get_valid_otp': f"""
+        SELECT {OTP_COLUMNS} FROM otps
+        WHERE user_id = $1 AND otp_code = $2 AND used = FALSE AND expiry > NOW()
+        ORDER BY created_at DESC LIMIT 1
+    """,
+    'count_recent_otps': """
+        SELECT COUNT(*) as count FROM otps
+        WHERE user_id = $1 AND created_at > NOW() - $2::int * INTERVAL '1 hour'
+    """,
+    # Insert unless the email or account number exists; when nothing was
+    # inserted the second branch reports which unique column collided
+    'register_user': f"""
+        WITH inserted AS (
+            INSERT INTO users (name, account_number, email, password_hash)
+            VALUES ($1::varchar, $2::varchar, $3::varchar, $4::varchar)
+            ON CONFLICT DO NOTHING
+            RETURNING {USER_COLUMNS}
+        )
+        SELECT {USER_COLUMNS}, NULL AS conflict FROM inserted
+        UNION ALL
+        SELECT NULL, NULL, NULL, NULL, NULL,
+               CASE WHEN EXISTS (SELECT 1 FROM users WHERE email = $3)
+                    THEN 'email' ELSE 'account_number' END
+        WHERE NOT EXISTS (SELECT 1 FROM inserted)
+    """,
+    # lock_and_count_recent_otps serializes issuing per user; a plain
+    # COUNT(*) here would let concurrent requests both pass the quota
+    'issue_otp_if_under_quota': """
+        WITH recent AS (
+            SELECT lock_and_count_recent_otps($1::int, $4::int) AS count
+        )
+        INSERT INTO otps (user_id, otp_code, expiry)
+        SELECT $1::int, $2::varchar, $3::timestamptz FROM recent
+        WHERE recent.count < $5
+        RETURNING id
+    """,
+    'issue_otp_for_account': """
+        WITH u AS (
+            SELECT id, name, account_number, email FROM users
+            WHERE account_number = $1
+        ), recent AS (
+            SELECT lock_and_count_recent_otps(u.id, $5::int) AS count FROM u
+        ), issued AS (
+            INSERT INTO otps (user_id, otp_code, expiry)
+            SELECT u.id, $2::varchar, $3::timestamptz FROM u, recent
+            WHERE recent.count < $4
+            RETURNING id
+        )
+        SELECT u.id, u.name, u.account_number, u.email, NULL AS created_at,
+               NULL AS password_hash, (SELECT id FROM issued) AS otp_id
+        FROM u
+    """,
+    'consume_otp_for_account': """
+        WITH u AS (
+            SELECT id, name, account_number, email, created_at FROM users
+            WHERE account_number = $1
+        ), consumed AS (
+            UPDATE otps SET used = TRUE
+            WHERE id = (
+                SELECT o.id FROM otps o JOIN u ON o.user_id = u.id
+                WHERE o.otp_code = $2 AND o.used = FALSE AND o.expiry > NOW()
+                ORDER BY o.created_at DESC LIMIT 1
+                FOR UPDATE OF o
+            ) AND used = FALSE
+            RETURNING id
+        )
+        SELECT u.id, u.name, u.account_number, u.email, u.created_at,
+               NULL AS password_hash, (SELECT id FROM consumed) AS otp_id
+        FROM u
+    """,
+}
+
+# Per-process cache of user lookups keyed by account number and email.
+# password_hash is stripped before caching unless USER_CACHE_PASSWORD_HASH
+# is enabled, so the login lookup normally still reads from the database.
+user_cache = TTLCache(
+    maxsize=int(os.getenv('USER_CACHE_SIZE', '1024')),
+    ttl=float(os.getenv('USER_CACHE_TTL', '60'))
+)
+USER_CACHE_PASSWORD_HASH = os.getenv('USER_CACHE_PASSWORD_HASH', 'false').lower() == 'true'
 
 # Global database pool instance
 db_pool = DatabasePool()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=db_pool._after_fork)
+for _name, _query in PREPARED_STATEMENTS.items():
+    db_pool.register_statement(_name, _query)
+
+def _scan_users(after_id=0, batch_size=5000):
+    """
+    Stream (id, account_number, email) for users with id > after_id
+    
+    Uses a server-side (named) cursor so a full scan holds one batch in
+    memory at a time instead of the whole table.
+    """
+    connection = None
+    broken = False
+    try:
+        connection = db_pool.get_connection()
+        connection.autocommit = False
+        with connection.cursor(name='user_bloom_scan') as cursor:
+            cursor.itersize = batch_size
+            cursor.execute(
+                "SELECT id, account_number, email FROM users WHERE id > %s ORDER BY id",
+                (after_id,)
+            )
+            for row in cursor:
+                yield row
+        connection.rollback()
+    except Exception as e:
+        broken = isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+        raise
+    finally:
+        if connection:
+            db_pool.return_connection(connection, close=broken)
+
+def _listen_users():
+    """
+    Dedicated connection LISTENing for users_created
+    
+    Returns None when the users table has no notify_user_created trigger
+    (schemas from before it), so the filters fall back to rescans.
+    """
+    connection = psycopg2.connect(db_pool.connection_string)
+    try:
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_trigger WHERE tgname = 'notify_user_created'")
+            if cursor.fetchone() is None:
+                connection.close()
+                return None
+            cursor.execute("LISTEN users_created")
+        return connection
+    except Exception:
+        connection.close()
+        raise
+
+def _count_users():
+    return execute_query("SELECT COUNT(*) AS count FROM users", fetch_one=True)['count']
+
+# Per-process Bloom filters of existing account numbers and emails, so
+# lookups of keys nobody has are answered without a round trip
+user_bloom = UserBloomIndex(
+    _scan_users, _count_users,
+    error_rate=float(os.getenv('BLOOM_ERROR_RATE', '0.001')),
+    min_capacity=int(os.getenv('BLOOM_MIN_CAPACITY', '10000')),
+    sync_interval=float(os.getenv('BLOOM_SYNC_INTERVAL', '1')),
+    rebuild_interval=float(os.getenv('BLOOM_REBUILD_INTERVAL', '3600')),
+    listen=_listen_users if os.getenv('BLOOM_LISTEN', 'true').lower() == 'true' else None,
+    max_staleness=float(os.getenv('BLOOM_MAX_STALENESS')) if os.getenv('BLOOM_MAX_STALENESS') else None,
+)
+user_bloom.enabled = os.getenv('BLOOM_FILTER', 'true').lower() == 'true'
+
+def _fetch(cursor, fetch_one, fetch_all, record):
+    """Read the result of the last statement on a cursor"""
+    if fetch_one:
+        row = cursor.fetchone()
+        return record(*row) if record and row is not None else row
+    elif fetch_all:
+        rows = cursor.fetchall()
+        return [record(*row) for row in rows] if record else rows
+    else:
+        return cursor.rowcount
+
+def _explain(cursor, run_explain, template, elapsed_ms):
+    """Capture EXPLAIN (ANALYZE, BUFFERS) for a slow read-only statement"""
+    try:
+        run_explain(cursor)
+        plan = '\n'.join(row[0] if isinstance(row, tuple) else list(row.values())[0]
+                         for row in cursor.fetchall())
+        query_stats.add_plan(template, elapsed_ms, plan)
+    except Exception as e:
+        print(f"[SLOW-QUERY] Could not capture plan for {template}: {e}")
+
+def _execute(template, run, run_explain, params, fetch_one, fetch_all, record,
+             readonly=False):
+    """
+    Run a statement on a pooled cursor and record its statistics
+    
+    Args:
+        template (str): Statistics key for the statement
+        run (callable): Executes the statement on a cursor
+        run_explain (callable): Executes EXPLAIN for it, or None for writes
+        readonly (bool): Statement may be served by a read replica
+    """
+    cursor_factory = None if record else RealDictCursor
+    started = time.perf_counter()
+    wait_ms = 0.0
+    try:
+        with db_pool.get_cursor(cursor_factory, write=run_explain is None,
+                                readonly=readonly) as cursor:
+            checked_out = time.perf_counter()
+            wait_ms = (checked_out - started) * 1000
+            run(cursor)
+            result = _fetch(cursor, fetch_one, fetch_all, record)
+            elapsed_ms = (time.perf_counter() - checked_out) * 1000
+            
+            rows = cursor.rowcount
+            if query_stats.record(template, elapsed_ms, wait_ms, rows):
+                query_stats.log_slow(template, elapsed_ms, params)
+                # An EXPLAIN error would abort an open request transaction
+                idle = cursor.connection.get_transaction_status() == extensions.TRANSACTION_STATUS_IDLE
+                if run_explain and idle and query_stats.should_explain(template):
+                    _explain(cursor, run_explain, template, elapsed_ms)
+            return result
+    except Exception:
+        query_stats.record(template, (time.perf_counter() - started) * 1000 - wait_ms,
+                           wait_ms, error=True)
+        raise
 
-def execute_query(query, params=None, fetch_one=False, fetch_all=False):
+def execute_query(query, params=None, fetch_one=False, fetch_all=False, record=None):
     """
     Execute a database query with parameters
     
@@ -94,29 +766,110 @@ def execute_query(query, params=None, fetch_one=False, fetch_all=False):
         params (tuple): Query parameters
         fetch_one (bool): Whether to fetch one result
         fetch_all (bool): Whether to fetch all results
+        record (type): Record class to map tuple rows onto (default: dict rows)
     
     Returns:
         Result based on fetch parameters
     """
-    with db_pool.get_cursor() as cursor:
-        cursor.execute(query, params)
-        
-        if fetch_one:
-            return cursor.fetchone()
-        elif fetch_all:
-            return cursor.fetchall()
-        else:
-            return cursor.rowcount
+    explain = None
+    if is_read_only(query):
+        explain = lambda cursor: cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + query, params)
+    return _execute(
+        normalize_statement(query), lambda cursor: cursor.execute(query, params),
+        explain, params, fetch_one, fetch_all, record
+    )
 
-def get_user_by_account(account_number):
-    """Get user by account number"""
-    query = "SELECT * FROM users WHERE account_number = %s"
-    return execute_query(query, (account_number,), fetch_one=True)
+def execute_prepared(name, params=(), fetch_one=False, fetch_all=False, record=None,
+                     readonly=False):
+    """
+    Execute a registered prepared statement
+    
+    Args:
+        name (str): Name registered in PREPARED_STATEMENTS
+        params (tuple): Values for $1, $2, ...
+        fetch_one (bool): Whether to fetch one result
+        fetch_all (bool): Whether to fetch all results
+        record (type): Record class to map tuple rows onto (default: dict rows)
+        readonly (bool): Statement may be served by a read replica
+    
+    Returns:
+        Result based on fetch parameters
+    """
+    explain = None
+    if is_read_only(db_pool.statements[name]):
+        explain = lambda cursor: db_pool.execute_prepared(cursor, name, params, explain=True)
+    return _execute(
+        name, lambda cursor: db_pool.execute_prepared(cursor, name, params),
+        explain, params, fetch_one, fetch_all, record,
+        readonly=readonly and explain is not None
+    )
+
+def _cache_user(user):
+    """Store a looked-up user under both of its cache keys"""
+    if user is None:
+        return
+    if user.password_hash is not None and not USER_CACHE_PASSWORD_HASH:
+        user = User(*(getattr(user, field) for field in User.__slots__[:-1]))
+    user_cache.set(('account', user.account_number), user)
+    user_cache.set(('email', user.email), user)
+
+def invalidate_user(account_number=None, email=None):
+    """
+    Drop a user from the lookup cache
+    
+    Call after anything that changes a users row (profile updates,
+    password changes) so this worker stops serving the old copy.
+    """
+    if account_number is not None:
+        user_cache.delete(('account', account_number))
+    if email is not None:
+        user_cache.delete(('email', email))
+
+def get_user_by_account(account_number, with_password=False):
+    """
+    Get user by account number
+    
+    Served from the in-process user cache when possible. The login lookup
+    (with_password=True) bypasses it unless USER_CACHE_PASSWORD_HASH is on.
+    
+    Args:
+        account_number (str): Account number to look up
+        with_password (bool): Also select password_hash (login only)
+    
+    Returns:
+        User: Matching user, or None
+    """
+    if not with_password or USER_CACHE_PASSWORD_HASH:
+        user = user_cache.get(('account', account_number))
+        if user is not None and (not with_password or user.password_hash is not None):
+            return user
+    
+    if not user_bloom.might_contain_account(account_number):
+        return None
+    
+    name = 'get_user_auth_by_account' if with_password else 'get_user_by_account'
+    user = execute_prepared(name, (account_number,), fetch_one=True, record=User,
+                            readonly=True)
+    if user is None:
+        user_bloom.record_false_positive()
+    _cache_user(user)
+    return user
 
 def get_user_by_email(email):
-    """Get user by email"""
-    query = "SELECT * FROM users WHERE email = %s"
-    return execute_query(query, (email,), fetch_one=True)
+    """Get user by email (without password hash)"""
+    user = user_cache.get(('email', email))
+    if user is not None:
+        return user
+    
+    if not user_bloom.might_contain_email(email):
+        return None
+    
+    user = execute_prepared('get_user_by_email', (email,), fetch_one=True, record=User,
+                            readonly=True)
+    if user is None:
+        user_bloom.record_false_positive()
+    _cache_user(user)
+    return user
 
 def create_user(name, account_number, email, password_hash):
     """Create a new user"""
@@ -124,24 +877,134 @@ def create_user(name, account_number, email, password_hash):
     INSERT INTO users (name, account_number, email, password_hash) 
     VALUES (%s, %s, %s, %s)
     """
-    return execute_query(query, (name, account_number, email, password_hash))
+    result = execute_query(query, (name, account_number, email, password_hash))
+    invalidate_user(account_number, email)
+    user_bloom.add(account_number, email)
+    return result
 
-def store_otp(user_id, otp_code, expiry):
-    """Store OTP for user"""
+def register_user(name, account_number, email, password_hash):
+    """
+    Create a user in one round trip, reporting a unique conflict
+    
+    The insert and the conflict check run as one statement, so concurrent
+    signups with the same email never raise a unique violation. A
+    conflict against a row committed after the statement started is
+    reported as 'account_number'; retrying with a new number then sees
+    the email conflict.
+    
+    Args:
+        name (str): User's name
+        account_number (str): Account number to assign
+        email (str): Normalised email address
+        password_hash (str): bcrypt hash
+    
+    Returns:
+        tuple: (User, None) on success, or (None, 'email') /
+        (None, 'account_number') naming the column that already exists
+    """
+    row = execute_prepared(
+        'register_user', (name, account_number, email, password_hash),
+        fetch_one=True, record=_raw_row
+    )
+    user, conflict = _split_user_row(row)
+    if conflict is not None:
+        return None, conflict
+    
+    invalidate_user(account_number, email)
+    user_bloom.add(account_number, email)
+    return user, None
+
+def update_password_hash(user, new_hash):
+    """
+    Replace a user's password hash (e.g. after a bcrypt cost change)
+    
+    Only applies if the stored hash is still the one the caller read, so
+    a rehash never overwrites a password changed in the meantime.
+    
+    Args:
+        user (User): User as loaded with with_password=True
+        new_hash (str): Replacement bcrypt hash
+    
+    Returns:
+        bool: Whether the hash was updated
+    """
+    query = """
+    UPDATE users SET password_hash = %s, updated_at = NOW()
+    WHERE id = %s AND password_hash = %s
+    """
+    updated = execute_query(query, (new_hash, user.id, user.password_hash))
+    invalidate_user(user.account_number, user.email)
+    return bool(updated)
+
+def revoke_token(jti, user_id, expires_at):
+    """
+    Durably revoke a token id until its expiry
+    
+    Args:
+        jti (str): Token id claim
+        user_id (int): Owner of the token
+        expires_at (datetime): Token expiry; the row is useless after it
+    """
     query = """
-    INSERT INTO otps (user_id, otp_code, expiry) 
+    INSERT INTO revoked_tokens (jti, user_id, expires_at)
     VALUES (%s, %s, %s)
+    ON CONFLICT (jti) DO NOTHING
     """
-    return execute_query(query, (user_id, otp_code, expiry))
+    return execute_query(query, (jti, user_id, expires_at))
 
-def get_valid_otp(user_id, otp_code):
-    """Get valid OTP for user"""
+def load_revoked_tokens(after_id=0):
+    """
+    Unexpired revocations with id > after_id
+    
+    Returns:
+        list: (id, jti, expires_at epoch seconds) tuples in id order
+    """
     query = """
-    SELECT * FROM otps 
-    WHERE user_id = %s AND otp_code = %s AND used = FALSE AND expiry > NOW()
-    ORDER BY created_at DESC LIMIT 1
+    SELECT id, jti, EXTRACT(EPOCH FROM expires_at)::float8 FROM revoked_tokens
+    WHERE id > %s AND expires_at > NOW()
+    ORDER BY id
     """
-    return execute_query(query, (user_id, otp_code), fetch_one=True)
+    return execute_query(query, (after_id,), fetch_all=True, record=_raw_row)
+
+def find_revocations(jtis):
+    """
+    Which of the given token ids are revoked and unexpired
+    
+    Used while a worker's revocation index has not loaded yet.
+    
+    Returns:
+        set: The revoked ones (jti or 'user:<id>' markers)
+    """
+    query = "SELECT jti FROM revoked_tokens WHERE jti = ANY(%s) AND expires_at > NOW()"
+    return {row[0] for row in execute_query(query, (list(jtis),), fetch_all=True, record=_raw_row)}
+
+def redeem_otp_ticket(nonce, user_id, expires_at):
+    """
+    Mark a stateless OTP ticket as spent
+    
+    Args:
+        nonce (str): Ticket handed out with the OTP
+        user_id (int): Owner of the ticket
+        expires_at (datetime): When the ticket's code stops verifying
+    
+    Returns:
+        bool: True the first time a ticket is redeemed, False afterwards
+    """
+    query = """
+    INSERT INTO otp_redemptions (nonce, user_id, expires_at)
+    VALUES (%s, %s, %s)
+    ON CONFLICT (nonce) DO NOTHING
+    RETURNING nonce
+    """
+    return execute_query(query, (nonce, user_id, expires_at), fetch_one=True) is not None
+
+def store_otp(user_id, otp_code, expiry):
+    """Store OTP for user"""
+    return execute_prepared('store_otp', (user_id, otp_code, expiry))
+
+def get_valid_otp(user_id, otp_code):
+    """Get valid OTP for user"""
+    return execute_prepared('get_valid_otp', (user_id, otp_code), fetch_one=True, record=Otp)
 
 def mark_otp_used(otp_id):
     """Mark OTP as used"""
@@ -150,9 +1013,96 @@ def mark_otp_used(otp_id):
 
 def count_recent_otps(user_id, hours=1):
     """Count recent OTPs for rate limiting"""
-    query = """
-    SELECT COUNT(*) as count FROM otps 
-    WHERE user_id = %s AND created_at > NOW() - INTERVAL '%s hours'
-    """
-    result = execute_query(query, (user_id, hours), fetch_one=True)
+    result = execute_prepared('count_recent_otps', (user_id, hours), fetch_one=True)
     return result['count'] if result else 0
+
+def issue_otp_if_under_quota(user_id, otp_code, expiry, max_otps=3, hours=1):
+    """
+    Store an OTP unless the user already reached the rate limit
+    
+    Counting and inserting happen in one statement, so issuing an OTP
+    costs a single round trip instead of count_recent_otps + store_otp.
+    Concurrent calls for one user are serialized by an advisory lock, so
+    the quota holds under READ COMMITTED.
+    
+    Args:
+        user_id (int): User identifier
+        otp_code (str): OTP to store
+        expiry (datetime): OTP expiry time
+        max_otps (int): OTPs allowed per window
+        hours (int): Rate limit window in hours
+    
+    Returns:
+        int: New OTP id, or None if the quota is exhausted
+    """
+    result = execute_prepared(
+        'issue_otp_if_under_quota',
+        (user_id, otp_code, expiry, hours, max_otps),
+        fetch_one=True
+    )
+    return result['id'] if result else None
+
+def issue_otp_for_account(account_number, otp_code, expiry, max_otps=3, hours=1):
+    """
+    Look up a user and store a rate-limited OTP in one round trip
+    
+    Args:
+        account_number (str): Account number of the user
+        otp_code (str): OTP to store
+        expiry (datetime): OTP expiry time
+        max_otps (int): OTPs allowed per window
+        hours (int): Rate limit window in hours
+    
+    Returns:
+        tuple: (User, otp_id) where otp_id is None if the quota is
+        exhausted, or (None, None) if the account does not exist
+    """
+    if not user_bloom.might_contain_account(account_number):
+        return None, None
+    
+    row = execute_prepared(
+        'issue_otp_for_account',
+        (account_number, otp_code, expiry, max_otps, hours),
+        fetch_one=True, record=_raw_row
+    )
+    if row is None:
+        user_bloom.record_false_positive()
+    return _split_user_row(row)
+
+def consume_otp_for_account(account_number, otp_code):
+    """
+    Atomically consume a matching OTP and return the user
+    
+    The newest valid OTP is locked and marked used by the same statement
+    that looks the user up. A concurrent verify of the same code blocks on
+    the row lock, re-checks used = FALSE and consumes nothing, so an OTP
+    can only ever be spent once.
+    
+    Args:
+        account_number (str): Account number of the user
+        otp_code (str): OTP submitted by the user
+    
+    Returns:
+        tuple: (User, otp_id) where otp_id is None if no valid OTP
+        matched, or (None, None) if the account does not exist
+    """
+    if not user_bloom.might_contain_account(account_number):
+        return None, None
+    
+    row = execute_prepared(
+        'consume_otp_for_account', (account_number, otp_code),
+        fetch_one=True, record=_raw_row
+    )
+    if row is None:
+        user_bloom.record_false_positive()
+    return _split_user_row(row)
+
+def _raw_row(*values):
+    """Row mapper that keeps the plain tuple"""
+    return values
+
+def _split_user_row(row):
+    """Split a user row with a trailing extra column into (User, extra)"""
+    if row is None:
+        return None, None
+    return User(*row[:-1]), row[-1]
@@ -0,0 +1,314 @@
+"""
+Buffered entropy for OTP generation
+
+Reading a few bytes from the OS per OTP costs a system call each time.
+EntropyPool reads a large block at once and hands it out in slices; the
+source is pluggable (os.urandom by default) so a hardware or remote
+random number generator can feed the same buffer.
+
+When QRNG_URL is set, codes come from a remote quantum random number
+generator instead. Its latency is kept off the request path by
+PrefetchingEntropyPool: a background thread keeps a ring buffer topped up
+from the provider and a read never waits for it. If the provider is slow
+or down and the buffer runs dry, reads fall back to os.urandom, so OTP
+latency stays the same whatever the provider does.
+
+Buffers are discarded after a fork: otherwise a parent and its children
+would hand out the same bytes, i.e. the same OTPs.
+"""
+import os
+import threading
+import time
+import urllib.request
+
+
+class EntropyPool:
+    """
+    Thread-safe buffer of random bytes refilled in bulk
+
+    Args:
+        source (callable): source(n) returns n random bytes
+        refill_size (int): Bytes fetched from the source per refill
+    """
+
+    def __init__(self, source=os.urandom, refill_size=4096):
+        self.source = source
+        self.refill_size = refill_size
+        self._lock = threading.Lock()
+        self._buffer = b''
+        self._offset = 0
+        self._pid = os.getpid()
+        self.refills = 0
+        self.bytes_served = 0
+
+    def read(self, n):
+        """
+        Take n bytes from the pool
+
+        Returns:
+            bytes: n random bytes, never handed out before
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._buffer = b''
+                self._offset = 0
+
+            available = len(self._buffer) - self._offset
+            if available < n:
+                # Keep the unread tail, then append at least one full refill
+                self._buffer = self._buffer[self._offset:] + self.source(max(self.refill_size, n - available))
+                self._offset = 0
+                self.refills += 1
+
+            chunk = self._buffer[self._offset:self._offset + n]
+            self._offset += n
+            self.bytes_served += n
+            return chunk
+
+    def stats(self):
+        """Buffer level and refill counters"""
+        return {
+            'buffered_bytes': len(self._buffer) - self._offset,
+            'refill_size': self.refill_size,
+            'refills': self.refills,
+            'bytes_served': self.bytes_served,
+        }
+
+
+class EntropyProvider:
+    """Source of random bytes for PrefetchingEntropyPool"""
+
+    name = 'provider'
+
+    def read(self, n):
+        """
+        Fetch n random bytes
+
+        Raises:
+            Exception: Any error; the pool backs off and retries
+        """
+        raise NotImplementedError
+
+
+class UrandomProvider(EntropyProvider):
+    """The operating system's CSPRNG"""
+
+    name = 'urandom'
+
+    def read(self, n):
+        return os.urandom(n)
+
+
+class HttpQrngProvider(EntropyProvider):
+    """
+    Remote random number generator over HTTP
+
+    GET <url>?bytes=<n> must answer with exactly n raw bytes
+    (scripts/qrng_standin_server.py serves this for local testing).
+
+    Args:
+        url (str): Endpoint of the generator
+        timeout (float): Seconds before a request is abandoned
+        api_key (str): Sent as "Authorization: Bearer <key>" if set
+    """
+
+    name = 'http'
+
+    def __init__(self, url, timeout=2.0, api_key=None):
+        self.url = url
+        self.timeout = timeout
+        self.api_key = api_key
+
+    def read(self, n):
+        separator = '&' if '?' in self.url else '?'
+        request = urllib.request.Request(f"{self.url}{separator}bytes={n}")
+        if self.api_key:
+            request.add_header('Authorization', f"Bearer {self.api_key}")
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            data = response.read(n + 1)
+        if len(data) != n:
+            raise ValueError(f"QRNG returned {len(data)} bytes, expected {n}")
+        return data
+
+
+class PrefetchingEntropyPool:
+    """
+    Ring buffer of provider bytes topped up by a background thread
+
+    Args:
+        provider (EntropyProvider): Where the bytes come from
+        capacity (int): Size of the ring buffer
+        low_watermark (int): Buffer level that wakes the refill thread
+        chunk_size (int): Bytes requested from the provider per call
+        fallback (callable): fallback(n) serves reads the buffer cannot
+        mix (bool): XOR provider bytes with fallback bytes, so the output
+            is never weaker than the fallback even if the provider is faulty
+        retry_seconds (float): First back-off after a provider error
+            (doubles up to MAX_RETRY_SECONDS)
+    """
+
+    MAX_RETRY_SECONDS = 60.0
+
+    def __init__(self, provider, capacity=65536, low_watermark=16384, chunk_size=4096,
+                 fallback=os.urandom, mix=True, retry_seconds=1.0):
+        self.provider = provider
+        self.capacity = capacity
+        self.low_watermark = low_watermark
+        self.chunk_size = chunk_size
+        self.fallback = fallback
+        self.mix = mix
+        self.retry_seconds = retry_seconds
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._ring = bytearray(capacity)
+        self._start = 0
+        self._level = 0
+        self._pid = None
+
+        self.fetches = 0
+        self.fetched_bytes = 0
+        self.fetch_ms_total = 0.0
+        self.fetched_at = 0.0
+        self.provider_errors = 0
+        self.consecutive_errors = 0
+        self.bytes_served = 0
+        self.fallback_reads = 0
+        self.fallback_bytes = 0
+
+    def start(self):
+        """Start this process's refill thread (reads start it on demand)"""
+        # The refill thread does not survive a fork, and bytes buffered
+        # before it would be handed out by every child
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._start = 0
+            self._level = 0
+            self._pid = os.getpid()
+        threading.Thread(target=self._refill, name='entropy-prefetch', daemon=True).start()
+
+    def _fetch(self, n):
+        started = time.perf_counter()
+        data = self.provider.read(n)
+        if self.mix:
+            data = (int.from_bytes(data, 'big') ^ int.from_bytes(self.fallback(n), 'big')).to_bytes(n, 'big')
+        self.fetches += 1
+        self.fetched_bytes += n
+        self.fetch_ms_total += (time.perf_counter() - started) * 1000
+        self.fetched_at = time.monotonic()
+        return data
+
+    def _put(self, data):
+        # Caller holds the lock
+        n = min(len(data), self.capacity - self._level)
+        end = (self._start + self._level) % self.capacity
+        first = min(n, self.capacity - end)
+        self._ring[end:end + first] = data[:first]
+        self._ring[:n - first] = data[first:n]
+        self._level += n
+
+    def _take(self, n):
+        # Caller holds the lock and checked the level
+        first = min(n, self.capacity - self._start)
+        chunk = bytes(self._ring[self._start:self._start + first]) + bytes(self._ring[:n - first])
+        self._start = (self._start + n) % self.capacity
+        self._level -= n
+        return chunk
+
+    def _refill(self):
+        delay = self.retry_seconds
+        while True:
+            with self._wake:
+                while self._level >= self.low_watermark:
+                    self._wake.wait()
+                room = self.capacity - self._level
+            # Top the buffer up completely once woken
+            while room > 0:
+                try:
+                    data = self._fetch(min(room, self.chunk_size))
+                except Exception as e:
+                    self.provider_errors += 1
+                    self.consecutive_errors += 1
+                    if self.consecutive_errors == 1:
+                        print(f"[ENTROPY] {self.provider.name} provider failed, serving os.urandom: {e}")
+                    time.sleep(delay)
+                    delay = min(delay * 2, self.MAX_RETRY_SECONDS)
+                    continue
+                if self.consecutive_errors:
+                    print(f"[ENTROPY] {self.provider.name} provider recovered after {self.consecutive_errors} error(s)")
+                self.consecutive_errors = 0
+                delay = self.retry_seconds
+                with self._lock:
+                    self._put(data)
+                    room = self.capacity - self._level
+
+    def read(self, n):
+        """
+        Take n bytes from the buffer, or from the fallback if it is short
+
+        Returns:
+            bytes: n random bytes, never handed out before
+        """
+        self.start()
+        with self._lock:
+            if self._level >= n:
+                chunk = self._take(n)
+                self.bytes_served += n
+                if self._level < self.low_watermark:
+                    self._wake.notify()
+                return chunk
+            self._wake.notify()
+            self.fallback_reads += 1
+            self.fallback_bytes += n
+        return self.fallback(n)
+
+    def stats(self):
+        """Buffer level, provider health and fallback counters"""
+        return {
+            'provider': self.provider.name,
+            'buffered_bytes': self._level if self._pid == os.getpid() else 0,
+            'capacity': self.capacity,
+            'low_watermark': self.low_watermark,
+            'fetches': self.fetches,
+            'fetched_bytes': self.fetched_bytes,
+            'fetch_avg_ms': round(self.fetch_ms_total / self.fetches, 3) if self.fetches else None,
+            'last_fetch_age_seconds': round(time.monotonic() - self.fetched_at, 1) if self.fetched_at else None,
+            'provider_errors': self.provider_errors,
+            'consecutive_errors': self.consecutive_errors,
+            'bytes_served': self.bytes_served,
+            'fallback_reads': self.fallback_reads,
+            'fallback_bytes': self.fallback_bytes,
+        }
+
+
+def load_entropy_pool():
+    """
+    Entropy pool for OTPs as configured by the environment
+
+    QRNG_URL selects the prefetching pool over a remote generator;
+    otherwise os.urandom is read in OTP_ENTROPY_BUFFER_BYTES blocks.
+    """
+    url = os.getenv('QRNG_URL')
+    if not url:
+        return EntropyPool(refill_size=int(os.getenv('OTP_ENTROPY_BUFFER_BYTES', '4096')))
+
+    capacity = int(os.getenv('QRNG_BUFFER_BYTES', '65536'))
+    provider = HttpQrngProvider(
+        url,
+        timeout=float(os.getenv('QRNG_TIMEOUT', '2')),
+        api_key=os.getenv('QRNG_API_KEY'),
+    )
+    return PrefetchingEntropyPool(
+        provider,
+        capacity=capacity,
+        low_watermark=int(os.getenv('QRNG_LOW_WATERMARK_BYTES', str(capacity // 4))),
+        chunk_size=int(os.getenv('QRNG_CHUNK_BYTES', '4096')),
+        mix=os.getenv('QRNG_MIX_URANDOM', 'true').lower() == 'true',
+    )
+
+
+# Global pool used by utils.quantum_otp
+entropy_pool = load_entropy_pool()
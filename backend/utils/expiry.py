@@ -0,0 +1,333 @@
+"""
+Expiry of short-lived rows (OTPs, spent OTP tickets, revoked tokens)
+
+Rows like OTPs are useless minutes after they are written but were never
+deleted, so otps and its indexes grew without bound. ExpiryPurger deletes
+them in small chunks on its own autocommit connection, pausing between
+chunks, so each DELETE holds its row locks for milliseconds and never
+joins a request's unit of work:
+
+- OTPs issued by this process are tracked in a hierarchical TimingWheel
+  and deleted by primary key shortly after they stop mattering
+- a periodic sweep deletes everything else that is due (rows from other
+  processes, from before a restart, other tables) through the expiry
+  indexes, with FOR UPDATE SKIP LOCKED so concurrent purgers never wait on
+  each other
+
+It runs on a background thread in every worker (EXPIRY_PURGE=true) or on
+its own via scripts/purge_expired.py.
+"""
+import os
+import threading
+import time
+
+import psycopg2
+import psycopg2.errors
+
+from utils.db import db_pool
+
+
+class TimingWheel:
+    """
+    Hierarchical timing wheel of (key, deadline) entries
+
+    Level 0 has one slot per tick; each higher level's slot spans a full
+    turn of the level below and is cascaded down when that turn begins, so
+    scheduling is O(1) and advancing costs O(1) per tick plus each entry's
+    few cascades. Deadlines beyond the top level wait in an overflow list.
+    Entries fire at the first tick boundary at or after their deadline.
+
+    Args:
+        tick (float): Seconds per level-0 slot
+        slots (int): Slots per level
+        levels (int): Number of levels (horizon: tick * slots ** levels)
+        now (float): Start time (default: time.time())
+    """
+
+    def __init__(self, tick=1.0, slots=64, levels=3, now=None):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self._spans = [slots ** level for level in range(levels + 1)]
+        self._wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+        self._overflow = []
+        self._current = int((time.time() if now is None else now) // tick)
+        self._lock = threading.Lock()
+        self.size = 0
+
+    def _insert(self, key, due, fired):
+        delta = due - self._current
+        if delta <= 0:
+            fired.append(key)
+            self.size -= 1
+            return
+        for level in range(self.levels):
+            if delta < self._spans[level + 1]:
+                slot = (due // self._spans[level]) % self.slots
+                self._wheels[level][slot].append((key, due))
+                return
+        self._overflow.append((key, due))
+
+    def schedule(self, key, deadline):
+        """Add key, to be returned by advance() once deadline has passed"""
+        due = -int(-deadline // self.tick)
+        with self._lock:
+            self.size += 1
+            fired = []
+            self._insert(key, max(due, self._current + 1), fired)
+
+    def advance(self, now=None):
+        """
+        Move the wheel to now
+
+        Returns:
+            list: Keys whose deadline has passed, in deadline order per tick
+        """
+        target = int((time.time() if now is None else now) // self.tick)
+        fired = []
+        with self._lock:
+            while self._current < target:
+                self._current += 1
+                tick = self._current
+                # Cascade from the top so entries can fall several levels
+                if tick % self._spans[self.levels] == 0:
+                    overflow, self._overflow = self._overflow, []
+                    for key, due in overflow:
+                        self._insert(key, due, fired)
+                for level in range(self.levels - 1, 0, -1):
+                    if tick % self._spans[level] == 0:
+                        slot = (tick // self._spans[level]) % self.slots
+                        entries, self._wheels[level][slot] = self._wheels[level][slot], []
+                        for key, due in entries:
+                            self._insert(key, due, fired)
+                slot = tick % self.slots
+                entries, self._wheels[0][slot] = self._wheels[0][slot], []
+                fired.extend(key for key, _ in entries)
+                self.size -= len(entries)
+        return fired
+
+    def next_deadline(self):
+        """Time of the next level-0 tick (when advance() may return keys)"""
+        return (self._current + 1) * self.tick
+
+
+class PurgeTarget:
+    """
+    A table whose rows expire
+
+    Args:
+        table (str): Table name
+        key (str): Primary key column
+        condition (str): SQL predicate true for rows that may be deleted;
+            must be cheap to check through an index
+        params (tuple): Parameters of condition
+    """
+
+    def __init__(self, table, key, condition, params=()):
+        self.table = table
+        self.key = key
+        self.condition = condition
+        self.params = tuple(params)
+        self.sweep_query = f"""
+            DELETE FROM {table} WHERE {key} IN (
+                SELECT {key} FROM {table} WHERE {condition}
+                LIMIT %s FOR UPDATE SKIP LOCKED
+            )
+        """
+        self.keys_query = f"DELETE FROM {table} WHERE {key} = ANY(%s) AND {condition}"
+
+        self.rows_purged = 0
+        self.chunks = 0
+        self.lock_ms_total = 0.0
+        self.lock_ms_max = 0.0
+        self.errors = 0
+        self.swept_at = 0.0
+
+    def stats(self):
+        return {
+            'rows_purged': self.rows_purged,
+            'chunks': self.chunks,
+            'lock_avg_ms': round(self.lock_ms_total / self.chunks, 3) if self.chunks else None,
+            'lock_max_ms': round(self.lock_ms_max, 3),
+            'errors': self.errors,
+            'last_sweep_age_seconds': round(time.monotonic() - self.swept_at, 1) if self.swept_at else None,
+        }
+
+
+class ExpiryPurger:
+    """
+    Chunked, paced deletion of expired rows
+
+    Args:
+        targets (list): PurgeTarget per table; the first one's keys can be
+            tracked in the timing wheel
+        batch_size (int): Rows per DELETE
+        pause_ms (float): Pause between chunks, to leave room for other work
+        max_chunks (int): Chunks per table per sweep (the rest waits for
+            the next sweep)
+        sweep_interval (float): Seconds between sweeps (0: wheel only)
+        wheel (TimingWheel): Deadlines of tracked keys
+        enabled (bool): Run in this process (track() and start() are no-ops
+            otherwise; sweep() can still be called directly)
+    """
+
+    def __init__(self, targets, batch_size=500, pause_ms=50.0, max_chunks=100,
+                 sweep_interval=300.0, wheel=None, enabled=True):
+        self.targets = targets
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.pause_ms = pause_ms
+        self.max_chunks = max_chunks
+        self.sweep_interval = sweep_interval
+        self.wheel = wheel or TimingWheel()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._due = []
+        self.runs = 0
+
+    def track(self, key, deadline):
+        """Schedule a row of the first target for deletion after deadline"""
+        if not self.enabled:
+            return
+        self.start()
+        self.wheel.schedule(key, deadline)
+
+    def _delete(self, target, query, params):
+        connection = None
+        broken = False
+        started = time.perf_counter()
+        try:
+            connection = db_pool.get_connection()
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                started = time.perf_counter()
+                cursor.execute(query, params)
+                deleted = cursor.rowcount
+        except Exception as e:
+            if not isinstance(e, psycopg2.errors.UndefinedTable):
+                target.errors += 1
+            broken = isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+            raise
+        finally:
+            if connection:
+                db_pool.return_connection(connection, close=broken)
+
+        # Each chunk is its own transaction: this is how long it held its locks
+        lock_ms = (time.perf_counter() - started) * 1000
+        target.rows_purged += deleted
+        target.chunks += 1
+        target.lock_ms_total += lock_ms
+        target.lock_ms_max = max(target.lock_ms_max, lock_ms)
+        return deleted
+
+    def _pause(self):
+        if self.pause_ms:
+            time.sleep(self.pause_ms / 1000)
+
+    def purge_due(self):
+        """
+        Delete tracked rows whose deadline passed, by primary key
+
+        Returns:
+            int: Rows deleted
+        """
+        target = self.targets[0]
+        self._due.extend(self.wheel.advance())
+        deleted = 0
+        while self._due:
+            chunk = self._due[:self.batch_size]
+            deleted += self._delete(target, target.keys_query, (chunk,) + target.params)
+            del self._due[:len(chunk)]
+            if self._due:
+                self._pause()
+        return deleted
+
+    def sweep(self):
+        """
+        Delete due rows of every target, a chunk at a time
+
+        Returns:
+            int: Rows deleted
+        """
+        deleted = 0
+        for target in self.targets:
+            try:
+                for _ in range(self.max_chunks):
+                    count = self._delete(target, target.sweep_query, target.params + (self.batch_size,))
+                    deleted += count
+                    if count < self.batch_size:
+                        break
+                    self._pause()
+            except psycopg2.errors.UndefinedTable:
+                # Tables of unused features may be missing from older schemas
+                continue
+            except Exception as e:
+                print(f"[EXPIRY] Sweep of {target.table} failed: {e}")
+                continue
+            target.swept_at = time.monotonic()
+        self.runs += 1
+        return deleted
+
+    def _run(self):
+        next_sweep = time.monotonic()
+        while True:
+            try:
+                if self.sweep_interval and time.monotonic() >= next_sweep:
+                    next_sweep = time.monotonic() + self.sweep_interval
+                    self.sweep()
+                self.purge_due()
+            except Exception as e:
+                # Keys that failed stay in _due and are retried next tick
+                print(f"[EXPIRY] Purge failed: {e}")
+            time.sleep(max(self.wheel.next_deadline() - time.time(), self.wheel.tick / 10))
+
+    def start(self):
+        """Start this process's purge thread (track() starts it on demand)"""
+        if not self.enabled:
+            return
+        # The purge thread does not survive a fork; keys tracked before it
+        # belong to the parent
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self.wheel = TimingWheel(self.wheel.tick, self.wheel.slots, self.wheel.levels)
+            self._due = []
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name='expiry-purger', daemon=True).start()
+
+    def stats(self):
+        """Tracked keys and per-table purge counters"""
+        return {
+            'enabled': self.enabled,
+            'tracked': self.wheel.size,
+            'pending': len(self._due),
+            'batch_size': self.batch_size,
+            'pause_ms': self.pause_ms,
+            'sweep_interval': self.sweep_interval,
+            'sweeps': self.runs,
+            'tables': {target.table: target.stats() for target in self.targets},
+        }
+
+
+# OTP rows also back the rate limit, so they are kept for at least that window
+OTP_RETENTION_HOURS = int(os.getenv('OTP_RETENTION_HOURS', '1'))
+
+EXPIRY_TARGETS = [
+    PurgeTarget('otps', 'id',
+                "expiry < NOW() AND created_at < NOW() - %s * INTERVAL '1 hour'",
+                (OTP_RETENTION_HOURS,)),
+    PurgeTarget('otp_redemptions', 'nonce', "expires_at < NOW()"),
+    PurgeTarget('revoked_tokens', 'id', "expires_at < NOW()"),
+]
+
+# Global purger, fed by utils.otp_store and started per worker
+expiry_purger = ExpiryPurger(
+    EXPIRY_TARGETS,
+    batch_size=int(os.getenv('EXPIRY_BATCH_SIZE', '500')),
+    pause_ms=float(os.getenv('EXPIRY_PAUSE_MS', '50')),
+    max_chunks=int(os.getenv('EXPIRY_MAX_CHUNKS', '100')),
+    sweep_interval=float(os.getenv('EXPIRY_SWEEP_INTERVAL', '300')),
+    enabled=os.getenv('EXPIRY_PURGE', 'true').lower() == 'true',
+)
@@ -0,0 +1,177 @@
+"""
+Bounded executor for bcrypt work
+
+bcrypt at a realistic cost takes hundreds of milliseconds of CPU. Running
+it on request threads lets a burst of logins occupy every gunicorn thread
+while cheap dashboard requests wait. Here hashing runs on a fixed set of
+worker threads (bcrypt releases the GIL, so they use every core) fed by a
+bounded priority queue:
+
+- login verification (PRIORITY_VERIFY) is served before new hashes for
+  registrations (PRIORITY_HASH), and hashes may only fill half the queue
+- when the queue is full, or a job waited longer than max_wait_ms before a
+  worker picked it up, the caller gets HashingOverloadedError at once and
+  the route answers 503 instead of timing out
+"""
+import itertools
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+PRIORITY_VERIFY = 0
+PRIORITY_HASH = 1
+_PRIORITY_NAMES = {PRIORITY_VERIFY: 'verify', PRIORITY_HASH: 'hash'}
+
+
+class HashingOverloadedError(Exception):
+    """Raised when the hashing queue cannot take or start a job in time"""
+
+
+class _PriorityStats:
+    __slots__ = ('submitted', 'completed', 'rejected', 'expired',
+                 'wait_ms_total', 'wait_ms_max', 'run_ms_total')
+
+    def __init__(self):
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.expired = 0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+        self.run_ms_total = 0.0
+
+    def as_dict(self):
+        started = self.completed or 1
+        return {
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'expired': self.expired,
+            'queue_wait_avg_ms': round(self.wait_ms_total / started, 3),
+            'queue_wait_max_ms': round(self.wait_ms_max, 3),
+            'run_avg_ms': round(self.run_ms_total / started, 3),
+        }
+
+
+class HashingExecutor:
+    """
+    Priority thread pool with admission control
+
+    Args:
+        workers (int): Worker threads (0 runs jobs inline on the caller)
+        max_queue (int): Jobs allowed to wait; further submissions fail fast
+        max_wait_ms (float): Jobs not started within this are dropped
+    """
+
+    def __init__(self, workers=None, max_queue=64, max_wait_ms=2000.0):
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.max_queue = max_queue
+        self.max_wait_ms = max_wait_ms
+        self._lock = threading.Lock()
+        self._queue = None
+        self._pid = None
+        self._sequence = itertools.count()
+        self._active = 0
+        self._stats = {priority: _PriorityStats() for priority in _PRIORITY_NAMES}
+
+    def _ensure_started(self):
+        # Worker threads do not survive a fork; start them per process
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.PriorityQueue()
+            self._active = 0
+            for index in range(self.workers):
+                threading.Thread(target=self._work, name=f'hashing-{index}', daemon=True).start()
+            self._pid = os.getpid()
+
+    def _work(self):
+        jobs = self._queue
+        while True:
+            priority, _, enqueued_at, future, fn, args = jobs.get()
+            stats = self._stats[priority]
+            waited_ms = (time.perf_counter() - enqueued_at) * 1000
+            if waited_ms > self.max_wait_ms:
+                stats.expired += 1
+                future.set_exception(HashingOverloadedError("Hashing job expired in queue"))
+                continue
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            with self._lock:
+                self._active += 1
+            started = time.perf_counter()
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                run_ms = (time.perf_counter() - started) * 1000
+                with self._lock:
+                    self._active -= 1
+                    stats.completed += 1
+                    stats.wait_ms_total += waited_ms
+                    stats.wait_ms_max = max(stats.wait_ms_max, waited_ms)
+                    stats.run_ms_total += run_ms
+
+    def submit(self, priority, fn, *args):
+        """
+        Queue fn(*args) and return a Future for its result
+
+        Raises:
+            HashingOverloadedError: If the queue has no room at this priority
+        """
+        future = Future()
+        if not self.workers:
+            future.set_running_or_notify_cancel()
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        self._ensure_started()
+        stats = self._stats[priority]
+        limit = self.max_queue if priority == PRIORITY_VERIFY else self.max_queue // 2
+        with self._lock:
+            if self._queue.qsize() >= limit:
+                stats.rejected += 1
+                raise HashingOverloadedError("Hashing queue is full")
+            stats.submitted += 1
+        self._queue.put((priority, next(self._sequence), time.perf_counter(), future, fn, args))
+        return future
+
+    def run(self, priority, fn, *args):
+        """
+        Run fn(*args) on a worker and wait for the result
+
+        Raises:
+            HashingOverloadedError: If the job is rejected or expires queued
+        """
+        return self.submit(priority, fn, *args).result()
+
+    def stats(self):
+        """Queue depth, busy workers and per-priority counters"""
+        return {
+            'workers': self.workers,
+            'active': self._active,
+            'queued': self._queue.qsize() if self._queue is not None and self._pid == os.getpid() else 0,
+            'max_queue': self.max_queue,
+            'max_wait_ms': self.max_wait_ms,
+            'priorities': {name: self._stats[priority].as_dict()
+                           for priority, name in _PRIORITY_NAMES.items()},
+        }
+
+
+_workers = os.getenv('HASHING_WORKERS')
+
+# Global executor used by utils.security
+hashing_executor = HashingExecutor(
+    workers=int(_workers) if _workers else None,
+    max_queue=int(os.getenv('HASHING_MAX_QUEUE', '64')),
+    max_wait_ms=float(os.getenv('HASHING_MAX_WAIT_MS', '2000')),
+)
@@ -0,0 +1,415 @@
+"""
+OTP storage backends
+
+OtpStore is what the auth routes issue and consume OTPs through:
+
+- PostgresOtpStore (OTP_STORE=postgres, the default) keeps every OTP as a
+  row in otps, issued and consumed by single statements
+- MemoryOtpStore (OTP_STORE=memory) keeps them in a ShardedOtpTable. OTPs
+  live for minutes, so a durable row per login is mostly write load; here
+  issue and consume touch no database at all. Issued/consumed events are
+  queued and written to otp_events in batches for the audit trail.
+
+With several gunicorn workers the table lives in one coordinator process
+started by gunicorn.conf.py (start_otp_coordinator) and every worker talks
+to it over a local socket, so a code issued by one worker verifies on any
+other and the rate limit is global. Without a coordinator (flask run, a
+single process) the table is kept in-process. OTPs in memory do not
+survive a restart of the coordinator; users then simply request a new one.
+"""
+import hmac
+import os
+import secrets
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from multiprocessing.managers import BaseManager
+
+from utils.bulk import WriteBehindQueue
+from utils.db import (
+    consume_otp_for_account, get_user_by_account,
+    issue_otp_for_account, issue_otp_if_under_quota
+)
+from utils.expiry import expiry_purger
+
+
+class OtpStore:
+    """Interface of an OTP backend"""
+
+    name = 'store'
+
+    def issue(self, user, otp_code, expiry, max_otps, hours):
+        """
+        Store an OTP for a known user unless the rate limit is reached
+
+        Args:
+            user (User): Owner of the OTP
+            otp_code (str): The code
+            expiry (datetime): When the code stops verifying
+            max_otps (int): OTPs allowed per window
+            hours (int): Rate limit window in hours
+
+        Returns:
+            bool: False if the user is rate limited
+        """
+        raise NotImplementedError
+
+    def issue_for_account(self, account_number, otp_code, expiry, max_otps, hours):
+        """
+        Look a user up and store an OTP for them
+
+        Returns:
+            tuple: (User, issued), or (None, False) for an unknown account
+        """
+        raise NotImplementedError
+
+    def consume_for_account(self, account_number, otp_code):
+        """
+        Spend a matching, unexpired OTP (at most once)
+
+        Returns:
+            tuple: (User, consumed), or (None, False) for an unknown account
+        """
+        raise NotImplementedError
+
+    def stats(self):
+        return {'backend': self.name}
+
+
+class PostgresOtpStore(OtpStore):
+    """
+    OTPs as rows of the otps table
+
+    New rows are handed to the expiry purger, which deletes them once they
+    have expired and left the rate limit window.
+    """
+
+    name = 'postgres'
+
+    def _track(self, otp_id, expiry, hours):
+        if otp_id is not None:
+            expiry_purger.track(otp_id, max(expiry.timestamp(), time.time() + hours * 3600))
+
+    def issue(self, user, otp_code, expiry, max_otps, hours):
+        otp_id = issue_otp_if_under_quota(user.id, otp_code, expiry, max_otps=max_otps, hours=hours)
+        self._track(otp_id, expiry, hours)
+        return otp_id is not None
+
+    def issue_for_account(self, account_number, otp_code, expiry, max_otps, hours):
+        user, otp_id = issue_otp_for_account(account_number, otp_code, expiry, max_otps=max_otps, hours=hours)
+        self._track(otp_id, expiry, hours)
+        return user, otp_id is not None
+
+    def consume_for_account(self, account_number, otp_code):
+        user, otp_id = consume_otp_for_account(account_number, otp_code)
+        return user, otp_id is not None
+
+
+class ShardedOtpTable:
+    """
+    OTPs and issue times per user, split over independently locked shards
+
+    Args:
+        shards (int): Number of shards (user_id % shards)
+        sweep_interval (float): Seconds between sweeps of expired entries
+            (0 disables the sweeper thread)
+    """
+
+    def __init__(self, shards=16, sweep_interval=30.0):
+        self._shards = [(threading.Lock(), {}) for _ in range(shards)]
+        self.issued = 0
+        self.consumed = 0
+        self.rejected = 0
+        if sweep_interval:
+            threading.Thread(target=self._sweep, args=(sweep_interval,),
+                             name='otp-sweeper', daemon=True).start()
+
+    def _shard(self, user_id):
+        return self._shards[user_id % len(self._shards)]
+
+    def issue(self, user_id, otp_code, expires_at, max_otps, window_seconds):
+        """
+        Add an OTP unless max_otps were issued within window_seconds
+
+        Returns:
+            bool: False if the user is rate limited
+        """
+        now = time.time()
+        lock, users = self._shard(user_id)
+        with lock:
+            codes, issued_at = users.get(user_id, ([], []))
+            issued_at = [at for at in issued_at if at > now - window_seconds]
+            if len(issued_at) >= max_otps:
+                self.rejected += 1
+                return False
+            issued_at.append(now)
+            codes = [entry for entry in codes if entry[1] > now]
+            codes.append((otp_code, expires_at))
+            users[user_id] = (codes, issued_at)
+            self.issued += 1
+            return True
+
+    def consume(self, user_id, otp_code):
+        """
+        Remove a matching unexpired OTP
+
+        Returns:
+            bool: True if one was found (it can never match again)
+        """
+        now = time.time()
+        lock, users = self._shard(user_id)
+        with lock:
+            entry = users.get(user_id)
+            if entry is None:
+                return False
+            codes = entry[0]
+            for index in range(len(codes) - 1, -1, -1):
+                code, expires_at = codes[index]
+                if expires_at > now and hmac.compare_digest(code, otp_code):
+                    del codes[index]
+                    self.consumed += 1
+                    return True
+            return False
+
+    def purge(self, window_seconds=3600):
+        """
+        Drop expired OTPs and issue times older than window_seconds
+
+        Returns:
+            int: Users removed from the table
+        """
+        now = time.time()
+        removed = 0
+        for lock, users in self._shards:
+            with lock:
+                for user_id in list(users):
+                    codes, issued_at = users[user_id]
+                    codes[:] = [entry for entry in codes if entry[1] > now]
+                    issued_at[:] = [at for at in issued_at if at > now - window_seconds]
+                    if not codes and not issued_at:
+                        del users[user_id]
+                        removed += 1
+        return removed
+
+    def _sweep(self, interval):
+        while True:
+            time.sleep(interval)
+            self.purge()
+
+    def stats(self):
+        """Entry counts and totals"""
+        return {
+            'shards': len(self._shards),
+            'users': sum(len(users) for _, users in self._shards),
+            'otps': sum(len(codes) for _, users in self._shards for codes, _ in list(users.values())),
+            'issued': self.issued,
+            'consumed': self.consumed,
+            'rate_limited': self.rejected,
+        }
+
+
+_shared_table = None
+_shared_table_lock = threading.Lock()
+
+
+def _get_shared_table():
+    # Runs in the coordinator process: one table for every worker
+    global _shared_table
+    with _shared_table_lock:
+        if _shared_table is None:
+            _shared_table = ShardedOtpTable(shards=int(os.getenv('OTP_STORE_SHARDS', '16')))
+    return _shared_table
+
+
+class OtpCoordinator(BaseManager):
+    """Manager process serving the shared ShardedOtpTable"""
+
+
+OtpCoordinator.register('otp_table', callable=_get_shared_table,
+                        exposed=('issue', 'consume', 'purge', 'stats'))
+
+
+def coordinator_authkey():
+    """
+    Key workers authenticate to the coordinator with
+
+    Anything that connects with it can read and write OTP state, so it is
+    never derived from configuration: start_otp_coordinator() generates a
+    random one and hands it to the coordinator and the workers through
+    OTP_STORE_AUTHKEY.
+    """
+    key = os.getenv('OTP_STORE_AUTHKEY')
+    if not key:
+        raise RuntimeError("OTP_STORE_AUTHKEY must be set to connect to the OTP coordinator")
+    return bytes.fromhex(key)
+
+
+def start_otp_coordinator(address=None, timeout=10.0):
+    """
+    Start the coordinator process (from the gunicorn master)
+
+    It runs as a separate program (python -m utils.otp_store), not a
+    multiprocessing child, so forked workers do not inherit it as theirs.
+    Sets OTP_STORE_ADDRESS and a freshly generated OTP_STORE_AUTHKEY so
+    the coordinator and workers forked afterwards share them.
+
+    Args:
+        address (str): Unix socket path (default: a new temporary directory)
+        timeout (float): Seconds to wait for it to accept connections
+
+    Returns:
+        subprocess.Popen: The coordinator; terminate() it on exit
+    """
+    if address is None:
+        address = os.path.join(tempfile.mkdtemp(prefix='otp-coordinator-'), 'otp.sock')
+    os.environ['OTP_STORE_AUTHKEY'] = secrets.token_hex(32)
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen([sys.executable, '-m', 'utils.otp_store', address], cwd=backend_dir)
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            OtpCoordinator(address=address, authkey=coordinator_authkey()).connect()
+            break
+        except OSError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                raise RuntimeError(f"OTP coordinator did not start on {address}")
+            time.sleep(0.05)
+
+    os.environ['OTP_STORE_ADDRESS'] = address
+    return process
+
+
+def _serve_coordinator(address):
+    parent = os.getppid()
+
+    def stop(*_):
+        try:
+            os.unlink(address)
+            os.rmdir(os.path.dirname(address))
+        except OSError:
+            pass
+        os._exit(0)
+
+    def watch_parent():
+        # Exit with the gunicorn master, even if it was killed outright
+        while os.getppid() == parent:
+            time.sleep(1)
+        stop()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    threading.Thread(target=watch_parent, name='otp-coordinator-parent', daemon=True).start()
+    server = OtpCoordinator(address=address, authkey=coordinator_authkey()).get_server()
+    print(f"[OTP-STORE] Coordinator listening on {address}")
+    server.serve_forever()
+
+
+class MemoryOtpStore(OtpStore):
+    """
+    OTPs in a ShardedOtpTable, with a write-behind audit log
+
+    Args:
+        address: Coordinator address (default: OTP_STORE_ADDRESS, read at
+            first use so workers see the address set by the master)
+        audit (WriteBehindQueue): Receives (user_id, event, created_at) rows
+        shards (int): Shards of the in-process table used without a coordinator
+    """
+
+    name = 'memory'
+
+    def __init__(self, address=None, audit=None, shards=16):
+        self.address = address
+        self.audit = audit
+        self.shards = shards
+        self._lock = threading.Lock()
+        self._table = None
+        self._pid = None
+        self.coordinator = None
+
+    def _get_table(self):
+        # Proxies hold sockets that must not be shared with a forked child
+        if self._pid == os.getpid():
+            return self._table
+        with self._lock:
+            if self._pid != os.getpid():
+                address = self.address or os.getenv('OTP_STORE_ADDRESS')
+                if address:
+                    coordinator = OtpCoordinator(address=address, authkey=coordinator_authkey())
+                    coordinator.connect()
+                    self._table = coordinator.otp_table()
+                    self.coordinator = address
+                else:
+                    self._table = ShardedOtpTable(shards=self.shards)
+                    self.coordinator = None
+                self._pid = os.getpid()
+        return self._table
+
+    def _call(self, method, *args):
+        try:
+            return getattr(self._get_table(), method)(*args)
+        except (OSError, EOFError):
+            # Coordinator restarted or gone: reconnect on the next call
+            self._pid = None
+            raise
+
+    def _record(self, user_id, event):
+        if self.audit is not None:
+            self.audit.append((user_id, event, datetime.now(timezone.utc)))
+
+    def issue(self, user, otp_code, expiry, max_otps, hours):
+        issued = self._call('issue', user.id, otp_code, expiry.timestamp(), max_otps, hours * 3600)
+        self._record(user.id, 'issued' if issued else 'rate_limited')
+        return issued
+
+    def issue_for_account(self, account_number, otp_code, expiry, max_otps, hours):
+        user = get_user_by_account(account_number)
+        if not user:
+            return None, False
+        return user, self.issue(user, otp_code, expiry, max_otps, hours)
+
+    def consume_for_account(self, account_number, otp_code):
+        user = get_user_by_account(account_number)
+        if not user:
+            return None, False
+        consumed = self._call('consume', user.id, otp_code)
+        self._record(user.id, 'consumed' if consumed else 'rejected')
+        return user, consumed
+
+    def stats(self):
+        """Table counters (from the coordinator if there is one) and audit queue"""
+        try:
+            table = self._call('stats')
+        except Exception as e:
+            table = {'error': str(e)}
+        return {
+            'backend': self.name,
+            'coordinator': self.coordinator,
+            'table': table,
+            'audit': self.audit.stats() if self.audit is not None else None,
+        }
+
+
+def load_otp_store():
+    """OTP backend as configured by OTP_STORE"""
+    if os.getenv('OTP_STORE', 'postgres').lower() != 'memory':
+        return PostgresOtpStore()
+    audit = WriteBehindQueue(
+        'otp_events', ['user_id', 'event', 'created_at'],
+        batch_size=int(os.getenv('OTP_AUDIT_BATCH_SIZE', '500')),
+        flush_interval=float(os.getenv('OTP_AUDIT_FLUSH_INTERVAL', '1')),
+    )
+    return MemoryOtpStore(audit=audit, shards=int(os.getenv('OTP_STORE_SHARDS', '16')))
+
+
+# Global store used by routes.auth
+otp_store = load_otp_store()
+
+
+if __name__ == '__main__':
+    _serve_coordinator(sys.argv[1])
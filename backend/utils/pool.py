@@ -0,0 +1,312 @@
+"""
+Thread-safe bounded connection pool for PostgreSQL
+
+psycopg2's SimpleConnectionPool is not safe to share between threads and has
+no way to wait for a free connection, so under gunicorn's threaded workers an
+exhausted pool used to fall back to opening a new connection per query. This
+pool keeps a hard upper bound, makes callers wait (with a timeout) for a
+connection to be returned, checks liveness on checkout and recycles
+connections that are too old or have been idle too long.
+"""
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2 import extensions
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection becomes available within the wait timeout"""
+
+
+class PooledConnection(extensions.connection):
+    """psycopg2 connection that carries pool bookkeeping"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        # Names of server-side prepared statements on this session
+        self.prepared_statements = set()
+
+
+class BoundedConnectionPool:
+    """
+    Bounded, thread-safe connection pool with a wait queue
+
+    Args:
+        dsn (str): Connection string passed to psycopg2.connect
+        minconn (int): Connections opened eagerly by warm_up()
+        maxconn (int): Hard limit of open connections
+        timeout (float): Seconds getconn() waits for a free connection
+        max_age (float): Recycle connections older than this (0 = never)
+        max_idle (float): Close idle connections unused for this long (0 = never)
+        ping_after (float): Ping connections idle longer than this on checkout
+    """
+
+    def __init__(self, dsn, minconn=1, maxconn=10, timeout=5.0,
+                 max_age=1800.0, max_idle=300.0, ping_after=30.0):
+        if maxconn < 1:
+            raise ValueError("maxconn must be at least 1")
+
+        self.dsn = dsn
+        self.minconn = max(0, min(minconn, maxconn))
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_age = max_age
+        self.max_idle = max_idle
+        self.ping_after = ping_after
+
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._idle = deque()
+        self._in_use = set()
+        self._opening = 0
+        self._waiting = 0
+        self._closed = False
+
+        # Counters exposed through stats()
+        self._checkouts = 0
+        self._timeouts = 0
+        self._opened = 0
+        self._recycled = 0
+        self._failed_pings = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _connect(self):
+        """Open a new physical connection"""
+        return psycopg2.connect(self.dsn, connection_factory=PooledConnection)
+
+    def _is_expired(self, connection, now):
+        """Check whether a connection should be recycled instead of reused"""
+        if connection.closed:
+            return True
+        if self.max_age and now - connection.created_at > self.max_age:
+            return True
+        if self.max_idle and now - connection.last_used > self.max_idle:
+            return True
+        return False
+
+    def _is_alive(self, connection):
+        """Liveness check run on checkout"""
+        if connection.closed:
+            return False
+        status = connection.get_transaction_status()
+        if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if time.monotonic() - connection.last_used < self.ping_after:
+            return True
+        try:
+            if status != extensions.TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            if not connection.autocommit:
+                connection.rollback()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _discard(connection):
+        """Close a connection, ignoring errors from already-broken sockets"""
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def getconn(self, timeout=None):
+        """
+        Check a connection out of the pool
+
+        Args:
+            timeout (float): Override the pool's wait timeout
+
+        Returns:
+            PooledConnection: A live connection owned by the caller
+
+        Raises:
+            PoolTimeoutError: If the pool stayed exhausted for the whole timeout
+        """
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+
+        while True:
+            connection = None
+            stale = []
+            with self._lock:
+                if self._closed:
+                    raise psycopg2.InterfaceError("connection pool is closed")
+
+                while True:
+                    now = time.monotonic()
+                    # Reuse the most recently returned connection first so
+                    # rarely used ones age out through max_idle
+                    while self._idle:
+                        candidate = self._idle.pop()
+                        if self._is_expired(candidate, now):
+                            stale.append(candidate)
+                            continue
+                        connection = candidate
+                        break
+                    if connection is not None:
+                        break
+                    if len(self._in_use) + self._opening < self.maxconn:
+                        self._opening += 1
+                        break
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeoutError(
+                            f"No database connection available after {timeout:.1f}s "
+                            f"(max {self.maxconn} in use)"
+                        )
+                    self._waiting += 1
+                    try:
+                        self._available.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+                self._recycled += len(stale)
+                if connection is not None:
+                    self._in_use.add(connection)
+
+            for candidate in stale:
+                self._discard(candidate)
+
+            if connection is None:
+                # We reserved a slot above; open outside the lock
+                try:
+                    connection = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._opening -= 1
+                        self._available.notify()
+                    raise
+                with self._lock:
+                    self._opening -= 1
+                    self._opened += 1
+                    self._in_use.add(connection)
+            elif not self._is_alive(connection):
+                with self._lock:
+                    self._in_use.discard(connection)
+                    self._failed_pings += 1
+                    self._available.notify()
+                self._discard(connection)
+                continue
+
+            waited = time.monotonic() - started
+            with self._lock:
+                self._checkouts += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+            return connection
+
+    def putconn(self, connection, close=False):
+        """
+        Return a connection to the pool
+
+        Args:
+            connection: Connection previously obtained from getconn()
+            close (bool): Close the connection instead of keeping it
+        """
+        now = time.monotonic()
+        if not close and not connection.closed:
+            try:
+                status = connection.get_transaction_status()
+                if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                    close = True
+                elif status != extensions.TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+            except Exception:
+                close = True
+
+        with self._lock:
+            self._in_use.discard(connection)
+            if close or self._closed:
+                keep = False
+            elif self._is_expired(connection, now):
+                self._recycled += 1
+                keep = False
+            else:
+                connection.last_used = now
+                self._idle.append(connection)
+                keep = True
+            self._available.notify()
+
+        if not keep:
+            self._discard(connection)
+
+    def warm_up(self, count=None):
+        """
+        Pre-open idle connections so the first requests skip connection setup
+
+        Args:
+            count (int): Number of connections to have open (default: minconn)
+
+        Returns:
+            int: Number of connections opened
+        """
+        count = self.minconn if count is None else min(count, self.maxconn)
+        opened = []
+        try:
+            while True:
+                with self._lock:
+                    total = len(self._idle) + len(self._in_use) + self._opening
+                    if total >= count:
+                        break
+                    self._opening += 1
+                try:
+                    connection = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._opening -= 1
+                    raise
+                with self._lock:
+                    self._opening -= 1
+                    self._opened += 1
+                    connection.last_used = time.monotonic()
+                    self._idle.appendleft(connection)
+                    self._available.notify()
+                opened.append(connection)
+        except Exception as e:
+            print(f"Warning: Pool warm-up stopped after {len(opened)} connections: {e}")
+        return len(opened)
+
+    def closeall(self):
+        """Close every connection and refuse further checkouts"""
+        with self._lock:
+            self._closed = True
+            connections = list(self._idle) + list(self._in_use)
+            self._idle.clear()
+            self._in_use.clear()
+            self._available.notify_all()
+        for connection in connections:
+            self._discard(connection)
+
+    def stats(self):
+        """
+        Snapshot of pool usage for sizing against worker/thread counts
+
+        Returns:
+            dict: Gauges and counters describing the pool
+        """
+        with self._lock:
+            checkouts = self._checkouts
+            return {
+                'max_connections': self.maxconn,
+                'in_use': len(self._in_use),
+                'idle': len(self._idle),
+                'opening': self._opening,
+                'waiting': self._waiting,
+                'checkouts': checkouts,
+                'timeouts': self._timeouts,
+                'opened': self._opened,
+                'recycled': self._recycled,
+                'failed_pings': self._failed_pings,
+                'wait_time_total_ms': round(self._wait_total * 1000, 3),
+                'wait_time_avg_ms': round(self._wait_total * 1000 / checkouts, 3) if checkouts else 0.0,
+                'wait_time_max_ms': round(self._wait_max * 1000, 3),
+            }
@@ -11,11 +11,26 @@ The current implementation uses cryptographic randomness with quantum-inspired
 algorithms to generate secure OTPs.
 """
 
+import base64
 import hashlib
 import hmac
-import time
 import os
-from datetime import datetime
+import threading
+import time
+from datetime import datetime, timezone
+
+from utils.cache import TTLCache
+from utils.entropy import entropy_pool
+
+# OTPs never start with 0: 900000 codes from 100000 to 999999
+OTP_FLOOR = 100000
+OTP_SPAN = 900000
+
+# Codes are drawn from 3-byte samples; samples at or above the largest
+# multiple of OTP_SPAN below 2^24 are rejected so every code is equally
+# likely (about 3.4% of samples)
+_SAMPLE_BYTES = 3
+_SAMPLE_LIMIT = (1 << 24) - (1 << 24) % OTP_SPAN
 
 class QuantumOTPGenerator:
     """
@@ -26,7 +41,10 @@ class QuantumOTPGenerator:
     would be replaced with actual quantum hardware interfaces.
     """
     
-    def __init__(self):
+    def __init__(self, entropy=None):
+        # Buffered randomness the codes are drawn from
+        self.entropy = entropy or entropy_pool
+        
         # Simulation of quantum seed - in real implementation, this would come from quantum hardware
         self.quantum_seed = os.getenv('JWT_SECRET', 'default_quantum_seed').encode('utf-8')
         
@@ -95,19 +113,41 @@ class QuantumOTPGenerator:
         
         return ''.join(digits)
     
+    def _sample_codes(self, count):
+        """
+        Draw unbiased 6-digit codes from the entropy pool
+        
+        Args:
+            count (int): Number of codes
+            
+        Returns:
+            list: OTP strings in [100000, 999999]
+        """
+        codes = []
+        while len(codes) < count:
+            needed = count - len(codes)
+            # Over-read a little so rejections rarely need a second pass
+            data = self.entropy.read(_SAMPLE_BYTES * (needed + needed // 16 + 1))
+            for offset in range(0, len(data), _SAMPLE_BYTES):
+                value = int.from_bytes(data[offset:offset + _SAMPLE_BYTES], 'big')
+                if value < _SAMPLE_LIMIT:
+                    codes.append(str(OTP_FLOOR + value % OTP_SPAN))
+                    if len(codes) == count:
+                        break
+        return codes
+    
     def generate_otp(self, user_id):
         """
         Generate quantum-inspired OTP for user
         
         SIMULATION PROCESS:
-        1. Create unique quantum context using user_id and timestamp
-        2. Simulate quantum photon measurements
-        3. Extract randomness from simulated quantum uncertainty
-        4. Generate 6-digit OTP with cryptographic security
+        Codes are drawn by rejection sampling from a buffered entropy pool
+        (bulk os.urandom reads by default), standing in for measurements
+        of a quantum random source.
         
         REAL QUANTUM INTEGRATION:
         To replace with real quantum hardware:
-        1. Replace _simulate_quantum_measurement with actual quantum device API
+        1. Give the entropy pool a source backed by the quantum device API
         2. Use real quantum random number generator (QRNG)
         3. Implement quantum key distribution if available
         4. Add quantum error correction for noisy intermediate-scale quantum (NISQ) devices
@@ -118,18 +158,7 @@ class QuantumOTPGenerator:
         Returns:
             str: 6-digit quantum-inspired OTP
         """
-        # Get current timestamp for uniqueness
-        timestamp = time.time()
-        
-        # Simulate quantum measurements
-        quantum_data = self._simulate_quantum_measurement(user_id, timestamp)
-        
-        # Extract OTP from quantum data
-        otp = self._extract_digits_from_quantum_data(quantum_data)
-        
-        # Ensure OTP doesn't start with 0 (for better UX)
-        if otp[0] == '0':
-            otp = '1' + otp[1:]
+        otp = self._sample_codes(1)[0]
         
         # Log quantum generation (for debugging - remove in production)
         if os.getenv('DEBUG_OTP', 'false').lower() == 'true':
@@ -137,6 +166,24 @@ class QuantumOTPGenerator:
         
         return otp
     
+    def generate_otps(self, user_ids):
+        """
+        Generate one OTP per user in a single pass over the entropy pool
+        
+        Args:
+            user_ids (list): User identifiers
+            
+        Returns:
+            list: 6-digit OTPs, in the order of user_ids
+        """
+        user_ids = list(user_ids)
+        otps = self._sample_codes(len(user_ids))
+        
+        if os.getenv('DEBUG_OTP', 'false').lower() == 'true':
+            print(f"[QUANTUM-OTP] Generated {len(otps)} OTPs using quantum simulation")
+        
+        return otps
+    
     def verify_quantum_signature(self, otp, user_id, generation_time):
         """
         Verify that OTP could have been generated by quantum process
@@ -165,6 +212,109 @@ class QuantumOTPGenerator:
         except Exception:
             return False
 
+class StatelessOTP:
+    """
+    Time-windowed OTPs derived from a server key (OTP_MODE=stateless)
+    
+    A code is HMAC(key, "user_id:nonce:window") reduced to 6 digits, where
+    nonce is random per login and handed to the client as the otp_ticket,
+    and window counts window_seconds steps of the clock. Issuing a code is
+    pure CPU; verifying recomputes it for the current and previous window
+    (so a code lives between one and two windows) and only a correct code
+    writes to the database, to mark its ticket spent.
+    
+    The issue rate limit and the wrong-guess limit per ticket are kept in
+    memory, i.e. per worker process.
+    
+    Args:
+        key (bytes): Server secret the codes are derived from
+        window_seconds (int): Length of a time step
+        redeem (callable): redeem(nonce, user_id, expires_at) returns True
+            the first time a ticket is spent
+        max_issues (int): Codes per user per issue_window_seconds
+        issue_window_seconds (int): Rate limit window
+        max_attempts (int): Wrong codes after which a ticket is dead
+        entropy: Pool the nonces are drawn from
+    """
+    
+    NONCE_BYTES = 12
+    
+    def __init__(self, key, window_seconds=300, redeem=None,
+                 max_issues=3, issue_window_seconds=3600, max_attempts=5, entropy=None):
+        if not key:
+            raise ValueError("StatelessOTP requires a secret key")
+        self._key = hmac.new(key, b"stateless-otp", hashlib.sha256).digest()
+        self.window_seconds = window_seconds
+        self.redeem = redeem
+        self.max_issues = max_issues
+        self.max_attempts = max_attempts
+        self.entropy = entropy or entropy_pool
+        self._lock = threading.Lock()
+        self._issued = TTLCache(maxsize=100000, ttl=issue_window_seconds)
+        self._failures = TTLCache(maxsize=100000, ttl=2 * window_seconds)
+    
+    def code(self, user_id, nonce, window):
+        """6-digit code for a user, ticket and time step"""
+        message = f"{user_id}:{nonce}:{window}".encode()
+        digest = hmac.new(self._key, message, hashlib.sha256).digest()
+        return str(OTP_FLOOR + int.from_bytes(digest[:8], 'big') % OTP_SPAN)
+    
+    def issue(self, user_id):
+        """
+        Derive a fresh code for a user, unless rate limited
+        
+        Returns:
+            tuple: (otp_code, otp_ticket), or None if the user reached
+            max_issues in the current rate limit window
+        """
+        now = time.time()
+        with self._lock:
+            recent = [issued_at for issued_at in self._issued.get(user_id, ())
+                      if issued_at > now - self._issued.ttl]
+            if len(recent) >= self.max_issues:
+                return None
+            recent.append(now)
+            self._issued.set(user_id, recent)
+        
+        nonce = base64.urlsafe_b64encode(self.entropy.read(self.NONCE_BYTES)).decode()
+        otp = self.code(user_id, nonce, int(now // self.window_seconds))
+        
+        if os.getenv('DEBUG_OTP', 'false').lower() == 'true':
+            print(f"[QUANTUM-OTP] Derived stateless OTP {otp} for user {user_id}")
+        
+        return otp, nonce
+    
+    def verify(self, user_id, otp, nonce):
+        """
+        Check a code against its ticket and spend the ticket
+        
+        Returns:
+            bool: True once per ticket for a correct, unexpired code
+        """
+        failures = self._failures.get(nonce, 0)
+        if failures >= self.max_attempts:
+            return False
+        
+        current = int(time.time() // self.window_seconds)
+        for window in (current, current - 1):
+            if hmac.compare_digest(self.code(user_id, nonce, window), otp):
+                break
+        else:
+            with self._lock:
+                self._failures.set(nonce, self._failures.get(nonce, 0) + 1)
+            return False
+        
+        expires_at = datetime.fromtimestamp((window + 2) * self.window_seconds, timezone.utc)
+        return self.redeem(nonce, user_id, expires_at)
+    
+    def stats(self):
+        """Sizes of the in-memory rate limit and attempt tables"""
+        return {
+            'window_seconds': self.window_seconds,
+            'tracked_users': len(self._issued),
+            'tickets_with_failures': len(self._failures),
+        }
+
 # Global quantum OTP generator instance
 quantum_otp_generator = QuantumOTPGenerator()
 
@@ -180,6 +330,18 @@ def generate_otp(user_id):
     """
     return quantum_otp_generator.generate_otp(user_id)
 
+def generate_otps(user_ids):
+    """
+    Public interface for generating OTPs for many users at once
+    
+    Args:
+        user_ids (list): User identifiers
+        
+    Returns:
+        list: 6-digit OTPs, in the order of user_ids
+    """
+    return quantum_otp_generator.generate_otps(user_ids)
+
 def verify_quantum_otp(otp, user_id, generation_time):
     """
     Public interface for verifying quantum OTP
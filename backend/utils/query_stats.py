@@ -0,0 +1,203 @@
+"""
+Query instrumentation for the database layer
+
+Every statement run through utils.db is recorded here: per-template latency
+histograms, pool checkout wait, row counts and errors. Statements slower
+than DB_SLOW_QUERY_MS are logged with their normalised text and the shape
+(types, never values) of their parameters, and read-only ones can have an
+EXPLAIN (ANALYZE, BUFFERS) plan captured for later inspection.
+"""
+import os
+import re
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+
+# Histogram bucket upper bounds in milliseconds (last bucket is +Inf)
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+_WHITESPACE = re.compile(r'\s+')
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER = re.compile(r'%\(\w+\)s|%s|\$\d+')
+_WRITE_KEYWORDS = re.compile(r'\b(INSERT|UPDATE|DELETE|MERGE|TRUNCATE|DROP|ALTER|CREATE)\b', re.IGNORECASE)
+
+
+@lru_cache(maxsize=512)
+def normalize_statement(query):
+    """
+    Collapse a SQL statement into its template
+
+    Literals and placeholders become ?, whitespace is collapsed, so every
+    call of the same query shares one set of statistics.
+    """
+    text = _STRING_LITERAL.sub('?', query)
+    text = _PLACEHOLDER.sub('?', text)
+    text = _NUMBER_LITERAL.sub('?', text)
+    return _WHITESPACE.sub(' ', text).strip()
+
+
+@lru_cache(maxsize=512)
+def is_read_only(query):
+    """Whether re-running the statement under EXPLAIN ANALYZE is harmless"""
+    text = query.lstrip().upper()
+    return text.startswith(('SELECT', 'WITH')) and not _WRITE_KEYWORDS.search(query)
+
+
+def params_shape(params):
+    """Describe parameters by type only so values never reach the logs"""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: type(value).__name__ for key, value in params.items()}
+    return [type(value).__name__ for value in params]
+
+
+class _TemplateStats:
+    """Counters for one statement template"""
+
+    __slots__ = ('calls', 'errors', 'rows', 'total_ms', 'max_ms',
+                 'wait_ms', 'slow', 'buckets')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.wait_ms = 0.0
+        self.slow = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def as_dict(self):
+        buckets = {f"le_{bound}": count for bound, count in zip(LATENCY_BUCKETS_MS, self.buckets)}
+        buckets['le_inf'] = self.buckets[-1]
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'rows': self.rows,
+            'slow': self.slow,
+            'total_ms': round(self.total_ms, 3),
+            'avg_ms': round(self.total_ms / self.calls, 3) if self.calls else 0.0,
+            'max_ms': round(self.max_ms, 3),
+            'pool_wait_ms': round(self.wait_ms, 3),
+            'histogram_ms': buckets,
+        }
+
+
+class QueryStats:
+    """
+    Thread-safe collector of per-template query statistics
+
+    Args:
+        slow_ms (float): Threshold above which a statement is logged as slow
+        explain_slow (bool): Capture EXPLAIN (ANALYZE, BUFFERS) for slow reads
+        explain_interval (float): Minimum seconds between plans per template
+        max_plans (int): Number of captured plans kept in memory
+    """
+
+    def __init__(self, slow_ms=200.0, explain_slow=False,
+                 explain_interval=60.0, max_plans=20):
+        self.enabled = True
+        self.slow_ms = slow_ms
+        self.explain_slow = explain_slow
+        self.explain_interval = explain_interval
+        self._lock = threading.Lock()
+        self._templates = {}
+        self._plans = deque(maxlen=max_plans)
+        self._last_explained = {}
+
+    def record(self, template, elapsed_ms, wait_ms=0.0, rows=0, error=False):
+        """
+        Record one statement execution
+
+        Returns:
+            bool: True if the statement crossed the slow-query threshold
+        """
+        if not self.enabled:
+            return False
+
+        slow = elapsed_ms >= self.slow_ms
+        bucket = len(LATENCY_BUCKETS_MS)
+        for index, bound in enumerate(LATENCY_BUCKETS_MS):
+            if elapsed_ms <= bound:
+                bucket = index
+                break
+
+        with self._lock:
+            stats = self._templates.get(template)
+            if stats is None:
+                stats = self._templates[template] = _TemplateStats()
+            stats.calls += 1
+            stats.total_ms += elapsed_ms
+            stats.wait_ms += wait_ms
+            stats.max_ms = max(stats.max_ms, elapsed_ms)
+            stats.buckets[bucket] += 1
+            if rows and rows > 0:
+                stats.rows += rows
+            if error:
+                stats.errors += 1
+            if slow:
+                stats.slow += 1
+        return slow
+
+    def log_slow(self, template, elapsed_ms, params):
+        """Log a slow statement with its parameter shape"""
+        print(f"[SLOW-QUERY] {elapsed_ms:.1f}ms {template} params={params_shape(params)}")
+
+    def should_explain(self, template):
+        """Rate-limit plan capture to one per template per explain_interval"""
+        if not self.explain_slow:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            last = self._last_explained.get(template)
+            if last is not None and now - last < self.explain_interval:
+                return False
+            self._last_explained[template] = now
+        return True
+
+    def add_plan(self, template, elapsed_ms, plan):
+        """Keep a captured EXPLAIN plan"""
+        with self._lock:
+            self._plans.append({
+                'template': template,
+                'elapsed_ms': round(elapsed_ms, 3),
+                'captured_at': time.time(),
+                'plan': plan,
+            })
+
+    def snapshot(self):
+        """
+        Current statistics for scraping
+
+        Returns:
+            dict: Per-template stats, captured plans and configuration
+        """
+        with self._lock:
+            templates = {template: stats.as_dict() for template, stats in self._templates.items()}
+            plans = list(self._plans)
+        return {
+            'slow_query_ms': self.slow_ms,
+            'explain_slow': self.explain_slow,
+            'buckets_ms': list(LATENCY_BUCKETS_MS),
+            'templates': templates,
+            'slow_plans': plans,
+        }
+
+    def reset(self):
+        """Clear all collected statistics"""
+        with self._lock:
+            self._templates.clear()
+            self._plans.clear()
+            self._last_explained.clear()
+
+
+# Global collector used by utils.db
+query_stats = QueryStats(
+    slow_ms=float(os.getenv('DB_SLOW_QUERY_MS', '200')),
+    explain_slow=os.getenv('DB_EXPLAIN_SLOW', 'false').lower() == 'true',
+    explain_interval=float(os.getenv('DB_EXPLAIN_INTERVAL', '60')),
+)
+query_stats.enabled = os.getenv('DB_QUERY_STATS', 'true').lower() == 'true'
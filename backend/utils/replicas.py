@@ -0,0 +1,166 @@
+"""
+Read-replica routing for the database pool
+
+Each replica gets its own bounded pool. Reads are spread over the replicas
+that are reachable and not lagging behind the primary by more than
+DB_REPLICA_MAX_LAG seconds; when none qualifies the caller falls back to
+the primary. Replication lag is sampled at most every
+DB_REPLICA_LAG_CHECK_INTERVAL seconds per replica, by whichever request
+notices the sample is stale.
+
+Read-your-writes is carried by the client: a response to a request that
+wrote returns the primary's WAL position (X-DB-LSN), the client sends it
+back, and its reads then only go to replicas whose last sampled replay
+position has reached it. This holds whichever worker serves the next
+request.
+"""
+import itertools
+import threading
+import time
+
+from psycopg2 import extensions
+
+from utils.pool import PoolTimeoutError
+
+# Seconds the replica is behind (0 when it has replayed everything it
+# received) and the WAL position replayed so far
+LAG_QUERY = """
+SELECT CASE
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 0)
+END, COALESCE(pg_last_wal_replay_lsn(), pg_current_wal_lsn())::text
+"""
+
+
+def parse_lsn(text):
+    """
+    A WAL position ('16/B374D848') as an integer for comparisons
+
+    Returns:
+        int: The position, or None if text is not an LSN
+    """
+    try:
+        high, low = text.split('/')
+        return (int(high, 16) << 32) + int(low, 16)
+    except (AttributeError, ValueError):
+        return None
+
+
+class Replica:
+    """A read replica with its own pool and last known replication lag"""
+
+    def __init__(self, dsn, pool):
+        self.dsn = dsn
+        self.pool = pool
+        self.lag = 0.0
+        self.replay_lsn = 0
+        self.healthy = True
+        self.checked_at = 0.0
+        self.checking = False
+
+        try:
+            params = extensions.parse_dsn(dsn)
+            self.name = f"{params.get('host', 'localhost')}:{params.get('port', '5432')}"
+        except Exception:
+            self.name = 'replica'
+
+    def stats(self):
+        """Lag, health and pool usage of this replica"""
+        return {
+            'name': self.name,
+            'healthy': self.healthy,
+            'lag_seconds': round(self.lag, 3),
+            'pool': self.pool.stats(),
+        }
+
+
+class ReplicaRouter:
+    """
+    Chooses a replica for read-only statements
+
+    Args:
+        dsns (list): Replica connection strings
+        pool_factory (callable): Builds a BoundedConnectionPool for a DSN
+        strategy (str): 'round_robin' or 'least_busy'
+        max_lag (float): Replicas further behind than this are skipped
+        check_interval (float): Seconds between lag samples per replica
+    """
+
+    def __init__(self, dsns, pool_factory, strategy='round_robin',
+                 max_lag=5.0, check_interval=5.0):
+        self.replicas = [Replica(dsn, pool_factory(dsn)) for dsn in dsns]
+        self.strategy = strategy
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+
+    def __bool__(self):
+        return bool(self.replicas)
+
+    def _check_lag(self, replica):
+        """Sample replication lag on a pooled replica connection"""
+        connection = None
+        broken = False
+        try:
+            connection = replica.pool.getconn(timeout=0)
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute(LAG_QUERY)
+                lag, replay_lsn = cursor.fetchone()
+                replica.lag = float(lag or 0)
+                replica.replay_lsn = parse_lsn(replay_lsn) or 0
+            replica.healthy = replica.lag <= self.max_lag
+        except PoolTimeoutError:
+            # Every connection busy: the replica is up, keep the last sample
+            pass
+        except Exception:
+            broken = connection is not None
+            replica.healthy = False
+        finally:
+            if connection is not None:
+                replica.pool.putconn(connection, close=broken)
+            replica.checked_at = time.monotonic()
+            replica.checking = False
+
+    def _refresh(self):
+        """Re-sample lag on replicas whose last sample is stale"""
+        now = time.monotonic()
+        stale = []
+        with self._lock:
+            for replica in self.replicas:
+                if not replica.checking and now - replica.checked_at >= self.check_interval:
+                    replica.checking = True
+                    stale.append(replica)
+        for replica in stale:
+            self._check_lag(replica)
+
+    def choose(self, min_lsn=None):
+        """
+        Pick a replica for the next read
+
+        Args:
+            min_lsn (int): WAL position the replica must have replayed
+                (the client's last write), if any
+
+        Returns:
+            Replica: A healthy replica, or None to use the primary
+        """
+        self._refresh()
+        candidates = [replica for replica in self.replicas if replica.healthy
+                      and (min_lsn is None or replica.replay_lsn >= min_lsn)]
+        if not candidates:
+            return None
+        if self.strategy == 'least_busy':
+            return min(candidates, key=lambda replica: replica.pool.stats()['in_use'])
+        return candidates[next(self._counter) % len(candidates)]
+
+    def mark_down(self, replica):
+        """Take a replica out of rotation until its next lag sample"""
+        replica.healthy = False
+        replica.checked_at = time.monotonic()
+
+    def stats(self):
+        """Per-replica lag, health and pool usage"""
+        return [replica.stats() for replica in self.replicas]
+
@@ -0,0 +1,230 @@
+"""
+Token revocation (logout) with an in-memory index
+
+Revoked token ids (jti) are stored durably in revoked_tokens and mirrored
+in every worker by a RevocationIndex, so token_required checks them with a
+dictionary lookup instead of a query. Entries are grouped in buckets by
+token expiry; a bucket is dropped as a whole once every token in it has
+expired, so memory only ever holds revocations that still matter.
+
+Deleting a user revokes all of its tokens: a trigger on users writes a
+'user:<id>' row for the JWT lifetime, which the index keeps by user id.
+
+Each worker polls for revocations made by other workers every
+REVOCATION_SYNC_INTERVAL seconds on a background thread; a revocation made
+in this worker takes effect here immediately. Gunicorn workers start the
+thread in post_worker_init, so the initial load is normally done before the
+first request arrives. Until it has succeeded (it is retried every sync
+interval) checks query revoked_tokens directly, and fail with
+RevocationUnavailableError when that is impossible too.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from utils.db import find_revocations, load_revoked_tokens, revoke_token
+
+# jti prefix of the rows written by the user deletion trigger
+USER_REVOCATION_PREFIX = 'user:'
+
+
+class RevocationUnavailableError(Exception):
+    """Neither the index nor revoked_tokens could answer a revocation check"""
+
+
+class RevocationIndex:
+    """
+    Revoked token ids bucketed by expiry
+
+    Args:
+        load (callable): load(after_id) returns unexpired (id, jti, exp) rows
+        lookup (callable): lookup(jtis) returns the unexpired revoked ones,
+            asked directly while the index has not loaded yet
+        bucket_seconds (int): Width of an expiry bucket
+        sync_interval (float): Seconds between polls for new revocations
+        sync_lookback (int): Ids re-read on each poll, so rows committed
+            out of id order are not missed
+        initial_wait (float): Longest a check waits for the initial load
+            before asking lookup instead (a slow database must not stall
+            requests for long)
+    """
+
+    def __init__(self, load, lookup=None, bucket_seconds=300, sync_interval=2.0,
+                 sync_lookback=100, initial_wait=0.5):
+        self.load = load
+        self.lookup = lookup
+        self.bucket_seconds = bucket_seconds
+        self.sync_interval = sync_interval
+        self.sync_lookback = sync_lookback
+        self.initial_wait = initial_wait
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._users = {}
+        self._last_id = 0
+        self._pid = None
+        self._loaded = threading.Event()
+        self.synced_at = 0.0
+        self.direct_checks = 0
+        self.syncs = 0
+        self.sync_errors = 0
+
+    def _bucket(self, exp):
+        return int(exp // self.bucket_seconds)
+
+    def add(self, jti, exp):
+        """Mark a token id revoked until exp (epoch seconds)"""
+        if exp <= time.time():
+            return
+        with self._lock:
+            if jti.startswith(USER_REVOCATION_PREFIX):
+                user_id = int(jti[len(USER_REVOCATION_PREFIX):])
+                self._users[user_id] = max(self._users.get(user_id, 0), exp)
+                return
+            self._buckets.setdefault(self._bucket(exp), set()).add(jti)
+
+    def _expire(self):
+        now = time.time()
+        current = self._bucket(now)
+        with self._lock:
+            for bucket in [bucket for bucket in self._buckets if bucket < current]:
+                del self._buckets[bucket]
+            for user_id in [user_id for user_id, exp in self._users.items() if exp <= now]:
+                del self._users[user_id]
+
+    def sync(self):
+        """Pull revocations written since the last poll"""
+        rows = self.load(max(self._last_id - self.sync_lookback, 0))
+        for row_id, jti, exp in rows:
+            self.add(jti, exp)
+            self._last_id = max(self._last_id, row_id)
+        self._expire()
+        self.synced_at = time.monotonic()
+        self.syncs += 1
+
+    def _poll(self):
+        # Runs outside any request, so the loads never join a request's
+        # unit of work. Checks go to the table until the
+        # initial load has succeeded.
+        while not self._loaded.is_set():
+            try:
+                self.sync()
+                self._loaded.set()
+            except Exception as e:
+                self.sync_errors += 1
+                print(f"[REVOCATION] Initial load failed, retrying: {e}")
+                time.sleep(self.sync_interval)
+        while True:
+            time.sleep(self.sync_interval)
+            try:
+                self.sync()
+            except Exception as e:
+                self.sync_errors += 1
+                print(f"[REVOCATION] Sync failed: {e}")
+
+    def start(self):
+        """Start this process's poller thread (is_revoked() starts it on demand)"""
+        # The poller thread does not survive a fork; start one per process
+        if self._pid != os.getpid():
+            with self._lock:
+                start = self._pid != os.getpid()
+                self._pid = os.getpid()
+            if start:
+                threading.Thread(target=self._poll, name='revocation-sync', daemon=True).start()
+
+    @property
+    def loaded(self):
+        return self._loaded.is_set()
+
+    def wait_until_loaded(self, timeout):
+        """Start the poller and wait up to timeout for the initial load"""
+        self.start()
+        return self._loaded.wait(timeout=timeout)
+
+    def is_revoked(self, jti, exp):
+        """O(1) check of a token id against the revocations in memory"""
+        bucket = self._buckets.get(self._bucket(exp))
+        return bucket is not None and jti in bucket
+
+    def is_user_deleted(self, user_id):
+        """Whether the user was deleted within the JWT lifetime (in memory)"""
+        exp = self._users.get(user_id)
+        return exp is not None and exp > time.time()
+
+    def check(self, jti, exp, user_id):
+        """
+        Why a verified token must be refused, if it must
+
+        Answered from memory once the initial load has succeeded. Until
+        then (worker start, database trouble) revoked_tokens is asked
+        directly, so a logout or a deletion is never missed.
+
+        Args:
+            jti (str): Token id claim (None for tokens without one)
+            exp (float): Token expiry (epoch seconds)
+            user_id (int): Token owner
+
+        Returns:
+            str: 'revoked', 'user_deleted', or None if the token is good
+
+        Raises:
+            RevocationUnavailableError: The index is not loaded and the
+                table could not be queried
+        """
+        marker = f"{USER_REVOCATION_PREFIX}{user_id}" if user_id is not None else None
+        if self.wait_until_loaded(self.initial_wait):
+            if jti is not None and self.is_revoked(jti, exp):
+                return 'revoked'
+            if user_id is not None and self.is_user_deleted(user_id):
+                return 'user_deleted'
+            return None
+
+        if self.lookup is None:
+            raise RevocationUnavailableError("Revocation index not loaded")
+        try:
+            found = self.lookup([key for key in (jti, marker) if key is not None])
+        except Exception as e:
+            raise RevocationUnavailableError(f"Revocation lookup failed: {e}") from e
+        self.direct_checks += 1
+        if jti is not None and jti in found:
+            return 'revoked'
+        if marker is not None and marker in found:
+            return 'user_deleted'
+        return None
+
+    def stats(self):
+        """Index size and sync health"""
+        return {
+            'revoked': sum(len(bucket) for bucket in list(self._buckets.values())),
+            'deleted_users': len(self._users),
+            'loaded': self.loaded,
+            'direct_checks': self.direct_checks,
+            'buckets': len(self._buckets),
+            'bucket_seconds': self.bucket_seconds,
+            'syncs': self.syncs,
+            'sync_errors': self.sync_errors,
+            'last_sync_age_seconds': round(time.monotonic() - self.synced_at, 1) if self.synced_at else None,
+        }
+
+
+# Global index used by token_required
+revoked_tokens = RevocationIndex(
+    load_revoked_tokens,
+    lookup=find_revocations,
+    bucket_seconds=int(os.getenv('REVOCATION_BUCKET_SECONDS', '300')),
+    sync_interval=float(os.getenv('REVOCATION_SYNC_INTERVAL', '2')),
+    initial_wait=float(os.getenv('REVOCATION_INITIAL_WAIT', '0.5')),
+)
+
+
+def revoke(jti, user_id, exp):
+    """
+    Revoke a token everywhere until it expires
+
+    Args:
+        jti (str): Token id claim
+        user_id (int): Owner of the token
+        exp (float): Token expiry (epoch seconds)
+    """
+    revoke_token(jti, user_id, datetime.fromtimestamp(exp, timezone.utc))
+    revoked_tokens.add(jti, exp)
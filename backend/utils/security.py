@@ -2,51 +2,362 @@
 Security utilities for password hashing and JWT token management
 """
 import bcrypt
+import json
 import jwt
 import os
-from datetime import datetime, timedelta
+import re
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta, timezone
 from functools import wraps
+from hashlib import blake2b
 from flask import request, jsonify, current_app
+from utils.cache import TTLCache
+from utils.db import User, get_user_by_account
+from utils.revocation import RevocationUnavailableError, revoked_tokens
+from utils.hashing import hashing_executor, HashingOverloadedError, PRIORITY_HASH, PRIORITY_VERIFY
+
+EMAIL_PATTERN = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+
+# Calibration never goes below the floor, whatever the host speed
+BCRYPT_MIN_ROUNDS = 10
+BCRYPT_MAX_ROUNDS = 16
+BCRYPT_DEFAULT_ROUNDS = 12
+
+_bcrypt_rounds = None
+
+def time_bcrypt(rounds):
+    """Milliseconds one bcrypt hash takes at the given cost on this host"""
+    salt = bcrypt.gensalt(rounds=rounds)
+    started = time.perf_counter()
+    bcrypt.hashpw(b'calibration-password', salt)
+    return (time.perf_counter() - started) * 1000
+
+def calibrate_bcrypt_rounds(budget_ms, min_rounds=BCRYPT_MIN_ROUNDS, max_rounds=BCRYPT_MAX_ROUNDS):
+    """
+    Highest bcrypt cost whose hash time stays within budget_ms
+    
+    Each extra round doubles the work, so the cost is extrapolated from one
+    cheap measurement and then confirmed by timing the chosen cost.
+    
+    Args:
+        budget_ms (float): Target milliseconds per hash
+        min_rounds (int): Lower bound, returned even if it exceeds the budget
+        max_rounds (int): Upper bound
+    
+    Returns:
+        int: bcrypt cost factor
+    """
+    base_rounds = min_rounds
+    base_ms = max(time_bcrypt(base_rounds), 0.001)
+    rounds = base_rounds
+    while rounds < max_rounds and base_ms * 2 ** (rounds + 1 - base_rounds) <= budget_ms:
+        rounds += 1
+    while rounds > min_rounds and time_bcrypt(rounds) > budget_ms:
+        rounds -= 1
+    return rounds
+
+def bcrypt_rounds():
+    """
+    bcrypt cost for new hashes
+    
+    BCRYPT_ROUNDS wins if set; otherwise, with BCRYPT_LATENCY_BUDGET_MS the
+    cost is calibrated on this host once per process; otherwise bcrypt's
+    default of 12.
+    """
+    global _bcrypt_rounds
+    if _bcrypt_rounds is None:
+        configured = os.getenv('BCRYPT_ROUNDS')
+        budget = os.getenv('BCRYPT_LATENCY_BUDGET_MS')
+        if configured:
+            _bcrypt_rounds = int(configured)
+        elif budget:
+            _bcrypt_rounds = calibrate_bcrypt_rounds(float(budget))
+            print(f"[BCRYPT] Calibrated cost {_bcrypt_rounds} for a {budget}ms budget")
+        else:
+            _bcrypt_rounds = BCRYPT_DEFAULT_ROUNDS
+    return _bcrypt_rounds
 
 def hash_password(password):
-    """Hash a password using bcrypt"""
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    """
+    Hash a password using bcrypt
+    
+    Runs on the hashing executor behind pending login verifications.
+    
+    Raises:
+        HashingOverloadedError: If the hashing queue is full
+    """
+    salt = bcrypt.gensalt(rounds=bcrypt_rounds())
+    return hashing_executor.run(
+        PRIORITY_HASH, bcrypt.hashpw, password.encode('utf-8'), salt
+    ).decode('utf-8')
+
+def password_needs_rehash(password_hash):
+    """Whether a stored hash uses a different cost than new hashes get"""
+    try:
+        return int(password_hash.split('$')[2]) != bcrypt_rounds()
+    except (IndexError, ValueError):
+        return False
+
+def rehash_password_async(password, on_hashed):
+    """
+    Hash a password at the current cost without waiting for it
+    
+    The hash is queued at registration priority; on_hashed(new_hash) runs
+    on a thread of its own, since it usually writes to the database and
+    the hashing workers must stay busy with bcrypt only. When the queue is
+    full the rehash is simply skipped and retried on a later login.
+    
+    Returns:
+        bool: Whether the rehash was queued
+    """
+    salt = bcrypt.gensalt(rounds=bcrypt_rounds())
+    try:
+        future = hashing_executor.submit(PRIORITY_HASH, bcrypt.hashpw, password.encode('utf-8'), salt)
+    except HashingOverloadedError:
+        return False
+    
+    def store(new_hash):
+        try:
+            on_hashed(new_hash)
+        except Exception as e:
+            print(f"[BCRYPT] Storing rehash failed: {e}")
+    
+    def done(future):
+        try:
+            new_hash = future.result().decode('utf-8')
+        except Exception as e:
+            print(f"[BCRYPT] Rehash failed: {e}")
+            return
+        threading.Thread(target=store, args=(new_hash,), name='rehash-store', daemon=True).start()
+    
+    future.add_done_callback(done)
+    return True
 
 def verify_password(password, hash_password):
-    """Verify a password against its hash"""
-    return bcrypt.checkpw(password.encode('utf-8'), hash_password.encode('utf-8'))
+    """
+    Verify a password against its hash
+    
+    Raises:
+        HashingOverloadedError: If the hashing queue is full
+    """
+    return hashing_executor.run(
+        PRIORITY_VERIFY, bcrypt.checkpw, password.encode('utf-8'), hash_password.encode('utf-8')
+    )
+
+# Verified tokens (keyed by a hash of the whole token) -> (kid, key,
+# payload), each entry expiring at the token's exp, so dashboard polls skip
+# the decode; the key is re-checked against the key ring on every hit
+token_cache = TTLCache(
+    maxsize=int(os.getenv('JWT_CACHE_SIZE', '4096')),
+    ttl=float(os.getenv('JWT_CACHE_TTL', '300'))
+)
+
+# Token claims carrying User fields (claim -> field)
+USER_CLAIMS = {'name': 'name', 'email': 'email', 'member_since': 'created_at'}
+
+# kid of the JWT_SECRET key; tokens without a kid header are checked against it
+DEFAULT_KID = 'default'
+
+class JwtKey:
+    """One HS256 key of the ring"""
+    __slots__ = ('kid', 'secret', 'activate_at')
+    
+    def __init__(self, kid, secret, activate_at=0.0):
+        self.kid = kid
+        self.secret = secret
+        self.activate_at = activate_at
+
+class JwtKeyRing:
+    """
+    HS256 keys identified by the token's kid header
+    
+    The newest key whose activate_at has passed signs new tokens. Every key
+    in the ring verifies, including ones scheduled for the future (publish
+    a key on all instances first, then let it activate) and superseded ones
+    until grace_seconds after their successor activated, by which time
+    every token they signed has expired. Rotating therefore never logs
+    anyone out.
+    
+    Args:
+        keys (list): JwtKey instances
+        grace_seconds (float): How long a superseded key still verifies
+    """
+    
+    def __init__(self, keys, grace_seconds=86400.0):
+        if not keys:
+            raise ValueError("JWT key ring is empty")
+        self.keys = sorted(keys, key=lambda key: key.activate_at)
+        self.grace_seconds = grace_seconds
+        self._by_kid = {key.kid: key for key in self.keys}
+    
+    def signing_key(self, now=None):
+        """Newest active key"""
+        now = time.time() if now is None else now
+        active = [key for key in self.keys if key.activate_at <= now]
+        return active[-1] if active else self.keys[0]
+    
+    def verification_secret(self, kid, now=None):
+        """
+        Secret for a token's kid, or None if unknown or retired
+        
+        Tokens issued before the ring existed carry no kid and are checked
+        against the 'default' (JWT_SECRET) key.
+        """
+        key = self._by_kid.get(kid if kid is not None else DEFAULT_KID)
+        if key is None:
+            return None
+        now = time.time() if now is None else now
+        successors = [other.activate_at for other in self.keys
+                      if key.activate_at < other.activate_at <= now]
+        if successors and now - min(successors) > self.grace_seconds:
+            return None
+        return key.secret
+    
+    def stats(self):
+        """Key ids and schedule (never the secrets)"""
+        now = time.time()
+        return {
+            'signing_kid': self.signing_key(now).kid,
+            'keys': [{
+                'kid': key.kid,
+                'activate_at': key.activate_at,
+                'verifies': self.verification_secret(key.kid, now) is not None,
+            } for key in self.keys],
+            'grace_seconds': self.grace_seconds,
+        }
+
+def _parse_activate_at(value):
+    if value is None:
+        return 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+def load_jwt_key_ring():
+    """
+    Build the key ring from the environment
+    
+    JWT_KEYS is a JSON list of {"kid", "secret", "activate_at"} objects
+    (activate_at as ISO-8601 or epoch seconds). JWT_SECRET, if set, joins
+    the ring as the 'default' key active since forever, so deployments
+    without JWT_KEYS keep working and existing tokens survive the switch.
+    """
+    keys = []
+    configured = os.getenv('JWT_KEYS')
+    if configured:
+        for entry in json.loads(configured):
+            keys.append(JwtKey(str(entry['kid']), entry['secret'],
+                               _parse_activate_at(entry.get('activate_at'))))
+    
+    secret_key = os.getenv('JWT_SECRET')
+    if secret_key and not any(key.kid == DEFAULT_KID for key in keys):
+        keys.append(JwtKey(DEFAULT_KID, secret_key, 0.0))
+    if not keys:
+        raise ValueError("JWT_SECRET not found in environment variables")
+    
+    return JwtKeyRing(keys, grace_seconds=float(os.getenv('JWT_KEY_GRACE_SECONDS', '86400')))
+
+_jwt_key_ring = None
+
+def get_jwt_key_ring():
+    """JWT key ring, loaded from the environment once"""
+    global _jwt_key_ring
+    if _jwt_key_ring is None:
+        _jwt_key_ring = load_jwt_key_ring()
+    return _jwt_key_ring
 
 def generate_jwt_token(user_data):
-    """Generate JWT token for user"""
+    """Generate JWT token for user, signed with the current key of the ring"""
+    created_at = user_data.get('created_at')
     payload = {
         'user_id': user_data['id'],
         'account_number': user_data['account_number'],
+        # Display claims, so dashboard requests need no user lookup
+        'name': user_data['name'],
+        'email': user_data['email'],
+        'member_since': int(created_at.timestamp()) if created_at else None,
         'exp': datetime.utcnow() + timedelta(hours=24),  # Token expires in 24 hours
-        'iat': datetime.utcnow()
+        'iat': datetime.utcnow(),
+        'jti': secrets.token_urlsafe(16)  # Token id, for revocation
     }
     
-    secret_key = os.getenv('JWT_SECRET')
-    if not secret_key:
-        raise ValueError("JWT_SECRET not found in environment variables")
-    
-    return jwt.encode(payload, secret_key, algorithm='HS256')
+    key = get_jwt_key_ring().signing_key()
+    return jwt.encode(payload, key.secret, algorithm='HS256', headers={'kid': key.kid})
 
 def decode_jwt_token(token):
-    """Decode and verify JWT token"""
+    """
+    Decode and verify JWT token
+    
+    The key is picked by the token's kid header. Tokens verified before
+    are answered from token_cache until their exp, as long as their key
+    is still accepted (a retired or replaced key ends the cached entry).
+    
+    Returns:
+        dict: Token payload (a copy the caller may modify), or None
+    """
+    cache_key = blake2b(token.encode('utf-8'), digest_size=16).digest()
+    cached = token_cache.get(cache_key)
+    if cached is not None:
+        kid, secret_key, payload = cached
+        if payload['exp'] > time.time() and get_jwt_key_ring().verification_secret(kid) == secret_key:
+            return dict(payload)
+        token_cache.delete(cache_key)
+    
     try:
-        secret_key = os.getenv('JWT_SECRET')
-        if not secret_key:
-            raise ValueError("JWT_SECRET not found in environment variables")
-        
+        kid = jwt.get_unverified_header(token).get('kid')
+        secret_key = get_jwt_key_ring().verification_secret(kid)
+        if secret_key is None:
+            return None
         payload = jwt.decode(token, secret_key, algorithms=['HS256'])
-        return payload
     except jwt.ExpiredSignatureError:
         return None
     except jwt.InvalidTokenError:
         return None
+    
+    remaining = payload.get('exp', 0) - time.time()
+    if remaining > 0:
+        token_cache.set(cache_key, (kid, secret_key, payload), ttl=min(remaining, token_cache.ttl))
+    return dict(payload)
 
-def token_required(f):
-    """Decorator to require valid JWT token"""
+def user_from_token(payload, fresh=()):
+    """
+    User for a verified token payload
+    
+    Built from the token's claims without a query, unless the endpoint
+    declared one of the claim fields as fresh or the token predates the
+    display claims; then the row is looked up.
+    
+    Args:
+        payload (dict): Verified token payload
+        fresh (iterable): User fields that must come from the database
+    
+    Returns:
+        User: The token's user, or None if the row no longer exists
+    """
+    claims_present = all(claim in payload for claim in USER_CLAIMS)
+    if not claims_present or any(field in USER_CLAIMS.values() for field in fresh):
+        return get_user_by_account(payload['account_number'])
+    
+    member_since = payload['member_since']
+    return User(
+        payload['user_id'], payload['name'], payload['account_number'], payload['email'],
+        datetime.fromtimestamp(member_since, timezone.utc) if member_since is not None else None
+    )
+
+def token_required(f=None, fresh=()):
+    """
+    Decorator to require valid JWT token
+    
+    Sets request.current_user (the token payload) and request.user (a
+    User record). Use as @token_required, or @token_required(fresh=(...))
+    to name the User fields the endpoint needs straight from the database
+    rather than from token claims.
+    """
+    if f is None:
+        return lambda view: token_required(view, fresh=fresh)
+    
     @wraps(f)
     def decorated(*args, **kwargs):
         token = None
@@ -67,17 +378,30 @@ def token_required(f):
         if payload is None:
             return jsonify({'error': 'Token is invalid or expired'}), 401
         
+        # Checked on every request (in memory); the token cache doesn't skip
+        # it. Claims-built users are never looked up, so deletion is too.
+        try:
+            refusal = revoked_tokens.check(payload.get('jti'), payload['exp'], payload.get('user_id'))
+        except RevocationUnavailableError as e:
+            print(f"Revocation check unavailable: {e}")
+            return jsonify({'error': 'Server is busy, please try again shortly'}), 503, {'Retry-After': '1'}
+        if refusal == 'revoked':
+            return jsonify({'error': 'Token has been revoked'}), 401
+        if refusal == 'user_deleted':
+            return jsonify({'error': 'User not found'}), 404
+        
         # Add user info to request context
         request.current_user = payload
+        request.user = user_from_token(payload, fresh)
+        if request.user is None:
+            return jsonify({'error': 'User not found'}), 404
         return f(*args, **kwargs)
     
     return decorated
 
 def validate_email(email):
     """Basic email validation"""
-    import re
-    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    return re.match(pattern, email) is not None
+    return EMAIL_PATTERN.match(email) is not None
 
 def validate_account_number(account_number):
     """Validate account number format (10 digits)"""
@@ -0,0 +1,142 @@
+"""
+Declarative validation of JSON request bodies
+
+A Schema lists the fields an endpoint accepts. Each Field is compiled once,
+at import, into a single function that normalises and checks the value,
+so validating a request is one pass over pre-built closures. The
+validate_json decorator rejects bodies that are not JSON objects or fail
+the schema with a 400 before the view runs, i.e. before any database or
+bcrypt work. Errors are reported per field:
+
+    {"error": "<first message>", "errors": {"email": "...", ...}}
+"""
+from functools import wraps
+
+from flask import jsonify, request
+
+
+class Field:
+    """
+    One string field of a request body
+
+    Args:
+        label (str): Name used in messages (default: the field name)
+        required (bool): Missing or blank values are an error
+        strip (bool): Strip surrounding whitespace first
+        lower (bool): Lower-case the value
+        min_length (int): Shortest accepted value
+        max_length (int): Longest accepted value
+        check (callable): Extra predicate on the normalised value
+        message (str): Error for a failed length or check
+    """
+
+    def __init__(self, label=None, required=True, strip=True, lower=False,
+                 min_length=None, max_length=None, check=None, message=None):
+        self.label = label
+        self.required = required
+        self.strip = strip
+        self.lower = lower
+        self.min_length = min_length
+        self.max_length = max_length
+        self.check = check
+        self.message = message
+
+    def compile(self, name):
+        """
+        Build the validator for this field
+
+        Returns:
+            callable: validate(value) -> (clean_value, error_or_None)
+        """
+        label = self.label or name
+        required_message = f"{label} is required"
+        type_message = f"{label} must be a string"
+        invalid_message = self.message or f"Invalid {label}"
+        too_long_message = self.message or f"{label} must be at most {self.max_length} characters"
+
+        steps = []
+        if self.strip:
+            steps.append(str.strip)
+        if self.lower:
+            steps.append(str.lower)
+
+        checks = []
+        if self.min_length is not None:
+            min_length = self.min_length
+            checks.append(lambda value: len(value) >= min_length)
+        if self.check is not None:
+            checks.append(self.check)
+        required = self.required
+        max_length = self.max_length
+
+        def validate(value):
+            if value is None or value == '':
+                return None, required_message if required else None
+            if not isinstance(value, str):
+                return None, type_message
+            for step in steps:
+                value = step(value)
+            if not value:
+                return None, required_message if required else None
+            if max_length is not None and len(value) > max_length:
+                return None, too_long_message
+            for check in checks:
+                if not check(value):
+                    return None, invalid_message
+            return value, None
+
+        return validate
+
+
+class Schema:
+    """
+    Set of fields for one endpoint, compiled at construction
+
+    Unknown keys in the body are ignored.
+    """
+
+    def __init__(self, **fields):
+        self.fields = fields
+        self._validators = tuple((name, field.compile(name)) for name, field in fields.items())
+
+    def validate(self, data):
+        """
+        Normalise and check a decoded JSON body
+
+        Returns:
+            tuple: (clean_data, errors) where errors maps field -> message
+        """
+        clean = {}
+        errors = {}
+        for name, validate in self._validators:
+            value, error = validate(data.get(name))
+            if error is not None:
+                errors[name] = error
+            else:
+                clean[name] = value
+        return clean, errors
+
+
+def validate_json(schema):
+    """
+    Decorator validating the request body against a Schema
+
+    The view finds the normalised values in request.validated.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            data = request.get_json(silent=True)
+            if not isinstance(data, dict):
+                return jsonify({'error': 'Request body must be a JSON object'}), 400
+
+            clean, errors = schema.validate(data)
+            if errors:
+                return jsonify({'error': next(iter(errors.values())), 'errors': errors}), 400
+
+            request.validated = clean
+            return f(*args, **kwargs)
+
+        return decorated
+
+    return decorator
@@ -85,6 +85,7 @@ function App() {
         return (
           <OtpVerify
             accountNumber={accountNumber}
+            otpTicket={otpData?.otp_ticket}
             onVerifySuccess={handleVerifySuccess}
             onBack={backToLogin}
           />
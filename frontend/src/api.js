@@ -17,9 +17,11 @@ class APIClient {
    */
   getAuthHeaders() {
     const token = localStorage.getItem('token');
+    const writePosition = sessionStorage.getItem('dbWritePosition');
     return {
       'Content-Type': 'application/json',
-      ...(token && { Authorization: `Bearer ${token}` })
+      ...(token && { Authorization: `Bearer ${token}` }),
+      ...(writePosition && { 'X-DB-LSN': writePosition })
     };
   }
 
@@ -36,6 +38,13 @@ class APIClient {
 
     try {
       const response = await fetch(url, config);
+
+      // Database position of our last write; sent back so our reads
+      // never come from a read replica that has not caught up with it
+      const writePosition = response.headers.get('X-DB-LSN');
+      if (writePosition) {
+        sessionStorage.setItem('dbWritePosition', writePosition);
+      }
       const data = await response.json();
 
       if (!response.ok) {
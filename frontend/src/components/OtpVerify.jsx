@@ -1,8 +1,9 @@
 import React, { useState, useEffect } from 'react';
 import { authAPI, errorHandler, authUtils } from '../api';
 
-const OtpVerify = ({ accountNumber, onVerifySuccess, onBack }) => {
+const OtpVerify = ({ accountNumber, otpTicket, onVerifySuccess, onBack }) => {
   const [otp, setOtp] = useState(['', '', '', '', '', '']);
+  const [ticket, setTicket] = useState(otpTicket); // only issued in stateless OTP mode
   const [loading, setLoading] = useState(false);
   const [resendLoading, setResendLoading] = useState(false);
   const [error, setError] = useState('');
@@ -90,7 +91,8 @@ const OtpVerify = ({ accountNumber, onVerifySuccess, onBack }) => {
       // Verify OTP
       const response = await authAPI.verifyOTP({
         account_number: accountNumber,
-        otp: otpCode
+        otp: otpCode,
+        ...(ticket && { otp_ticket: ticket })
       });
 
       // Store authentication data
@@ -124,6 +126,7 @@ const OtpVerify = ({ accountNumber, onVerifySuccess, onBack }) => {
       const response = await authAPI.resendOTP(accountNumber);
       
       if (response.status === 'otp_sent') {
+        setTicket(response.otp_ticket);
         setSuccess('New OTP sent to your email!');
         setTimeLeft(120); // Reset timer
         setCanResend(false);